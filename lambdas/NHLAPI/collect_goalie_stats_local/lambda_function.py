@@ -1,41 +1,27 @@
-import boto3
 import json
-import requests
 import pandas as pd
 from io import StringIO
 import tqdm
+import logging
+from urllib.parse import urlencode
+from o2k_io import (get_s3_client, reset_s3_read_stats, get_s3_read_stats, configure_rate_limiter,
+                    get_rate_limiter_stats, configure_response_cache, get_cache_stats, get_cached_json,
+                    NEGATIVE_CACHE_TTL)
+from o2k_collectors import (reports_to_driver, get_session, append_records, build_dataframe, get_season_ids,
+                            order_by_nhl_ids, get_nhl_ids, get_refresh_plan, collect_stats_incrementally, save_collected_ids,
+                            new_checkpoint_state, get_checkpoint_state, delete_checkpoint, collect_stats_with_checkpoints,
+                            publish_stats_sink)
 
-def get_nhl_ids(bucket_name, prefix):
-    try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = json.loads(data)
-        
-        return {
-            "statusCode": 200,
-            "message": "NHL IDs retrieved successfully",
-            "body": data['nhl_ids']
-        }
-    except Exception as e:
-        return {
-            "statusCode": 404,
-            "message": "Could not retrieve NHL IDs",
-            "body": f"Could not retrieve NHL IDs: {e}"
-        }
 
 def get_goalie_stats(goalie_id):
     try:
         url = f"https://api.nhle.com/stats/rest/en/goalie/summary?limit=-1&cayenneExp=playerId={goalie_id}"
-        response = requests.get(url)
-        data = response.json()
+        data = get_cached_json(url, negative_ttl=NEGATIVE_CACHE_TTL)
         if data['total'] > 0:
-            data = data['data']
-            df = pd.DataFrame(data)
             return {
                 "statusCode": 200,
                 "message": "Goalie stats retrieved successfully",
-                "body": df
+                "body": data['data']
             }
         else:
             return {
@@ -43,6 +29,65 @@ def get_goalie_stats(goalie_id):
                 "message": "No goalie stats found",
                 "body": f"No goalie stats found for goalie {goalie_id}"
             }
+    except Exception as e:
+        # 500 marks a failed request, as opposed to a player without goalie stats
+        return {
+            "statusCode": 500,
+            "message": "Could not retrieve goalie stats",
+            "body": f"Could not retrieve goalie stats: {e}"
+        }
+
+def get_season_goalie_stats(season_id, page_size=-1, session=None):
+    try:
+        logging.info(f"Collecting goalie stats for season {season_id}")
+        rows = []
+        start = 0
+        while True:
+            params = {
+                "limit": page_size,
+                "start": start,
+                "sort": json.dumps([{"property": "playerId", "direction": "ASC"}]),
+                "cayenneExp": f"seasonId={season_id}"
+            }
+            url = f"https://api.nhle.com/stats/rest/en/goalie/summary?{urlencode(params)}"
+            data = get_cached_json(url, session)
+            rows.extend(data['data'])
+            start += len(data['data'])
+            if page_size < 0 or len(data['data']) == 0 or start >= data['total']:
+                break
+        return {
+            "statusCode": 200,
+            "message": "Season goalie stats retrieved successfully",
+            "body": rows
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve season goalie stats",
+            "body": f"Could not retrieve season goalie stats for season {season_id}: {e}"
+        }
+
+def collect_goalie_stats_by_season(goalie_ids, seasons, page_size=-1):
+    try:
+        logging.info(f"Collecting goalie stats for {len(seasons)} seasons")
+        session = get_session(1)
+        wanted_ids = set(goalie_ids)
+        columns = {}
+        for season_id in tqdm.tqdm(seasons):
+            season_stats = get_season_goalie_stats(season_id, page_size, session)
+            if season_stats['statusCode'] != 200:
+                # A missing season would silently drop rows for every goalie
+                session.close()
+                return season_stats
+            append_records(columns, [row for row in season_stats['body'] if row['playerId'] in wanted_ids])
+        session.close()
+
+        df = order_by_nhl_ids(build_dataframe(columns), goalie_ids)
+        return {
+            "statusCode": 200,
+            "message": "Goalie stats retrieved successfully",
+            "body": [df]
+        }
     except Exception as e:
         return {
             "statusCode": 404,
@@ -50,9 +95,25 @@ def get_goalie_stats(goalie_id):
             "body": f"Could not retrieve goalie stats: {e}"
         }
 
+def collect_goalie_stats_serially(goalie_ids):
+    columns = {}
+    failed_ids = []
+    for goalie_id in tqdm.tqdm(goalie_ids):
+        goalie_stats = get_goalie_stats(goalie_id)
+        if goalie_stats['statusCode'] == 200:
+            append_records(columns, goalie_stats['body'])
+        elif goalie_stats['statusCode'] == 500:
+            failed_ids.append(goalie_id)
+    return {
+        "statusCode": 200,
+        "message": "Goalie stats retrieved successfully",
+        "body": [build_dataframe(columns)] if columns else [],
+        "failed_ids": failed_ids
+    }
+
 def save_to_s3(data, bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}goalie_stats.csv"
         csv_buffer = StringIO()
         data.to_csv(csv_buffer, index=False)
@@ -70,22 +131,97 @@ def save_to_s3(data, bucket_name, prefix):
             "body": f"Could not save to S3: {e}"
         }
 
+@reports_to_driver
 def lambda_handler(event, context):
     try:
-        goalie_ids = get_nhl_ids(event['bucket_name'], event['nhl_ids_prefix'])
+        checkpoint_state = None
+        if event.get('continuation_token'):
+            checkpoint_state = get_checkpoint_state(event['player_stats_bucket_name'], event['player_stats_prefix'], event['continuation_token'])
+            if checkpoint_state['statusCode'] != 200:
+                return checkpoint_state
+            checkpoint_state = checkpoint_state['body']
+            goalie_ids = {"statusCode": 200, "body": checkpoint_state['nhl_ids']}
+        elif 'nhl_ids' in event:
+            # A shard of ids handed over by the fan-out driver
+            goalie_ids = {"statusCode": 200, "body": event['nhl_ids']}
+        else:
+            goalie_ids = get_nhl_ids(event['bucket_name'], event['nhl_ids_prefix'])
         if goalie_ids['statusCode'] == 200:
-            goalie_stats_list = []
-            for goalie_id in tqdm.tqdm(goalie_ids['body']):
-                goalie_stats = get_goalie_stats(goalie_id)
-                if goalie_stats['statusCode'] == 200:
-                    goalie_stats_list.append(goalie_stats['body'])
-            df = pd.concat(goalie_stats_list)
-            save_to_s3_response = save_to_s3(df, event['player_stats_bucket_name'], event['player_stats_prefix'])
+            configure_response_cache(event.get('cache_dir'))
+            configure_rate_limiter(event.get('requests_per_second', 10.0), event.get('max_retries', 5), event.get('retry_budget', 200))
+            reset_s3_read_stats()
+            refresh_plan = None
+            if checkpoint_state is None:
+                # Only full refreshes checkpoint, so a resumed run never needs the stored table
+                refresh_plan = get_refresh_plan(event, goalie_ids['body'], "goalie_stats")
+                if refresh_plan['unchanged']:
+                    return {
+                        "statusCode": 200,
+                        "message": "No new or removed NHL IDs",
+                        "body": "No new or removed NHL IDs, goalie stats left as they were",
+                        "failed_ids": []
+                    }
+
+            if refresh_plan is not None and refresh_plan['previous_stats'] is not None:
+                goalie_stats = collect_stats_incrementally(goalie_ids['body'], refresh_plan, get_season_goalie_stats, collect_goalie_stats_serially)
+            elif event.get('collection_mode', 'per_player') == 'season_bulk':
+                seasons = event.get('seasons') or get_season_ids(event.get('first_season', 2008))
+                goalie_stats = collect_goalie_stats_by_season(goalie_ids['body'], seasons, event.get('page_size', -1))
+            else:
+                checkpoint_state = checkpoint_state or new_checkpoint_state(goalie_ids['body'])
+                goalie_stats = collect_stats_with_checkpoints(checkpoint_state, event, context, collect_goalie_stats_serially)
+                if goalie_stats['statusCode'] == 202:
+                    goalie_stats['rate_limiter_stats'] = get_rate_limiter_stats()
+                    goalie_stats['s3_read_stats'] = get_s3_read_stats()
+                    return goalie_stats
+            if goalie_stats['statusCode'] != 200:
+                return goalie_stats
+            goalie_stats_list = goalie_stats['body']
+            failed_ids = goalie_stats.get('failed_ids', [])
+            if failed_ids:
+                logging.error(f"Could not retrieve goalie stats for {len(failed_ids)} ids: {failed_ids}")
+            if 'sink' in goalie_stats:
+                save_to_s3_response = publish_stats_sink(goalie_stats['sink'], event['player_stats_bucket_name'], f"{event['player_stats_prefix']}goalie_stats.csv")
+            elif goalie_stats_list:
+                df = pd.concat(goalie_stats_list)
+                save_to_s3_response = save_to_s3(df, event['player_stats_bucket_name'], event['player_stats_prefix'])
+            else:
+                save_to_s3_response = {
+                    "statusCode": 204,
+                    "message": "No goalie stats collected",
+                    "body": "No goalie stats collected"
+                }
+            if save_to_s3_response['statusCode'] == 204 and event.get('allow_empty', False):
+                # A fan-out shard without any goalies is an empty result, not a failure; nothing is written
+                if checkpoint_state is not None:
+                    delete_checkpoint(checkpoint_state, event['player_stats_bucket_name'], event['player_stats_prefix'])
+                return {
+                    "statusCode": 200,
+                    "message": "No goalie stats collected",
+                    "body": "No goalie stats collected",
+                    "empty": True,
+                    "failed_ids": failed_ids,
+                    "cache_stats": get_cache_stats(),
+                    "rate_limiter_stats": get_rate_limiter_stats(),
+                    "s3_read_stats": get_s3_read_stats()
+                }
             if save_to_s3_response['statusCode'] == 200:
+                # Failed ids are left out so the next incremental run retries them
+                failed = set(failed_ids)
+                save_collected_ids([goalie_id for goalie_id in goalie_ids['body'] if goalie_id not in failed], event['player_stats_bucket_name'], event['player_stats_prefix'], "goalie_stats")
+                if checkpoint_state is not None:
+                    delete_checkpoint(checkpoint_state, event['player_stats_bucket_name'], event['player_stats_prefix'])
+                cache_stats = get_cache_stats()
+                rate_limiter_stats = get_rate_limiter_stats()
+                logging.info(f"Response cache: {cache_stats}, rate limiter: {rate_limiter_stats}")
                 return {
                     "statusCode": 200,
                     "message": "Goalie stats saved to S3",
-                    "body": "Goalie stats saved to S3"
+                    "body": "Goalie stats saved to S3",
+                    "failed_ids": failed_ids,
+                    "cache_stats": cache_stats,
+                    "rate_limiter_stats": rate_limiter_stats,
+                    "s3_read_stats": get_s3_read_stats()
                 }
             else:
                 return {
@@ -111,11 +247,17 @@ def lambda_handler(event, context):
     
     
     
-event = {
-    "bucket_name": "puckpedia",
-    "player_stats_bucket_name": "nhlapi-data",
-    "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
-    "player_stats_prefix": "players/player_stats/"
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "player_stats_bucket_name": "nhlapi-data",
+        "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
+        "player_stats_prefix": "players/player_stats/",
+        "collection_mode": "per_player",
+        "first_season": 2008,
+        "incremental": False,
+        "cache_dir": "/tmp/nhlapi_cache",
+        "requests_per_second": 10.0
+    }
 
-print(lambda_handler(event, None))
\ No newline at end of file
+    print(lambda_handler(event, None))
\ No newline at end of file
@@ -1,19 +1,63 @@
 import requests
-import boto3
 import json
 import logging
+import io
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from o2k_io import (get_s3_client, read_s3_object, reset_s3_read_stats, get_s3_read_stats, PARQUET_COMPRESSION,
+                    configure_rate_limiter, get_rate_limiter_stats, configure_response_cache, get_cache_stats,
+                    get_cached_json, NEGATIVE_CACHE_TTL)
+from o2k_collectors import reports_to_driver
 
 
-def get_player_information(player_id):
+def get_session(max_workers):
+    # One keep-alive connection per worker so concurrent requests reuse sockets
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    return session
+
+def get_nhl_ids(bucket_name, prefix):
+    try:
+        data = read_s3_object(bucket_name, prefix, json.load)
+        return {
+            "statusCode": 200,
+            "message": "NHL IDs retrieved successfully",
+            "body": data['nhl_ids']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve NHL IDs",
+            "body": f"Could not retrieve NHL IDs: {e}"
+        }
+
+def get_nhl_id_changes(nhl_ids, collected_ids):
+    # Diffed against the players the stored table already covers rather than get_player_ids' latest diff,
+    # so ids that a failed run or a second get_player_ids run skipped past are still collected
+    current = set(nhl_ids)
+    return {
+        "new_ids": [nhl_id for nhl_id in nhl_ids if nhl_id not in collected_ids],
+        "removed_ids": sorted(nhl_id for nhl_id in collected_ids if nhl_id not in current)
+    }
+
+def get_player_information(player_id, session=None):
     try:
         logging.info(f"Getting player information for player {player_id}")
         url = f"https://api-web.nhle.com/v1/player/{player_id}/landing"
-        response = requests.get(url)
+        player_information = get_cached_json(url, session, NEGATIVE_CACHE_TTL)
+        if player_information is None:
+            return {
+                "statusCode": 404,
+                "message": "Could not get player information",
+                "body": f"No player information found for player {player_id}"
+            }
         logging.info(f"Player information retrieved successfully for player {player_id}")
         return {
             "statusCode": 200,
             "message": "Player information retrieved successfully",
-            "body": response.json()
+            "body": player_information
         }
     except Exception as e:
         logging.error(f"Could not get player information for player {player_id}: {e}")
@@ -26,7 +70,7 @@ def get_player_information(player_id):
 def save_to_s3(data, bucket_name, prefix, player_id):
     try:
         logging.info(f"Saving player information to S3 for player {data}")
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}{player_id}/player_information.json"
         s3.put_object(Bucket=bucket_name, Key=path, Body=json.dumps(data), ContentType='application/json')
         logging.info(f"Player information saved to S3 for player {player_id}")
@@ -66,10 +110,181 @@ def clean_player_information(player_information):
             "body": f"Could not clean player information: {e}"
         }
 
+PLAYER_INFORMATION_DTYPES = {
+    "playerId": "Int64",
+    "heightInInches": "Int64",
+    "heightInCentimeters": "Int64",
+    "weightInPounds": "Int64",
+    "weightInKilograms": "Int64",
+    "draftYear": "Int64",
+    "draftRound": "Int64",
+    "draftPickInRound": "Int64",
+    "draftOverallPick": "Int64"
+}
+
+def get_player_information_row(player_information):
+    draft_details = player_information.get('draftDetails') or {}
+    return {
+        "playerId": player_information.get('playerId'),
+        "firstName": (player_information.get('firstName') or {}).get('default'),
+        "lastName": (player_information.get('lastName') or {}).get('default'),
+        "birthDate": player_information.get('birthDate'),
+        "position": player_information.get('position'),
+        "shootsCatches": player_information.get('shootsCatches'),
+        "heightInInches": player_information.get('heightInInches'),
+        "heightInCentimeters": player_information.get('heightInCentimeters'),
+        "weightInPounds": player_information.get('weightInPounds'),
+        "weightInKilograms": player_information.get('weightInKilograms'),
+        "draftYear": draft_details.get('year'),
+        "draftTeamAbbrev": draft_details.get('teamAbbrev'),
+        "draftRound": draft_details.get('round'),
+        "draftPickInRound": draft_details.get('pickInRound'),
+        "draftOverallPick": draft_details.get('overallPick')
+    }
+
+def build_player_information_table(player_information_list):
+    df = pd.DataFrame([get_player_information_row(player_information) for player_information in player_information_list], columns=list(get_player_information_row({}).keys()))
+    df = df.astype(PLAYER_INFORMATION_DTYPES)
+    df['birthDate'] = pd.to_datetime(df['birthDate'], errors='coerce')
+    return df.sort_values('playerId', kind='stable').reset_index(drop=True)
+
+def save_player_information_table(data, bucket_name, key):
+    try:
+        logging.info(f"Saving player information table to S3 for {len(data)} players")
+        s3 = get_s3_client()
+        buffer = io.BytesIO()
+        if key.endswith('.csv'):
+            buffer.write(data.to_csv(index=False).encode('utf-8'))
+            content_type = 'text/csv'
+        else:
+            data.to_parquet(buffer, index=False, compression=PARQUET_COMPRESSION)
+            content_type = 'application/octet-stream'
+        s3.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue(), ContentType=content_type)
+        return {
+            "statusCode": 200,
+            "message": "Player information table saved to S3",
+            "body": f"Saved to S3: {key}"
+        }
+    except Exception as e:
+        logging.error(f"Could not save player information table to S3: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save player information table to S3",
+            "body": f"Could not save player information table to S3: {e}"
+        }
+
+def get_player_information_table(bucket_name, key):
+    try:
+        buffer = read_s3_object(bucket_name, key, lambda body: io.BytesIO(body.read()))
+        if key.endswith('.csv'):
+            data = pd.read_csv(buffer).astype(PLAYER_INFORMATION_DTYPES)
+            data['birthDate'] = pd.to_datetime(data['birthDate'], errors='coerce')
+        else:
+            data = pd.read_parquet(buffer)
+        return {
+            "statusCode": 200,
+            "message": "Player information table retrieved successfully",
+            "body": data
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve player information table",
+            "body": f"Could not retrieve player information table: {e}"
+        }
+
+def upsert_player_information_table(previous_table, fresh_table, removed_ids):
+    stale_ids = set(removed_ids) | set(fresh_table['playerId'].dropna().tolist())
+    table = pd.concat([previous_table[~previous_table['playerId'].isin(stale_ids)], fresh_table], ignore_index=True)
+    return table.sort_values('playerId', kind='stable').reset_index(drop=True)
+
+def collect_player_information_bulk(event):
+    try:
+        if 'player_ids' in event:
+            player_ids = event['player_ids']
+        else:
+            player_ids = get_nhl_ids(event['nhl_ids_bucket_name'], event['nhl_ids_prefix'])
+            if player_ids['statusCode'] != 200:
+                return player_ids
+            player_ids = player_ids['body']
+        key = event.get('table_key', f"{event['prefix']}player_information.parquet")
+
+        previous_table = None
+        removed_ids = []
+        if event.get('only_new_ids', False) and 'player_ids' not in event:
+            previous_table = get_player_information_table(event['bucket_name'], key)
+            if previous_table['statusCode'] != 200:
+                logging.warning(f"No previous player information table, collecting every player: {previous_table['body']}")
+                previous_table = None
+            else:
+                previous_table = previous_table['body']
+                changes = get_nhl_id_changes(player_ids, set(previous_table['playerId'].dropna().astype(int).tolist()))
+                if not changes['new_ids'] and not changes['removed_ids']:
+                    return {
+                        "statusCode": 200,
+                        "message": "No new or removed NHL IDs",
+                        "body": "No new or removed NHL IDs, player information left as it was",
+                        "failed_ids": []
+                    }
+                player_ids = changes['new_ids']
+                removed_ids = changes['removed_ids']
+        max_workers = event.get('max_workers', 8)
+        logging.info(f"Collecting player information for {len(player_ids)} players with {max_workers} workers")
+
+        session = get_session(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda player_id: get_player_information(player_id, session), player_ids))
+        session.close()
+
+        cleaned_player_information_list = []
+        failed_ids = []
+        for player_id, player_information in zip(player_ids, results):
+            if player_information['statusCode'] == 200:
+                cleaned_player_information = clean_player_information(player_information['body'])
+                if cleaned_player_information['statusCode'] == 200:
+                    cleaned_player_information_list.append(cleaned_player_information['body'])
+                    if event.get('write_player_json', False):
+                        save_to_s3(cleaned_player_information['body'], event['bucket_name'], event['prefix'], player_id)
+                    continue
+            failed_ids.append(player_id)
+
+        table = build_player_information_table(cleaned_player_information_list)
+        if previous_table is not None:
+            table = upsert_player_information_table(previous_table, table, removed_ids)
+        response = save_player_information_table(table, event['bucket_name'], key)
+        if response['statusCode'] != 200:
+            return response
+        return {
+            "statusCode": 200,
+            "message": "Player information collected successfully",
+            "body": f"Player information collected for {len(table)} players",
+            "failed_ids": failed_ids,
+            "cache_stats": get_cache_stats(),
+            "rate_limiter_stats": get_rate_limiter_stats(),
+            "s3_read_stats": get_s3_read_stats()
+        }
+    except Exception as e:
+        logging.error(f"Could not collect player information: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not collect player information",
+            "body": f"Could not collect player information: {e}"
+        }
+
+@reports_to_driver
 def lambda_handler(event, context):
     try:
+        if 'player_id' not in event:
+            # Bulk mode: a list of player_ids or the nhl_ids.json key
+            configure_response_cache(event.get('cache_dir'))
+            configure_rate_limiter(event.get('requests_per_second', 10.0), event.get('max_retries', 5), event.get('retry_budget', 200))
+            reset_s3_read_stats()
+            return collect_player_information_bulk(event)
      
         logging.info(f"Collecting player information for player {event['player_id']}")
+        configure_response_cache(event.get('cache_dir'))
+        configure_rate_limiter(event.get('requests_per_second', 10.0), event.get('max_retries', 5), event.get('retry_budget', 200))
+        reset_s3_read_stats()
         player_information = get_player_information(event['player_id'])
     
         if player_information['statusCode'] == 200:
@@ -80,7 +295,10 @@ def lambda_handler(event, context):
                     return {
                         "statusCode": 200,
                         "message": "Player information collected successfully",
-                        "body": "Player information collected successfully"
+                        "body": "Player information collected successfully",
+                        "cache_stats": get_cache_stats(),
+                        "rate_limiter_stats": get_rate_limiter_stats(),
+                        "s3_read_stats": get_s3_read_stats()
                     }
                 else:
                     return {
@@ -111,23 +329,20 @@ def lambda_handler(event, context):
         }
 
 
-
-
-
-
-
-
-
-
-
-
 # event = {
 #     "bucket_name": "nhlapi-data",
 #     "prefix": "players/player_info/",
 #     "player_id": 8470594
 # }
 
-
+# event = {
+#     "bucket_name": "nhlapi-data",
+#     "prefix": "players/player_info/",
+#     "nhl_ids_bucket_name": "puckpedia",
+#     "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
+#     "max_workers": 8,
+#     "write_player_json": False
+# }
 
 
 # print(lambda_handler(event, None))
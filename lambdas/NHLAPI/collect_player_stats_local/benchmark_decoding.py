@@ -0,0 +1,82 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import pandas as pd
+import requests
+
+from o2k_io import decode_json
+from o2k_collectors import append_records, build_dataframe
+
+
+def record_payloads(nhl_ids_path, payload_dir, limit):
+    os.makedirs(payload_dir, exist_ok=True)
+    with open(nhl_ids_path, 'r') as f:
+        nhl_ids = json.load(f)['nhl_ids'][:limit]
+    session = requests.Session()
+    for player_id in nhl_ids:
+        url = f"https://api.nhle.com/stats/rest/en/skater/summary?limit=-1&cayenneExp=playerId={player_id}"
+        response = session.get(url, timeout=30)
+        with open(os.path.join(payload_dir, f"{player_id}.json"), 'wb') as f:
+            f.write(response.content)
+    print(f"Recorded {len(nhl_ids)} payloads to {payload_dir}")
+
+
+def parse_current(payloads):
+    # response.json() followed by one DataFrame per player and a final concat
+    player_stats_list = []
+    for payload in payloads:
+        data = json.loads(payload)
+        if data['total'] > 0:
+            player_stats_list.append(pd.DataFrame(data['data']))
+    return pd.concat(player_stats_list)
+
+
+def parse_columnar(payloads):
+    columns = {}
+    for payload in payloads:
+        data = decode_json(payload)
+        if data['total'] > 0:
+            append_records(columns, data['data'])
+    return build_dataframe(columns)
+
+
+def run_benchmark(payload_dir, repeat):
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(payload_dir, "*.json"))):
+        with open(path, 'rb') as f:
+            payloads.append(f.read())
+    print(f"{len(payloads)} payloads, {sum(len(payload) for payload in payloads) / 1e6:.1f} MB")
+
+    current = parse_current(payloads)
+    columnar = parse_columnar(payloads)
+    if current.reset_index(drop=True).to_csv(index=False) != columnar.to_csv(index=False):
+        raise AssertionError("Columnar path does not produce the same CSV as the current path")
+
+    for name, parse in [("current", parse_current), ("columnar", parse_columnar)]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse(payloads)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:>9}: best {min(timings) * 1000:.1f} ms, mean {sum(timings) / len(timings) * 1000:.1f} ms over {repeat} runs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-player DataFrame path against the columnar decode path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="Save raw skater summary payloads for offline runs")
+    record_parser.add_argument("nhl_ids_path")
+    record_parser.add_argument("payload_dir")
+    record_parser.add_argument("--limit", type=int, default=500)
+    run_parser = subparsers.add_parser("run", help="Time both parse paths on recorded payloads")
+    run_parser.add_argument("payload_dir")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_payloads(args.nhl_ids_path, args.payload_dir, args.limit)
+    else:
+        run_benchmark(args.payload_dir, args.repeat)
@@ -1,26 +1,31 @@
 import sys
-import os
-import requests
 import logging
-import boto3
 import json
 import pandas as pd
 import tqdm
+import time
+from urllib.parse import urlencode
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from o2k_io import (get_s3_client, reset_s3_read_stats, get_s3_read_stats, configure_rate_limiter,
+                    get_rate_limiter_stats, configure_response_cache, get_cache_stats, get_cached_json,
+                    NEGATIVE_CACHE_TTL)
+from o2k_collectors import (reports_to_driver, get_session, append_records, build_dataframe, get_season_ids,
+                            order_by_nhl_ids, get_nhl_ids, get_refresh_plan, collect_stats_incrementally, save_collected_ids,
+                            new_checkpoint_state, get_checkpoint_state, delete_checkpoint, collect_stats_with_checkpoints,
+                            publish_stats_sink)
 
-def get_player_stats(player_id):
+
+def get_player_stats(player_id, session=None):
     try:
         logging.info(f"Collecting player stats for player {player_id}")
         url = f"https://api.nhle.com/stats/rest/en/skater/summary?limit=-1&cayenneExp=playerId={player_id}"
-        response = requests.get(url)
-        data = response.json()
+        data = get_cached_json(url, session, NEGATIVE_CACHE_TTL)
         if data['total'] > 0:
-            data = data['data']
-            df = pd.DataFrame(data)
             return {
                 "statusCode": 200,
                 "message": "Player stats collected successfully",
-                "body": df
+                "body": data['data']
             }
         else:
             return {
@@ -30,35 +35,124 @@ def get_player_stats(player_id):
             }
         
     except Exception as e:  
+        # 500 marks a failed request, as opposed to a player without stats
+        return {
+            "statusCode": 500,
+            "message": "Could not collect player stats",
+            "body": f"Could not collect player stats: {e}"
+        }
+
+def get_season_player_stats(season_id, page_size=-1, session=None):
+    try:
+        logging.info(f"Collecting player stats for season {season_id}")
+        rows = []
+        start = 0
+        while True:
+            params = {
+                "limit": page_size,
+                "start": start,
+                "sort": json.dumps([{"property": "playerId", "direction": "ASC"}]),
+                "cayenneExp": f"seasonId={season_id}"
+            }
+            url = f"https://api.nhle.com/stats/rest/en/skater/summary?{urlencode(params)}"
+            data = get_cached_json(url, session)
+            rows.extend(data['data'])
+            start += len(data['data'])
+            if page_size < 0 or len(data['data']) == 0 or start >= data['total']:
+                break
+        return {
+            "statusCode": 200,
+            "message": "Season player stats collected successfully",
+            "body": rows
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not collect season player stats",
+            "body": f"Could not collect season player stats for season {season_id}: {e}"
+        }
+
+def collect_player_stats_by_season(nhl_ids, seasons, page_size=-1):
+    try:
+        logging.info(f"Collecting player stats for {len(seasons)} seasons")
+        session = get_session(1)
+        wanted_ids = set(nhl_ids)
+        columns = {}
+        for season_id in tqdm.tqdm(seasons):
+            season_stats = get_season_player_stats(season_id, page_size, session)
+            if season_stats['statusCode'] != 200:
+                # A missing season would silently drop rows for every player
+                session.close()
+                return season_stats
+            append_records(columns, [row for row in season_stats['body'] if row['playerId'] in wanted_ids])
+        session.close()
+
+        df = order_by_nhl_ids(build_dataframe(columns), nhl_ids)
+        return {
+            "statusCode": 200,
+            "message": "Player stats collected successfully",
+            "body": [df]
+        }
+    except Exception as e:
         return {
             "statusCode": 404,
             "message": "Could not collect player stats",
             "body": f"Could not collect player stats: {e}"
         }
-        
-def get_nhl_ids(bucket_name, prefix):
+
+def collect_player_stats_serially(nhl_ids):
+    columns = {}
+    failed_ids = []
+    for player_id in tqdm.tqdm(nhl_ids):
+        player_stats = get_player_stats(player_id)
+        if player_stats['statusCode'] == 200:
+            append_records(columns, player_stats['body'])
+        elif player_stats['statusCode'] == 500:
+            failed_ids.append(player_id)
+    return {
+        "statusCode": 200,
+        "message": "Player stats collected successfully",
+        "body": [build_dataframe(columns)] if columns else [],
+        "failed_ids": failed_ids
+    }
+
+def collect_player_stats_concurrently(nhl_ids, max_workers):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = json.loads(data)
-        
+        logging.info(f"Collecting player stats for {len(nhl_ids)} players with {max_workers} workers")
+        start = time.perf_counter()
+        session = get_session(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps the nhl_ids order so the output matches the serial path
+            results = list(tqdm.tqdm(executor.map(lambda player_id: get_player_stats(player_id, session), nhl_ids), total=len(nhl_ids)))
+        session.close()
+        columns = {}
+        for result in results:
+            if result['statusCode'] == 200:
+                append_records(columns, result['body'])
+        failed_ids = [player_id for player_id, result in zip(nhl_ids, results) if result['statusCode'] == 500]
+        elapsed = time.perf_counter() - start
+        logging.info(f"Collected player stats for {len(nhl_ids)} players in {elapsed:.1f}s ({len(nhl_ids) / max(elapsed, 1e-9):.1f} players/s)")
         return {
             "statusCode": 200,
-            "message": "NHL IDs retrieved successfully",
-            "body": data['nhl_ids']
+            "message": "Player stats collected successfully",
+            "body": [build_dataframe(columns)] if columns else [],
+            "failed_ids": failed_ids
         }
     except Exception as e:
         return {
             "statusCode": 404,
-            "message": "Could not retrieve NHL IDs",
-            "body": f"Could not retrieve NHL IDs: {e}"
+            "message": "Could not collect player stats",
+            "body": f"Could not collect player stats: {e}"
         }
 
+def collect_player_stats(nhl_ids, max_workers=1):
+    if max_workers > 1:
+        return collect_player_stats_concurrently(nhl_ids, max_workers)
+    return collect_player_stats_serially(nhl_ids)
 
 def save_to_s3(data, bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}player_stats.csv"
         csv_buffer = StringIO()
         data.to_csv(csv_buffer, index=False)
@@ -76,25 +170,101 @@ def save_to_s3(data, bucket_name, prefix):
             "body": f"Could not save to S3: {e}"
         }
 
+@reports_to_driver
 def lambda_handler(event, context):
     try:
-        nhl_ids = get_nhl_ids(event['bucket_name'], event['nhl_ids_prefix'])
+        checkpoint_state = None
+        if event.get('continuation_token'):
+            checkpoint_state = get_checkpoint_state(event['player_stats_bucket_name'], event['player_stats_prefix'], event['continuation_token'])
+            if checkpoint_state['statusCode'] != 200:
+                return checkpoint_state
+            checkpoint_state = checkpoint_state['body']
+            nhl_ids = {"statusCode": 200, "body": checkpoint_state['nhl_ids']}
+        elif 'nhl_ids' in event:
+            # A shard of ids handed over by the fan-out driver
+            nhl_ids = {"statusCode": 200, "body": event['nhl_ids']}
+        else:
+            nhl_ids = get_nhl_ids(event['bucket_name'], event['nhl_ids_prefix'])
         if nhl_ids['statusCode'] == 200:
             nhl_ids = nhl_ids['body']
-            player_stats_list = []
-          
-            for player_id in tqdm.tqdm(nhl_ids):
-                player_stats = get_player_stats(player_id)
-                if player_stats['statusCode'] == 200:
-                    player_stats_list.append(player_stats['body'])
+            max_workers = event.get('max_workers', 1)
+            configure_response_cache(event.get('cache_dir'))
+            configure_rate_limiter(event.get('requests_per_second', 10.0), event.get('max_retries', 5), event.get('retry_budget', 200))
+            reset_s3_read_stats()
+
+            refresh_plan = None
+            if checkpoint_state is None:
+                # Only full refreshes checkpoint, so a resumed run never needs the stored table
+                refresh_plan = get_refresh_plan(event, nhl_ids, "player_stats")
+                if refresh_plan['unchanged']:
+                    return {
+                        "statusCode": 200,
+                        "message": "No new or removed NHL IDs",
+                        "body": "No new or removed NHL IDs, player stats left as they were",
+                        "failed_ids": []
+                    }
+
+            if refresh_plan is not None and refresh_plan['previous_stats'] is not None:
+                player_stats = collect_stats_incrementally(nhl_ids, refresh_plan, get_season_player_stats, lambda ids: collect_player_stats(ids, max_workers))
+            elif event.get('collection_mode', 'per_player') == 'season_bulk':
+                seasons = event.get('seasons') or get_season_ids(event.get('first_season', 2008))
+                player_stats = collect_player_stats_by_season(nhl_ids, seasons, event.get('page_size', -1))
+            else:
+                checkpoint_state = checkpoint_state or new_checkpoint_state(nhl_ids)
+                player_stats = collect_stats_with_checkpoints(checkpoint_state, event, context, lambda ids: collect_player_stats(ids, max_workers))
+                if player_stats['statusCode'] == 202:
+                    player_stats['rate_limiter_stats'] = get_rate_limiter_stats()
+                    player_stats['s3_read_stats'] = get_s3_read_stats()
+                    return player_stats
+            if player_stats['statusCode'] != 200:
+                return player_stats
+            player_stats_list = player_stats['body']
+            failed_ids = player_stats.get('failed_ids', [])
+            if failed_ids:
+                logging.error(f"Could not collect player stats for {len(failed_ids)} players: {failed_ids}")
                 
-            df = pd.concat(player_stats_list)
-            save_to_s3_response = save_to_s3(df, event['player_stats_bucket_name'], event['player_stats_prefix'])
+            if 'sink' in player_stats:
+                save_to_s3_response = publish_stats_sink(player_stats['sink'], event['player_stats_bucket_name'], f"{event['player_stats_prefix']}player_stats.csv")
+            elif player_stats_list:
+                df = pd.concat(player_stats_list)
+                save_to_s3_response = save_to_s3(df, event['player_stats_bucket_name'], event['player_stats_prefix'])
+            else:
+                save_to_s3_response = {
+                    "statusCode": 204,
+                    "message": "No player stats collected",
+                    "body": "No player stats collected"
+                }
+            if save_to_s3_response['statusCode'] == 204 and event.get('allow_empty', False):
+                # A fan-out shard without any players is an empty result, not a failure; nothing is written
+                if checkpoint_state is not None:
+                    delete_checkpoint(checkpoint_state, event['player_stats_bucket_name'], event['player_stats_prefix'])
+                return {
+                    "statusCode": 200,
+                    "message": "No player stats collected",
+                    "body": "No player stats collected",
+                    "empty": True,
+                    "failed_ids": failed_ids,
+                    "cache_stats": get_cache_stats(),
+                    "rate_limiter_stats": get_rate_limiter_stats(),
+                    "s3_read_stats": get_s3_read_stats()
+                }
             if save_to_s3_response['statusCode'] == 200:
+                # Failed players are left out so the next incremental run retries them
+                failed = set(failed_ids)
+                save_collected_ids([player_id for player_id in nhl_ids if player_id not in failed], event['player_stats_bucket_name'], event['player_stats_prefix'], "player_stats")
+                if checkpoint_state is not None:
+                    delete_checkpoint(checkpoint_state, event['player_stats_bucket_name'], event['player_stats_prefix'])
+                cache_stats = get_cache_stats()
+                rate_limiter_stats = get_rate_limiter_stats()
+                logging.info(f"Response cache: {cache_stats}, rate limiter: {rate_limiter_stats}")
                 return {
                     "statusCode": 200,
                     "message": "Player stats collected successfully",
-                    "body": "Player stats collected successfully"
+                    "body": "Player stats collected successfully",
+                    "failed_ids": failed_ids,
+                    "cache_stats": cache_stats,
+                    "rate_limiter_stats": rate_limiter_stats,
+                    "s3_read_stats": get_s3_read_stats()
                 }
             else:
                 return {
@@ -117,10 +287,17 @@ def lambda_handler(event, context):
         
         
 
-event = {
-    "bucket_name": "puckpedia",
-    "player_stats_bucket_name": "nhlapi-data",
-    "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
-    "player_stats_prefix": "players/player_stats/"
-}
-print(lambda_handler(event, None))
\ No newline at end of file
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "player_stats_bucket_name": "nhlapi-data",
+        "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
+        "player_stats_prefix": "players/player_stats/",
+        "max_workers": 1,
+        "collection_mode": "per_player",
+        "first_season": 2008,
+        "incremental": False,
+        "cache_dir": "/tmp/nhlapi_cache",
+        "requests_per_second": 10.0
+    }
+    print(lambda_handler(event, None))
\ No newline at end of file
@@ -0,0 +1,425 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import importlib.util
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from o2k_io import get_s3_client, read_s3_object, PARQUET_COMPRESSION
+from o2k_collectors import get_lambda_client, get_stalled_response
+
+
+# Collectors the driver can fan out. "directory" is the sibling folder used by the local backend,
+# "function_name" is the deployed Lambda used by the lambda backend.
+COLLECTORS = {
+    "player_stats": {
+        "directory": "collect_player_stats_local",
+        "function_name": "collect_player_stats",
+        "output": "player_stats.csv",
+        "ids_output": "player_stats_ids.json"
+    },
+    "goalie_stats": {
+        "directory": "collect_goalie_stats_local",
+        "function_name": "collect_goalie_stats",
+        "output": "goalie_stats.csv",
+        "ids_output": "goalie_stats_ids.json"
+    },
+    "player_information": {
+        "directory": "collect_player_information",
+        "function_name": "collect_player_information",
+        "output": "player_information.parquet",
+        "ids_output": None
+    }
+}
+
+def get_nhl_ids(bucket_name, prefix):
+    try:
+        data = read_s3_object(bucket_name, prefix, json.load)
+
+        return {
+            "statusCode": 200,
+            "message": "NHL IDs retrieved successfully",
+            "body": data['nhl_ids']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve NHL IDs",
+            "body": f"Could not retrieve NHL IDs: {e}"
+        }
+
+def shard_ids(nhl_ids, shard_count):
+    # Contiguous slices, so concatenating the shard outputs in shard order keeps the order of nhl_ids.json
+    if not nhl_ids:
+        return []
+    shard_count = max(1, min(shard_count, len(nhl_ids)))
+    shard_size = -(-len(nhl_ids) // shard_count)
+    return [nhl_ids[start:start + shard_size] for start in range(0, len(nhl_ids), shard_size)]
+
+def get_shard_prefix(prefix, run_id, shard_index):
+    return f"{prefix}shards/{run_id}/shard-{shard_index:04d}/"
+
+def get_result_key(prefix, run_id, shard_index):
+    # Asynchronous workers leave their final response here for the driver
+    return f"{get_shard_prefix(prefix, run_id, shard_index)}result.json"
+
+def get_run_state_key(prefix, run_id):
+    return f"{prefix}shards/{run_id}/run.json"
+
+def build_worker_events(collector, event, shards, run_id, report=False):
+    worker_event = dict(event.get('worker_event', {}))
+    if 'total_requests_per_second' in event:
+        # Every worker has its own rate limiter, so split the overall budget between them
+        worker_event['requests_per_second'] = event['total_requests_per_second'] / len(shards)
+
+    worker_events = []
+    for shard_index, shard in enumerate(shards):
+        shard_prefix = get_shard_prefix(event['output_prefix'], run_id, shard_index)
+        if collector == "player_information":
+            worker_events.append({
+                **worker_event,
+                "player_ids": shard,
+                "bucket_name": event['output_bucket_name'],
+                "prefix": event['output_prefix'],
+                "table_key": f"{shard_prefix}{COLLECTORS[collector]['output']}"
+            })
+        else:
+            worker_events.append({
+                **worker_event,
+                "nhl_ids": shard,
+                "player_stats_bucket_name": event['output_bucket_name'],
+                "player_stats_prefix": shard_prefix,
+                "allow_empty": True
+            })
+        if report:
+            worker_events[-1]['result_bucket_name'] = event['output_bucket_name']
+            worker_events[-1]['result_key'] = get_result_key(event['output_prefix'], run_id, shard_index)
+    return worker_events
+
+def load_collector(directory):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", directory, "lambda_function.py")
+    spec = importlib.util.spec_from_file_location(f"{directory}_lambda_function", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_local_worker(directory, worker_event):
+    # Runs in a child process: each worker gets its own module state (rate limiter, cache counters)
+    collector = load_collector(directory)
+    response = collector.lambda_handler(worker_event, None)
+    next_index = 0
+    while response.get('statusCode') == 202:
+        stalled = get_stalled_response(next_index, response)
+        if stalled is not None:
+            return stalled
+        next_index = response.get('next_index', next_index)
+        response = collector.lambda_handler({**worker_event, "continuation_token": response['continuation_token']}, None)
+    return response
+
+def start_lambda_workers(function_name, worker_events):
+    # Fire and forget: each worker checkpoints and re-invokes itself, then writes its result_key,
+    # so neither the read timeout nor the driver's own time limit bounds how long a shard can run
+    lambda_client = get_lambda_client()
+    for worker_event in worker_events:
+        lambda_client.invoke(FunctionName=function_name, InvocationType='Event', Payload=json.dumps(worker_event))
+
+def save_run_state(bucket_name, prefix, state):
+    s3 = get_s3_client()
+    s3.put_object(Bucket=bucket_name, Key=get_run_state_key(prefix, state['run_id']), Body=json.dumps(state), ContentType='application/json')
+
+def get_run_state(bucket_name, prefix, run_id):
+    try:
+        state = read_s3_object(bucket_name, get_run_state_key(prefix, run_id), json.load)
+        return {
+            "statusCode": 200,
+            "message": "Run state retrieved successfully",
+            "body": state
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve run state",
+            "body": f"Could not retrieve run state for run {run_id}: {e}"
+        }
+
+def get_worker_results(bucket_name, prefix, run_id, shard_count):
+    # None marks a shard whose worker has not reported yet
+    s3 = get_s3_client()
+    results = []
+    for shard_index in range(shard_count):
+        try:
+            results.append(read_s3_object(bucket_name, get_result_key(prefix, run_id, shard_index), json.load))
+        except s3.exceptions.NoSuchKey:
+            results.append(None)
+    return results
+
+def timed(worker, *args):
+    started = time.perf_counter()
+    response = worker(*args)
+    response['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return response
+
+def run_local_shards(collector, worker_events):
+    directory = COLLECTORS[collector]['directory']
+    with ProcessPoolExecutor(max_workers=len(worker_events)) as executor:
+        futures = [executor.submit(timed, run_local_worker, directory, worker_event) for worker_event in worker_events]
+
+    responses = []
+    for future in futures:
+        try:
+            responses.append(future.result())
+        except Exception as e:
+            responses.append({
+                "statusCode": 500,
+                "message": "Worker failed",
+                "body": f"Worker failed: {e}"
+            })
+    return responses
+
+def copy_csv_shard(s3, bucket_name, key, combined, header):
+    # Streams one shard into the combined file and drops its header; returns the header of the first shard
+    body = s3.get_object(Bucket=bucket_name, Key=key)['Body']
+    pending = b""
+    for chunk in body.iter_chunks(1 << 20):
+        if pending is not None:
+            pending += chunk
+            newline = pending.find(b"\n")
+            if newline == -1:
+                continue
+            shard_header, chunk = pending[:newline + 1], pending[newline + 1:]
+            pending = None
+            if header is None:
+                header = shard_header
+                combined.write(header)
+            elif shard_header != header:
+                # Bytes can only be appended under the same columns
+                raise ValueError(f"{key} does not have the same columns as the first shard")
+        combined.write(chunk)
+    return header
+
+def copy_parquet_shards(s3, bucket_name, shard_keys, combined_path, directory):
+    paths = []
+    for index, key in enumerate(shard_keys):
+        paths.append(os.path.join(directory, f"shard-{index:04d}.parquet"))
+        s3.download_file(bucket_name, key, paths[-1])
+    # Shards can miss columns no player in them had, so every row group is aligned to the union of the shard schemas
+    schema = pa.unify_schemas([pq.read_schema(path) for path in paths])
+    with pq.ParquetWriter(combined_path, schema, compression=PARQUET_COMPRESSION) as writer:
+        for path in paths:
+            shard = pq.ParquetFile(path)
+            for row_group in range(shard.num_row_groups):
+                table = shard.read_row_group(row_group)
+                writer.write_table(pa.Table.from_arrays(
+                    [table.column(field.name).cast(field.type) if field.name in table.column_names else pa.nulls(len(table), field.type) for field in schema],
+                    schema=schema
+                ))
+            os.remove(path)
+
+def merge_shard_outputs(bucket_name, shard_keys, key):
+    # Shards are copied through a temp file one chunk or row group at a time, so the driver never holds a whole shard
+    directory = tempfile.mkdtemp()
+    combined_path = os.path.join(directory, os.path.basename(key))
+    try:
+        s3 = get_s3_client()
+        if key.endswith('.csv'):
+            header = None
+            with open(combined_path, 'wb') as combined:
+                for shard_key in shard_keys:
+                    header = copy_csv_shard(s3, bucket_name, shard_key, combined, header)
+        else:
+            copy_parquet_shards(s3, bucket_name, shard_keys, combined_path, directory)
+        s3.upload_file(combined_path, bucket_name, key)
+        return {
+            "statusCode": 200,
+            "message": "Shard outputs merged",
+            "body": f"Merged {len(shard_keys)} shards into {key}"
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not merge shard outputs",
+            "body": f"Could not merge shard outputs: {e}"
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def save_collected_ids(nhl_ids, bucket_name, key):
+    try:
+        s3 = get_s3_client()
+        s3.put_object(Bucket=bucket_name, Key=key, Body=json.dumps({"nhl_ids": nhl_ids}), ContentType='application/json')
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": "Saved to S3"
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
+def delete_shard_outputs(bucket_name, prefix, run_id):
+    try:
+        s3 = get_s3_client()
+        shards_prefix = f"{prefix}shards/{run_id}/"
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=shards_prefix):
+            keys = [{"Key": item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                s3.delete_objects(Bucket=bucket_name, Delete={"Objects": keys})
+    except Exception as e:
+        logging.warning(f"Could not delete shard outputs under {prefix}shards/{run_id}/: {e}")
+
+def finish_run(collector, event, run_id, nhl_ids, shards, responses, started_at):
+    shard_summaries = [
+        {"shard": shard_index, "ids": len(shard), "statusCode": response.get('statusCode'), "empty": response.get('empty', False), "elapsed_seconds": response.get('elapsed_seconds')}
+        for shard_index, (shard, response) in enumerate(zip(shards, responses))
+    ]
+    failed_shards = [shard_index for shard_index, response in enumerate(responses) if response.get('statusCode') != 200]
+    if failed_shards:
+        # Never publish a partial merge; the shard outputs stay in place for inspection
+        for shard_index in failed_shards:
+            logging.error(f"Shard {shard_index} failed: {responses[shard_index].get('body')}")
+        return {
+            "statusCode": 500,
+            "message": "Some shards failed",
+            "body": f"Shards {failed_shards} failed, nothing was merged",
+            "shards": shard_summaries
+        }
+
+    output = COLLECTORS[collector]['output']
+    bucket_name = event['output_bucket_name']
+    # Empty shards wrote nothing and are left out of the merge
+    shard_keys = [
+        f"{get_shard_prefix(event['output_prefix'], run_id, shard_index)}{output}"
+        for shard_index, response in enumerate(responses) if not response.get('empty', False)
+    ]
+    if not shard_keys:
+        return {
+            "statusCode": 404,
+            "message": f"No {collector} collected",
+            "body": f"None of the {len(shards)} shards collected any rows",
+            "shards": shard_summaries
+        }
+    merged = merge_shard_outputs(bucket_name, shard_keys, f"{event['output_prefix']}{output}")
+    if merged['statusCode'] != 200:
+        return merged
+
+    failed_ids = [player_id for response in responses for player_id in response.get('failed_ids', [])]
+    if COLLECTORS[collector]['ids_output']:
+        failed = set(failed_ids)
+        save_collected_ids([player_id for player_id in nhl_ids if player_id not in failed], bucket_name, f"{event['output_prefix']}{COLLECTORS[collector]['ids_output']}")
+    delete_shard_outputs(bucket_name, event['output_prefix'], run_id)
+
+    return {
+        "statusCode": 200,
+        "message": f"{collector} collected successfully",
+        "body": merged['body'],
+        "failed_ids": failed_ids,
+        "shards": shard_summaries,
+        "elapsed_seconds": round(time.time() - started_at, 3)
+    }
+
+def start_lambda_run(collector, event, run_id, nhl_ids, shards):
+    state = {"run_id": run_id, "collector": collector, "nhl_ids": nhl_ids, "shards": shards, "started_at": time.time()}
+    save_run_state(event['output_bucket_name'], event['output_prefix'], state)
+    worker_events = build_worker_events(collector, event, shards, run_id, report=True)
+    start_lambda_workers(event.get('function_name') or COLLECTORS[collector]['function_name'], worker_events)
+    return {
+        "statusCode": 202,
+        "message": "Workers started",
+        "body": f"Started {len(shards)} shard workers, invoke again with the continuation_token to merge once they finish",
+        "continuation_token": run_id
+    }
+
+def resume_lambda_run(event, run_id):
+    state = get_run_state(event['output_bucket_name'], event['output_prefix'], run_id)
+    if state['statusCode'] != 200:
+        return state
+    state = state['body']
+    responses = get_worker_results(event['output_bucket_name'], event['output_prefix'], run_id, len(state['shards']))
+    pending = [shard_index for shard_index, response in enumerate(responses) if response is None]
+    if pending:
+        waited = time.time() - state['started_at']
+        if waited > event.get('max_wait_seconds', 4 * 60 * 60):
+            # A worker that crashed or timed out never reports, so the run is given up instead of polled forever
+            return {
+                "statusCode": 500,
+                "message": "Some shards did not finish",
+                "body": f"Shards {pending} did not report within {waited:.0f} s, nothing was merged"
+            }
+        return {
+            "statusCode": 202,
+            "message": "Workers still running",
+            "body": f"{len(responses) - len(pending)} of {len(responses)} shards finished",
+            "continuation_token": run_id
+        }
+    return finish_run(state['collector'], event, run_id, state['nhl_ids'], state['shards'], responses, state['started_at'])
+
+def lambda_handler(event, context):
+    try:
+        collector = event['collector']
+        if collector not in COLLECTORS:
+            return {
+                "statusCode": 404,
+                "message": "Unknown collector",
+                "body": f"Unknown collector: {collector}"
+            }
+        backend = event.get('backend', 'lambda')
+        if backend not in ("local", "lambda"):
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "lambda" and event.get('continuation_token'):
+            return resume_lambda_run(event, event['continuation_token'])
+
+        if 'nhl_ids' in event:
+            nhl_ids = event['nhl_ids']
+        else:
+            nhl_ids = get_nhl_ids(event['bucket_name'], event['nhl_ids_prefix'])
+            if nhl_ids['statusCode'] != 200:
+                return nhl_ids
+            nhl_ids = nhl_ids['body']
+        if not nhl_ids:
+            return {
+                "statusCode": 404,
+                "message": "No NHL IDs to collect",
+                "body": "No NHL IDs to collect"
+            }
+
+        started_at = time.time()
+        run_id = uuid.uuid4().hex
+        shards = shard_ids(nhl_ids, event.get('shard_count', 4))
+        logging.info(f"Running {collector} over {len(nhl_ids)} ids in {len(shards)} shards on the {backend} backend")
+        if backend == "lambda":
+            return start_lambda_run(collector, event, run_id, nhl_ids, shards)
+        responses = run_local_shards(collector, build_worker_events(collector, event, shards, run_id))
+        return finish_run(collector, event, run_id, nhl_ids, shards, responses, started_at)
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not run sharded collection",
+            "body": f"Could not run sharded collection: {e}"
+        }
+
+
+if __name__ == "__main__":
+    event = {
+        "collector": "player_stats",
+        "backend": "local",
+        "shard_count": 4,
+        "bucket_name": "puckpedia",
+        "nhl_ids_prefix": "players/nhl_ids/nhl_ids.json",
+        "output_bucket_name": "nhlapi-data",
+        "output_prefix": "players/player_stats/",
+        "total_requests_per_second": 10.0,
+        "worker_event": {
+            "max_workers": 1,
+            "cache_dir": "/tmp/nhlapi_cache"
+        }
+    }
+
+    print(lambda_handler(event, None))
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import pandas as pd
+from o2k_io import read_s3_object, read_table, write_table
+from o2k_contracts import CONTRACT_TABLES, join_contract_tables, get_table_key
+
+
+# Used to derive a contract_id for rows PuckPedia did not give one
+CONTRACT_KEY_COLUMNS = ["nhl_id", "signing_date"]
+
+def get_contracts_csv_from_s3(bucket_name, prefix):
+    try:
+        logging.info(f"Retrieving CSV from S3 for bucket {bucket_name} and prefix {prefix}")
+        csv_data = read_table(bucket_name, prefix)
+        return {
+            "statusCode": 200,
+            "message": "CSV retrieved successfully",
+            "body": csv_data
+        }
+    except Exception as e:
+        logging.error(f"Could not retrieve CSV from S3 for bucket {bucket_name} and prefix {prefix}: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve CSV",
+            "body": f"Could not retrieve CSV: {e}"
+        }
+
+def get_normalized_contracts_from_s3(bucket_name, prefix):
+    # prefix is the normalized/ folder, e.g. players/current_contracts/normalized/
+    try:
+        logging.info(f"Retrieving normalized contract tables from S3 for bucket {bucket_name} and prefix {prefix}")
+        tables = {}
+        for name in CONTRACT_TABLES:
+            tables[name] = read_s3_object(bucket_name, f"{prefix}{name}.csv", pd.read_csv)
+        return {
+            "statusCode": 200,
+            "message": "CSV retrieved successfully",
+            "body": join_contract_tables(tables['players'], tables['contracts'], tables['contract_years'])
+        }
+    except Exception as e:
+        logging.error(f"Could not retrieve normalized contract tables from S3 for bucket {bucket_name} and prefix {prefix}: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve CSV",
+            "body": f"Could not retrieve CSV: {e}"
+        }
+
+def get_season_keys(seasons):
+    # Only the dash is dropped, so "2023-24" becomes 202324 and "20232024" stays 20232024; anything unparseable becomes NA
+    return pd.to_numeric(seasons.astype(str).str.replace('-', '', regex=False), errors='coerce').astype('Int64')
+
+def get_key_text(values):
+    # A column with a missing value reads back as float, so 8478402 would hash as "8478402.0";
+    # whole numbers are written as integers whatever the dtype, anything else as it is
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().sum() == values.notna().sum() and (numbers.dropna() % 1 == 0).all():
+        return numbers.astype('Int64').astype(str)
+    return values.astype(str)
+
+def derive_contract_ids(data, key_columns):
+    # Negative ids can never collide with PuckPedia's own (positive) contract ids
+    key_columns = [column for column in key_columns if column in data.columns]
+    keys = data[key_columns].apply(get_key_text).agg('|'.join, axis=1)
+    return keys.map(lambda key: -int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:12], 16))
+
+def build_canonical_contracts(current_contracts, historical_contracts, key_columns=CONTRACT_KEY_COLUMNS):
+    try:
+        # Current first, so a contract-year present in both snapshots keeps its current values
+        contracts = pd.concat([current_contracts, historical_contracts], ignore_index=True, sort=False)
+        contracts['season'] = get_season_keys(contracts['season'])
+        missing_seasons = contracts['season'].isna().sum()
+        if missing_seasons:
+            logging.warning(f"Dropping {missing_seasons} contract rows without a usable season")
+            contracts = contracts[contracts['season'].notna()]
+        contracts['season'] = contracts['season'].astype('int64')
+
+        if 'contract_id' not in contracts.columns:
+            contracts['contract_id'] = pd.NA
+        missing_ids = contracts['contract_id'].isna()
+        # A null key column hashes as "nan", which would merge unrelated contracts under one id
+        key_columns = [column for column in key_columns if column in contracts.columns]
+        missing_keys = missing_ids & contracts[key_columns].isna().any(axis=1)
+        if missing_keys.any():
+            logging.warning(f"Dropping {missing_keys.sum()} contract rows without a contract_id or a full {key_columns} key")
+            contracts = contracts[~missing_keys]
+            missing_ids = missing_ids[~missing_keys]
+        if missing_ids.any():
+            contracts.loc[missing_ids, 'contract_id'] = derive_contract_ids(contracts[missing_ids], key_columns)
+        contracts['contract_id'] = contracts['contract_id'].astype('int64')
+
+        contracts = contracts.drop_duplicates(subset=['contract_id', 'season'], keep='first')
+        contracts = contracts.sort_values(['nhl_id', 'season'], kind='stable').reset_index(drop=True)
+        return {
+            "statusCode": 200,
+            "message": "Canonical contracts built successfully",
+            "body": contracts
+        }
+    except Exception as e:
+        logging.error(f"Could not build canonical contracts: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not build canonical contracts",
+            "body": f"Could not build canonical contracts: {e}"
+        }
+
+def save_to_s3(data, bucket_name, prefix, storage_format="csv"):
+    try:
+        logging.info(f"Saving to S3 for bucket {bucket_name} and prefix {prefix}")
+        path = get_table_key(prefix, "contracts", storage_format)
+        changed = write_table(data, bucket_name, path)
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": f"Saved to S3: {path}",
+            "changed": changed
+        }
+    except Exception as e:
+        logging.error(f"Could not save to S3: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
+def lambda_handler(event, context):
+    try:
+        # With contracts_mode "normalized" the prefixes point at the collectors' normalized/ folders
+        if event.get('contracts_mode', 'wide') == 'normalized':
+            get_contracts = get_normalized_contracts_from_s3
+        else:
+            get_contracts = get_contracts_csv_from_s3
+        current_contracts = get_contracts(event['bucket_name'], event['current_contracts_prefix'])
+        if current_contracts['statusCode'] != 200:
+            return {
+                "statusCode": 404,
+                "message": "Could not retrieve current contracts",
+                "body": current_contracts['body']
+            }
+        historical_contracts = get_contracts(event['bucket_name'], event['historical_contracts_prefix'])
+        if historical_contracts['statusCode'] != 200:
+            return {
+                "statusCode": 404,
+                "message": "Could not retrieve historical contracts",
+                "body": historical_contracts['body']
+            }
+
+        contracts = build_canonical_contracts(current_contracts['body'], historical_contracts['body'], event.get('contract_key_columns', CONTRACT_KEY_COLUMNS))
+        if contracts['statusCode'] != 200:
+            return contracts
+        # storage_format "parquet" keeps the integer seasons and ids typed for the merge stages,
+        # "partitioned" writes one folder per season so the merge stages can read only the seasons they need
+        storage_format = event.get('storage_format', 'csv')
+        response = save_to_s3(contracts['body'], event['bucket_name'], event['canonical_contracts_prefix'], storage_format)
+        if response['statusCode'] != 200:
+            return response
+        return {
+            "statusCode": 200,
+            "message": "Canonical contracts saved to S3",
+            "body": f"Saved {len(contracts['body'])} contract years to {get_table_key(event['canonical_contracts_prefix'], 'contracts', storage_format)}",
+            "changed": response['changed']
+        }
+    except Exception as e:
+        logging.error(f"Could not build canonical contracts: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not build canonical contracts",
+            "body": f"Could not build canonical contracts: {e}"
+        }
+
+
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "current_contracts_prefix": "players/current_contracts/current_contracts.csv",
+        "historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
+        "canonical_contracts_prefix": "players/canonical_contracts/"
+    }
+
+    print(lambda_handler(event, None))
@@ -1,51 +1,22 @@
-import boto3
-import json
-import requests
 import logging
 from io import StringIO
 import pandas as pd
+try:
+    import ijson
+except ImportError:
+    ijson = None
+from o2k_io import (get_s3_client, reset_s3_read_stats, get_s3_read_stats, configure_rate_limiter,
+                    get_rate_limiter_stats, rate_limited_get, get_secrets, SECRETS_TTL)
+from o2k_contracts import CONTRACT_TABLES, append_contract_rows, append_normalized_rows, append_contract_index, save_contract_changes
+
+
+# PuckPedia's player payloads are large and slow to stream, so requests get longer than the shared 30s default
+REQUEST_TIMEOUT = 120
 
-def get_secrets():
-    try:
-        logging.info(f"Retrieving secrets")
-        client = boto3.client("secretsmanager", region_name="us-east-2")
-        secrets = {}
-
-        paginator = client.get_paginator("list_secrets")
-        for page in paginator.paginate():
-            for secret in page["SecretList"]:
-                name = secret["Name"]
-                try:
-                    response = client.get_secret_value(SecretId=name)
-                    if "SecretString" in response:
-                        secrets[name] = json.loads(response["SecretString"])
-                    else:
-                        secrets[name] = response["SecretBinary"]  # base64 encoded
-                except Exception as e:
-                    logging.error(f"Could not retrieve secret {name}: {e}")
-                    return {
-                        "statusCode": 404,
-                        "message": "Could not retrieve secret",
-                        "body": f"Could not retrieve secret {name}: {e}"
-                    }
-        logging.info(f"Secrets retrieved successfully")
-        return {
-            "statusCode": 200,
-            "message": "Secrets retrieved successfully",
-            "secrets": secrets
-        }
-    except Exception as e:
-        logging.error(f"Could not retrieve secrets: {e}")
-        return {
-            "statusCode": 404,
-            "message": "Could not retrieve secrets",
-            "body": f"Could not retrieve secrets: {e}"
-        }
-    
 def save_to_s3(data, bucket_name, prefix):
     try:
         logging.info(f"Saving to S3 for bucket {bucket_name} and prefix {prefix}")
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}current_contracts.csv"
         csv_buffer = StringIO()
         data.to_csv(csv_buffer, index=False)  
@@ -67,21 +38,51 @@ def save_to_s3(data, bucket_name, prefix):
         }
 
 
+def save_tables_to_s3(tables, bucket_name, prefix):
+    try:
+        s3 = get_s3_client()
+        sizes = {}
+        for name, data in tables.items():
+            path = f"{prefix}normalized/{name}.csv"
+            csv_buffer = StringIO()
+            data.to_csv(csv_buffer, index=False)
+            body = csv_buffer.getvalue()
+            s3.put_object(Bucket=bucket_name, Key=path, Body=body, ContentType='text/csv')
+            sizes[name] = len(body)
+        logging.info(f"Saved normalized tables to S3 under {prefix}normalized/: {sizes}")
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": sizes
+        }
+    except Exception as e:
+        logging.error(f"Could not save normalized tables to S3: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
     
     
     
     
+
+
 def get_contract_data(secret):
     try:
         logging.info(f"Getting contract data")
         url = f"https://puckpedia.com/api/v2/players?api_key={secret}" 
-        response = requests.get(url)
+        response = rate_limited_get(url, timeout=REQUEST_TIMEOUT, stream=True)
+        # Never hand an error payload to the flattener and overwrite good data with it
+        response.raise_for_status()
         logging.info(f"Contract data retrieved successfully")
         
+        # Players are parsed lazily while process_current_contract_data consumes them
         return {
             "statusCode": 200,
             "message": "Contract data retrieved successfully",
-            "body": response.json()
+            "body": iter_players(response)
         }
     except Exception as e:
         logging.error(f"Could not get contract data: {e}")
@@ -92,27 +93,40 @@ def get_contract_data(secret):
         }
 
 
-def process_current_contract_data(data):
+def iter_players(response):
+    # Walks the top-level player array one player at a time instead of loading the whole payload
+    try:
+        if ijson is None:
+            yield from response.json()
+            return
+        response.raw.decode_content = True
+        yield from ijson.items(response.raw, 'item', use_float=True)
+    finally:
+        response.close()
+
+def process_current_contract_data(data, output_mode='wide', capture_changes=True):
     try:
         logging.info(f"Processing current contract data")
-        rows = []
+        # output_mode: "wide" (one row per contract year), "normalized" or "both"
+        columns = {} if output_mode in ('wide', 'both') else None
+        tables = {name: {} for name in CONTRACT_TABLES} if output_mode in ('normalized', 'both') else None
+        contract_index = {} if capture_changes else None
         for player in data:
-            player_info = {k: v for k, v in player.items() if k != 'current'}
-            for contract in player.get('current', []):
-                contract_info = {k: v for k, v in contract.items() if k != 'years'}
-                
-                for year in contract.get('years', []):
-                    # Merge player info + contract info + year
-                    row = {**player_info, **contract_info, **year}
-                    rows.append(row)
+            if columns is not None:
+                append_contract_rows(columns, player, 'current')
+            if tables is not None:
+                append_normalized_rows(tables, player, 'current')
+            if contract_index is not None:
+                append_contract_index(contract_index, player, 'current')
 
-        
-        df = pd.DataFrame(rows)
+        df = pd.DataFrame(columns) if columns is not None else None
         logging.info(f"Current contract data processed successfully")
         return {
             "statusCode": 200,
             "message": "Historical contract data processed successfully",
-            "body": df
+            "body": df,
+            "tables": {name: pd.DataFrame(table) for name, table in tables.items()} if tables is not None else None,
+            "contract_index": contract_index
         }
        
             
@@ -127,21 +141,34 @@ def process_current_contract_data(data):
     
 def lambda_handler(event, context):
     try:
-        secrets = get_secrets()
+        configure_rate_limiter(event.get('requests_per_second', 2.0), event.get('max_retries', 5), event.get('retry_budget', 20))
+        reset_s3_read_stats()
+        secrets = get_secrets(ttl=event.get('secrets_ttl', SECRETS_TTL))
         if secrets['statusCode'] == 200:   
             contract_data = get_contract_data(secrets['secrets']['PuckPedia']['PuckPedia'])
 
             if contract_data['statusCode'] == 200:
-                processed_contract_data = process_current_contract_data(contract_data['body'])
+                processed_contract_data = process_current_contract_data(contract_data['body'], event.get('output_mode', 'wide'), event.get('capture_changes', True))
                 
                 if processed_contract_data['statusCode'] == 200:
-                    response = save_to_s3(processed_contract_data['body'], event['bucket_name'], event['prefix'])
+                    response = {"statusCode": 200}
+                    if processed_contract_data['body'] is not None:
+                        response = save_to_s3(processed_contract_data['body'], event['bucket_name'], event['prefix'])
+                    if response['statusCode'] == 200 and processed_contract_data['tables'] is not None:
+                        response = save_tables_to_s3(processed_contract_data['tables'], event['bucket_name'], event['prefix'])
+                    changes = None
+                    if response['statusCode'] == 200 and processed_contract_data['contract_index'] is not None:
+                        # A failed delta does not fail the run; the next run's delta covers both snapshots
+                        changes = save_contract_changes(processed_contract_data['contract_index'], event['bucket_name'], event['prefix'], 'current_contracts')['body']
                     
                     if response['statusCode'] == 200:
                         return {
                             "statusCode": 200,
                             "message": "Contract data saved to S3",
-                            "body": "Contract data saved to S3"
+                            "body": "Contract data saved to S3",
+                            "rate_limiter_stats": get_rate_limiter_stats(),
+                            "s3_read_stats": get_s3_read_stats(),
+                            "changes": changes
                         }
                     else:
                         return {
@@ -177,9 +204,10 @@ def lambda_handler(event, context):
             "body": f"Could not get contract data: {e}"
         }
 
-event = {
-    "bucket_name": "puckpedia",
-    "prefix": "players/current_contracts/",
-    "key": "contract-data.json"
-}
-lambda_handler(event, None)
\ No newline at end of file
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "prefix": "players/current_contracts/",
+        "key": "contract-data.json"
+    }
+    lambda_handler(event, None)
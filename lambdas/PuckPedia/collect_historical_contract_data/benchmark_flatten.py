@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+import requests
+
+from lambda_function import ijson, append_contract_rows
+
+
+def record_payload(api_key, payload_path):
+    url = f"https://puckpedia.com/api/v2/players?api_key={api_key}&contract_type=history"
+    with requests.get(url, stream=True, timeout=120) as response:
+        response.raise_for_status()
+        with open(payload_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+    print(f"Recorded {os.path.getsize(payload_path) / 1e6:.1f} MB to {payload_path}")
+
+
+def generate_payload(payload_path, players, seed):
+    # Shaped like the history payload: players -> history -> years, with optional and overlapping fields
+    rng = random.Random(seed)
+    data = []
+    for player_index in range(players):
+        player = {
+            "player_id": 100000 + player_index,
+            "nhl_id": 8470000 + player_index,
+            "first_name": f"First{player_index}",
+            "last_name": f"Last{player_index}",
+            "position": rng.choice(["C", "LW", "RW", "D", "G"]),
+            "shoots": rng.choice(["L", "R", None]),
+            "history": []
+        }
+        if rng.random() < 0.3:
+            player["birth_place"] = "Somewhere, ON"
+        season = rng.randint(2005, 2018)
+        for contract_index in range(rng.randint(1, 6)):
+            contract = {
+                "contract_type": rng.choice(["SPC", "ELC", "Standard"]),
+                "signing_date": f"{season}-07-01",
+                "length": rng.randint(1, 8),
+                "value": rng.randint(750, 90000) * 1000,
+                "years": []
+            }
+            if rng.random() < 0.2:
+                contract["position"] = "F"
+            for year_index in range(contract["length"]):
+                year = {
+                    "season": f"{season}-{str(season + 1)[-2:]}",
+                    "cap_hit": rng.randint(750, 12000) * 1000,
+                    "aav": round(rng.uniform(0.75, 12.0), 3),
+                    "clause": rng.choice(["NMC", "NTC", None])
+                }
+                if rng.random() < 0.1:
+                    year["signing_bonus"] = rng.randint(0, 5000) * 1000
+                contract["years"].append(year)
+                season += 1
+            player["history"].append(contract)
+        data.append(player)
+    with open(payload_path, 'w') as f:
+        json.dump(data, f)
+    print(f"Generated {players} players, {os.path.getsize(payload_path) / 1e6:.1f} MB to {payload_path}")
+
+
+def flatten_current(payload_path):
+    # response.json() followed by one merged dict per contract year
+    with open(payload_path, 'rb') as f:
+        data = json.load(f)
+    rows = []
+    for player in data:
+        player_info = {k: v for k, v in player.items() if k != 'history'}
+        for contract in player.get('history', []):
+            contract_info = {k: v for k, v in contract.items() if k != 'years'}
+            for year in contract.get('years', []):
+                rows.append({**player_info, **contract_info, **year})
+    return pd.DataFrame(rows)
+
+
+def flatten_streaming(payload_path):
+    columns = {}
+    with open(payload_path, 'rb') as f:
+        players = ijson.items(f, 'item', use_float=True) if ijson is not None else json.load(f)
+        for player in players:
+            append_contract_rows(columns, player, 'history')
+    return pd.DataFrame(columns)
+
+
+def measure(flatten, payload_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    flatten(payload_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_benchmark(payload_path, repeat):
+    print(f"{payload_path}: {os.path.getsize(payload_path) / 1e6:.1f} MB, ijson backend: {ijson.backend if ijson is not None else 'not installed'}")
+    current = flatten_current(payload_path)
+    streaming = flatten_streaming(payload_path)
+    if current.to_csv(index=False) != streaming.to_csv(index=False):
+        raise AssertionError("Streaming flatten does not produce the same CSV as the current path")
+    print(f"{len(current)} rows, {len(current.columns)} columns, identical CSV")
+
+    for name, flatten in [("current", flatten_current), ("streaming", flatten_streaming)]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            flatten(payload_path)
+            timings.append(time.perf_counter() - start)
+        # tracemalloc slows the run down, so peak memory is measured on a separate pass
+        _, peak = measure(flatten, payload_path)
+        print(f"{name:>9}: best {min(timings) * 1000:.1f} ms, mean {sum(timings) / len(timings) * 1000:.1f} ms over {repeat} runs, peak {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the merged-dict flatten against the streaming columnar flatten")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="Save the raw history payload for offline runs")
+    record_parser.add_argument("api_key")
+    record_parser.add_argument("payload_path")
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic history payload")
+    generate_parser.add_argument("payload_path")
+    generate_parser.add_argument("--players", type=int, default=5000)
+    generate_parser.add_argument("--seed", type=int, default=0)
+    run_parser = subparsers.add_parser("run", help="Time both flatten paths on a saved payload")
+    run_parser.add_argument("payload_path")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_payload(args.api_key, args.payload_path)
+    elif args.command == "generate":
+        generate_payload(args.payload_path, args.players, args.seed)
+    else:
+        run_benchmark(args.payload_path, args.repeat)
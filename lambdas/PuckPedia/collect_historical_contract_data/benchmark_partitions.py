@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lambda_function import (configure_rate_limiter, get_historical_contract_data, process_historical_contract_data,
+                             fetch_partition, combine_partitions, get_partition_id)
+from replay_server import start_server
+
+
+SECRETS = {"PuckPedia": {"PuckPedia": "replay"}}
+
+def run_single(base_url):
+    data = get_historical_contract_data(SECRETS, base_url)
+    return process_historical_contract_data(data['body'], 'wide', True)
+
+def run_partitioned(base_url, partitions, workers, manifest=None):
+    manifest = manifest or {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(lambda params: fetch_partition(params, manifest.get(get_partition_id(params)), SECRETS, base_url, 'wide', True), partitions))
+    return fetched
+
+def get_row_set(df):
+    # Partitions come back in partition order, so rows are compared as a set
+    df = df[sorted(df.columns)]
+    return sorted(df.to_csv(index=False, header=False).splitlines())
+
+def run_benchmark(directory, workers, latency, bandwidth, repeat):
+    with open(os.path.join(directory, 'partitions.json')) as f:
+        partitions = json.load(f)
+    server = start_server(directory, latency=latency, bandwidth=bandwidth)
+    base_url = f"http://127.0.0.1:{server.server_port}/api/v2/players"
+    configure_rate_limiter(1000.0)
+    try:
+        single = run_single(base_url)['body']
+        fetched = run_partitioned(base_url, partitions, workers)
+        partitioned = combine_partitions([result['processed'] for result in fetched])['body']
+        if get_row_set(single) != get_row_set(partitioned):
+            raise AssertionError("Partitioned fetch does not produce the same rows as the single request")
+        print(f"{len(partitions)} partitions, {len(single)} rows, same rows as the single request")
+
+        manifest = {result['partition_id']: result['entry'] for result in fetched}
+        runs = [
+            ("single", lambda: run_single(base_url)),
+            (f"partitioned x{workers}", lambda: run_partitioned(base_url, partitions, workers)),
+            ("conditional", lambda: run_partitioned(base_url, partitions, workers, manifest))
+        ]
+        for name, run in runs:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = run()
+                timings.append(time.perf_counter() - start)
+            note = ""
+            if name == "conditional":
+                note = f", {sum(not partition['modified'] for partition in result)}/{len(partitions)} partitions not modified"
+            print(f"{name:>15}: best {min(timings):.2f} s, mean {sum(timings) / len(timings):.2f} s over {repeat} runs{note}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the single history request against the partitioned fetch on the replay server")
+    parser.add_argument("directory", help="Directory written by replay_server.py split or record")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--bandwidth", type=float, default=20e6, help="Bytes per second per connection")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.directory, args.workers, args.latency, args.bandwidth, args.repeat)
@@ -1,59 +1,37 @@
-import boto3
 import json
-import requests
-from datetime import datetime
+from datetime import datetime, timezone
 import time
 import logging
+import tempfile
 import pandas as pd
 from io import StringIO
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import ijson
+except ImportError:
+    ijson = None
+from o2k_io import (get_s3_client, read_s3_object, reset_s3_read_stats, get_s3_read_stats, configure_rate_limiter,
+                    get_rate_limiter_stats, rate_limited_get, get_secrets, SECRETS_TTL)
+from o2k_contracts import CONTRACT_TABLES, append_contract_rows, append_normalized_rows, append_contract_index, save_contract_changes
 
 
+# PuckPedia's player payloads are large and slow to stream, so requests get longer than the shared 30s default
+REQUEST_TIMEOUT = 120
 
+PUCKPEDIA_BASE_URL = "https://puckpedia.com/api/v2/players"
 
-def get_secrets():
+def get_historical_contract_data(secrets, base_url=PUCKPEDIA_BASE_URL):
     try:
-        client = boto3.client("secretsmanager", region_name="us-east-2")
-        secrets = {}
-
-        paginator = client.get_paginator("list_secrets")
-        for page in paginator.paginate():
-            for secret in page["SecretList"]:
-                name = secret["Name"]
-                try:
-                    response = client.get_secret_value(SecretId=name)
-                    if "SecretString" in response:
-                        secrets[name] = json.loads(response["SecretString"])
-                    else:
-                        secrets[name] = response["SecretBinary"]  # base64 encoded
-                except Exception as e:
-                    logging.error(f"Could not retrieve secret {name}: {e}")
-                    return {
-                        "statusCode": 404,
-                        "message": "Could not retrieve secret",
-                        "body": f"Could not retrieve secret {name}: {e}"
-                    }
-        return {
-            "statusCode": 200,
-            "message": "Secrets retrieved successfully",
-            "secrets": secrets
-        }
-    except Exception as e:
-        logging.error(f"Could not retrieve secrets: {e}")
-        return {
-            "statusCode": 404,
-            "message": "Could not retrieve secrets",
-            "body": f"Could not retrieve secrets: {e}"
-        }
-        
-        
-def get_historical_contract_data(secrets):
-    try:
-        url = f"https://puckpedia.com/api/v2/players?api_key={secrets['PuckPedia']['PuckPedia']}&contract_type=history"
-        response = requests.get(url)
+        url = f"{base_url}?api_key={secrets['PuckPedia']['PuckPedia']}&contract_type=history"
+        response = rate_limited_get(url, timeout=REQUEST_TIMEOUT, stream=True)
+        # Never hand an error payload to the flattener and overwrite good data with it
+        response.raise_for_status()
+        # Players are parsed lazily while process_historical_contract_data consumes them
         return {
             "statusCode": 200,
             "message": "Historical contract data retrieved successfully",
-            "body": response.json()
+            "body": iter_players(response)
         }
     except Exception as e:
         logging.error(f"Could not get historical contract data: {e}")
@@ -65,7 +43,7 @@ def get_historical_contract_data(secrets):
         
 def save_to_s3(data, bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}historical_contracts.csv"
         csv_buffer = StringIO()
         data.to_csv(csv_buffer, index=False)  
@@ -83,28 +61,83 @@ def save_to_s3(data, bucket_name, prefix):
             "message": "Could not save to S3",
             "body": f"Could not save to S3: {e}"
         }
-        
-        
-        
-def process_historical_contract_data(data):
+
+def save_tables_to_s3(tables, bucket_name, prefix):
     try:
-        rows = []
+        s3 = get_s3_client()
+        sizes = {}
+        for name, data in tables.items():
+            path = f"{prefix}normalized/{name}.csv"
+            csv_buffer = StringIO()
+            data.to_csv(csv_buffer, index=False)
+            body = csv_buffer.getvalue()
+            s3.put_object(Bucket=bucket_name, Key=path, Body=body, ContentType='text/csv')
+            sizes[name] = len(body)
+        logging.info(f"Saved normalized tables to S3 under {prefix}normalized/: {sizes}")
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": sizes
+        }
+    except Exception as e:
+        logging.error(f"Could not save normalized tables to S3: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
+def iter_players(response):
+    # Walks the top-level player array one player at a time instead of loading the whole payload
+    try:
+        if ijson is None:
+            yield from response.json()
+            return
+        response.raw.decode_content = True
+        yield from ijson.items(response.raw, 'item', use_float=True)
+    finally:
+        response.close()
+
+def iter_stream_players(stream):
+    # Same as iter_players, for a file-like payload (a recorded partition or an S3 body)
+    if ijson is None:
+        yield from json.load(stream)
+        return
+    yield from ijson.items(stream, 'item', use_float=True)
+
+class PayloadRecorder:
+    # Copies every chunk the parser reads into sink, so a partition is stored without a second download
+    def __init__(self, raw, sink):
+        self.raw = raw
+        self.sink = sink
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.sink.write(chunk)
+        return chunk
+
+def process_historical_contract_data(data, output_mode='wide', capture_changes=True):
+    try:
+        # output_mode: "wide" (one row per contract year), "normalized" or "both"
+        columns = {} if output_mode in ('wide', 'both') else None
+        tables = {name: {} for name in CONTRACT_TABLES} if output_mode in ('normalized', 'both') else None
+        contract_index = {} if capture_changes else None
         for player in data:
-            player_info = {k: v for k, v in player.items() if k != 'history'}
-            for contract in player.get('history', []):
-                contract_info = {k: v for k, v in contract.items() if k != 'years'}
-                
-                for year in contract.get('years', []):
-                    # Merge player info + contract info + year
-                    row = {**player_info, **contract_info, **year}
-                    rows.append(row)
+            if columns is not None:
+                append_contract_rows(columns, player, 'history')
+            if tables is not None:
+                append_normalized_rows(tables, player, 'history')
+            if contract_index is not None:
+                append_contract_index(contract_index, player, 'history')
 
         # Create DataFrame
-        df = pd.DataFrame(rows)
+        df = pd.DataFrame(columns) if columns is not None else None
         return {
             "statusCode": 200,
             "message": "Historical contract data processed successfully",
-            "body": df
+            "body": df,
+            "tables": {name: pd.DataFrame(table) for name, table in tables.items()} if tables is not None else None,
+            "contract_index": contract_index
         }
        
             
@@ -117,19 +150,171 @@ def process_historical_contract_data(data):
         }
 
 
-        
+# Partitioned mode: event['partitions'] is a list of extra query parameters, e.g. [{"team": "TOR"}, ...]
+# or id ranges. Partitions are expected not to overlap. Each partition's raw payload and validators are
+# kept under {prefix}partitions/, so unchanged partitions are answered with a 304 and read back from S3.
+def get_partition_id(params):
+    return urlencode(sorted(params.items()))
+
+def get_partition_manifest(s3, bucket_name, prefix):
+    try:
+        return read_s3_object(bucket_name, f"{prefix}partitions/manifest.json", json.load)['partitions']
+    except Exception as e:
+        logging.info(f"No partition manifest under {prefix}partitions/, fetching every partition: {e}")
+        return {}
+
+def save_partition_manifest(s3, manifest, bucket_name, prefix):
+    s3.put_object(Bucket=bucket_name, Key=f"{prefix}partitions/manifest.json", Body=json.dumps({"partitions": manifest}), ContentType='application/json')
+
+def fetch_partition(params, previous, secrets, base_url, output_mode, capture_changes, s3=None, bucket_name=None, prefix=None):
+    # Streams one partition into the flattener. Without s3 nothing is stored (used by the benchmark).
+    partition_id = get_partition_id(params)
+    url = f"{base_url}?{urlencode({'api_key': secrets['PuckPedia']['PuckPedia'], 'contract_type': 'history', **params})}"
+    headers = {}
+    if previous and previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous and previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+    started = time.perf_counter()
+    response = rate_limited_get(url, headers=headers or None, timeout=REQUEST_TIMEOUT, stream=True)
+    if response.status_code == 304:
+        response.close()
+        return {"partition_id": partition_id, "entry": previous, "modified": False, "processed": None, "bytes": 0, "elapsed_seconds": round(time.perf_counter() - started, 3)}
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with tempfile.TemporaryFile() as payload:
+            recorder = PayloadRecorder(response.raw, payload)
+            processed = process_historical_contract_data(iter_stream_players(recorder), output_mode, capture_changes)
+            if processed['statusCode'] != 200:
+                raise RuntimeError(processed['body'])
+            # The parser can stop before the closing bracket, the stored payload has to be complete
+            while recorder.read(1 << 16):
+                pass
+            size = payload.tell()
+            if s3 is not None:
+                payload.seek(0)
+                s3.upload_fileobj(payload, bucket_name, f"{prefix}partitions/{partition_id}.json")
+    finally:
+        response.close()
+    entry = {
+        "params": params,
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "fetched_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    }
+    return {"partition_id": partition_id, "entry": entry, "modified": True, "processed": processed, "bytes": size, "elapsed_seconds": round(time.perf_counter() - started, 3)}
+
+def process_stored_partition(bucket_name, prefix, partition_id, output_mode, capture_changes):
+    processed = read_s3_object(bucket_name, f"{prefix}partitions/{partition_id}.json", lambda body: process_historical_contract_data(iter_stream_players(body), output_mode, capture_changes))
+    if processed['statusCode'] != 200:
+        raise RuntimeError(processed['body'])
+    return processed
+
+def combine_partitions(processed_partitions):
+    # Partition order is kept, so the output only depends on the order of event['partitions']
+    bodies = [processed['body'] for processed in processed_partitions if processed['body'] is not None]
+    tables = None
+    if processed_partitions and processed_partitions[0]['tables'] is not None:
+        tables = {name: pd.concat([processed['tables'][name] for processed in processed_partitions], ignore_index=True, sort=False) for name in CONTRACT_TABLES}
+    contract_index = None
+    if processed_partitions and processed_partitions[0]['contract_index'] is not None:
+        contract_index = {}
+        for processed in processed_partitions:
+            contract_index.update(processed['contract_index'])
+    return {
+        "statusCode": 200,
+        "message": "Historical contract data processed successfully",
+        "body": pd.concat(bodies, ignore_index=True, sort=False) if bodies else None,
+        "tables": tables,
+        "contract_index": contract_index
+    }
+
+def get_partitioned_historical_contract_data(secrets, partitions, bucket_name, prefix, base_url=PUCKPEDIA_BASE_URL, output_mode='wide', capture_changes=True, max_workers=4):
+    try:
+        s3 = get_s3_client()
+        manifest = get_partition_manifest(s3, bucket_name, prefix)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(partitions)))) as executor:
+            fetched = list(executor.map(
+                lambda params: fetch_partition(params, manifest.get(get_partition_id(params)), secrets, base_url, output_mode, capture_changes, s3, bucket_name, prefix),
+                partitions
+            ))
+            stats = [{key: result[key] for key in ("partition_id", "modified", "bytes", "elapsed_seconds")} for result in fetched]
+            partition_ids = [result['partition_id'] for result in fetched]
+            if not any(result['modified'] for result in fetched) and set(partition_ids) == set(manifest):
+                return {
+                    "statusCode": 200,
+                    "message": "Historical contract data unchanged",
+                    "unchanged": True,
+                    "partition_stats": stats
+                }
+            def load_unchanged(result):
+                # Unchanged partitions are flattened from the payload stored by the run that fetched them
+                try:
+                    return process_stored_partition(bucket_name, prefix, result['partition_id'], output_mode, capture_changes)
+                except Exception as e:
+                    logging.warning(f"Stored payload for partition {result['partition_id']} is unusable, fetching it again: {e}")
+                    refetched = fetch_partition(result['entry']['params'], None, secrets, base_url, output_mode, capture_changes, s3, bucket_name, prefix)
+                    result['entry'] = refetched['entry']
+                    return refetched['processed']
+            stored = {result['partition_id']: executor.submit(load_unchanged, result) for result in fetched if not result['modified']}
+            processed_partitions = [result['processed'] if result['modified'] else stored[result['partition_id']].result() for result in fetched]
+        processed = combine_partitions(processed_partitions)
+        processed['unchanged'] = False
+        processed['partition_stats'] = stats
+        processed['manifest'] = {result['partition_id']: result['entry'] for result in fetched}
+        return processed
+    except Exception as e:
+        logging.error(f"Could not get partitioned historical contract data: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not get historical contract data",
+            "body": f"Could not get partitioned historical contract data: {e}"
+        }
+
 def lambda_handler(event, context):
-    secrets = get_secrets()
+    configure_rate_limiter(event.get('requests_per_second', 2.0), event.get('max_retries', 5), event.get('retry_budget', 20))
+    reset_s3_read_stats()
+    secrets = get_secrets(ttl=event.get('secrets_ttl', SECRETS_TTL))
     if secrets['statusCode'] == 200:
-        historical_contract_data = get_historical_contract_data(secrets['secrets'])
-        processed_data = process_historical_contract_data(historical_contract_data['body'])
+        base_url = event.get('puckpedia_base_url', PUCKPEDIA_BASE_URL)
+        if 'partitions' in event:
+            processed_data = get_partitioned_historical_contract_data(secrets['secrets'], event['partitions'], event['bucket_name'], event['prefix'], base_url, event.get('output_mode', 'wide'), event.get('capture_changes', True), event.get('partition_workers', 4))
+            if processed_data['statusCode'] == 200 and processed_data['unchanged']:
+                return {
+                    "statusCode": 200,
+                    "message": "Historical contract data unchanged",
+                    "body": "Every partition answered 304, nothing was rewritten",
+                    "rate_limiter_stats": get_rate_limiter_stats(),
+                    "s3_read_stats": get_s3_read_stats(),
+                    "partition_stats": processed_data['partition_stats'],
+                    "changes": None
+                }
+        else:
+            historical_contract_data = get_historical_contract_data(secrets['secrets'], base_url)
+            processed_data = process_historical_contract_data(historical_contract_data['body'], event.get('output_mode', 'wide'), event.get('capture_changes', True))
         if processed_data['statusCode'] == 200:
-            response = save_to_s3(processed_data['body'], event['bucket_name'], event['prefix'])
+            response = {"statusCode": 200}
+            if processed_data['body'] is not None:
+                response = save_to_s3(processed_data['body'], event['bucket_name'], event['prefix'])
+            if response['statusCode'] == 200 and processed_data['tables'] is not None:
+                response = save_tables_to_s3(processed_data['tables'], event['bucket_name'], event['prefix'])
+            changes = None
+            if response['statusCode'] == 200 and processed_data['contract_index'] is not None:
+                # A failed delta does not fail the run; the next run's delta covers both snapshots
+                changes = save_contract_changes(processed_data['contract_index'], event['bucket_name'], event['prefix'], 'historical_contracts')['body']
             if response['statusCode'] == 200:
+                if 'manifest' in processed_data:
+                    # Validators are only recorded once the outputs built from them are saved
+                    save_partition_manifest(get_s3_client(), processed_data['manifest'], event['bucket_name'], event['prefix'])
                 return {
                     "statusCode": 200,
                     "message": "Historical contract data saved to S3",
-                    "body": "Historical contract data saved to S3"
+                    "body": "Historical contract data saved to S3",
+                    "rate_limiter_stats": get_rate_limiter_stats(),
+                    "s3_read_stats": get_s3_read_stats(),
+                    "partition_stats": processed_data.get('partition_stats'),
+                    "changes": changes
                 }
             else:
                 return {
@@ -152,8 +337,9 @@ def lambda_handler(event, context):
     
     
     
-event = {
-    "bucket_name": "puckpedia",
-    "prefix": "players/historical_contracts/",
-}
-lambda_handler(event, None)
\ No newline at end of file
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "prefix": "players/historical_contracts/",
+    }
+    lambda_handler(event, None)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+
+
+# Stand-in for the PuckPedia players endpoint. Recorded payloads live in one directory, named after the
+# partition they answer (the query string without api_key and contract_type), with all.json for the
+# unpartitioned request. Point the collector at it with "puckpedia_base_url": "http://127.0.0.1:<port>/api/v2/players".
+
+def get_partition_id(params):
+    return urlencode(sorted(params.items()))
+
+def get_payload_path(directory, params):
+    return os.path.join(directory, f"{get_partition_id(params) or 'all'}.json")
+
+def get_validators(path):
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', formatdate(int(stat.st_mtime), usegmt=True)
+
+def make_handler(directory, latency, bandwidth):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            query = urlparse(self.path).query
+            params = {k: v for k, v in parse_qsl(query) if k not in ('api_key', 'contract_type')}
+            path = get_payload_path(directory, params)
+            if latency:
+                time.sleep(latency)
+            if not os.path.exists(path):
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag, last_modified = get_validators(path)
+            if self.is_not_modified(etag, path):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            chunk_size = 1 << 16
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    if bandwidth:
+                        # Per connection, so concurrent partitions see the same link speed as one big request
+                        time.sleep(len(chunk) / bandwidth)
+
+        def is_not_modified(self, etag, path):
+            if 'If-None-Match' in self.headers:
+                return self.headers['If-None-Match'] == etag
+            if 'If-Modified-Since' in self.headers:
+                try:
+                    return int(os.stat(path).st_mtime) <= parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+    return ReplayHandler
+
+def start_server(directory, port=0, latency=0.0, bandwidth=0.0):
+    # Returns the running server; its base URL is http://127.0.0.1:<server.server_port>/api/v2/players
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(directory, latency, bandwidth))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def split_payload(payload_path, directory, partitions):
+    # Cuts a recorded history payload into contiguous nhl_id ranges. The nhl_id_min / nhl_id_max
+    # parameters only exist on the replay server; against PuckPedia use its own filters (e.g. team).
+    with open(payload_path, 'rb') as f:
+        players = json.load(f)
+    players.sort(key=lambda player: (player.get('nhl_id') is None, player.get('nhl_id') or 0))
+    os.makedirs(directory, exist_ok=True)
+    shutil.copyfile(payload_path, os.path.join(directory, 'all.json'))
+    size = -(-len(players) // partitions)
+    partition_params = []
+    for start in range(0, len(players), size):
+        chunk = players[start:start + size]
+        ids = [player['nhl_id'] for player in chunk if player.get('nhl_id') is not None]
+        params = {"nhl_id_min": str(min(ids)) if ids else "none", "nhl_id_max": str(max(ids)) if ids else "none"}
+        with open(get_payload_path(directory, params), 'w') as f:
+            json.dump(chunk, f)
+        partition_params.append(params)
+    with open(os.path.join(directory, 'partitions.json'), 'w') as f:
+        json.dump(partition_params, f, indent=2)
+    print(f"Wrote {len(partition_params)} partitions to {directory}, event partitions in {directory}/partitions.json")
+
+def record_partitions(api_key, directory, partitions_path):
+    with open(partitions_path) as f:
+        partition_params = json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    for params in [{}] + partition_params:
+        url = f"https://puckpedia.com/api/v2/players?{urlencode({'api_key': api_key, 'contract_type': 'history', **params})}"
+        with requests.get(url, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            with open(get_payload_path(directory, params), 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        print(f"Recorded {get_partition_id(params) or 'all'}")
+    shutil.copyfile(partitions_path, os.path.join(directory, 'partitions.json'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded PuckPedia history payloads over HTTP")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Serve a directory of recorded partitions")
+    serve_parser.add_argument("directory")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each response starts")
+    serve_parser.add_argument("--bandwidth", type=float, default=0.0, help="Bytes per second per connection, 0 for unlimited")
+    split_parser = subparsers.add_parser("split", help="Split one recorded history payload into id-range partitions")
+    split_parser.add_argument("payload_path")
+    split_parser.add_argument("directory")
+    split_parser.add_argument("--partitions", type=int, default=8)
+    record_parser = subparsers.add_parser("record", help="Record the full payload and every partition from PuckPedia")
+    record_parser.add_argument("api_key")
+    record_parser.add_argument("directory")
+    record_parser.add_argument("partitions_path", help="JSON list of query parameters, one object per partition")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = start_server(args.directory, args.port, args.latency, args.bandwidth)
+        print(f"Replaying {args.directory} on http://127.0.0.1:{server.server_port}/api/v2/players")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == "split":
+        split_payload(args.payload_path, args.directory, args.partitions)
+    else:
+        record_partitions(args.api_key, args.directory, args.partitions_path)
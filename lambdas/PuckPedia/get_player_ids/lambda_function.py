@@ -1,17 +1,15 @@
-import boto3
 import logging
 import pandas as pd
-from io import StringIO
 import json
+from datetime import datetime, timezone
+from o2k_io import get_s3_client, read_s3_object, read_table
 
 
 def get_historical_contracts_csv_from_s3(bucket_name, prefix):
     try:
         logging.info(f"Retrieving CSV from S3 for bucket {bucket_name} and prefix {prefix}")
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)    
-        csv_data = response['Body'].read().decode('utf-8')
-        csv_data = pd.read_csv(StringIO(csv_data))
+        # Only the id column is needed, so the contract fields are never parsed
+        csv_data = read_table(bucket_name, prefix, columns=['nhl_id'])
         logging.info(f"CSV retrieved successfully for bucket {bucket_name} and prefix {prefix}")
     
         return {
@@ -30,10 +28,8 @@ def get_historical_contracts_csv_from_s3(bucket_name, prefix):
 def get_current_contracts_csv_from_s3(bucket_name, prefix):
     try:
         logging.info(f"Retrieving CSV from S3 for bucket {bucket_name} and prefix {prefix}")
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        csv_data = response['Body'].read().decode('utf-8')
-        csv_data = pd.read_csv(StringIO(csv_data))
+        # Only the id column is needed, so the contract fields are never parsed
+        csv_data = read_table(bucket_name, prefix, columns=['nhl_id'])
         logging.info(f"CSV retrieved successfully for bucket {bucket_name} and prefix {prefix}")
         return {
             "statusCode": 200,
@@ -47,12 +43,32 @@ def get_current_contracts_csv_from_s3(bucket_name, prefix):
             "message": "Could not retrieve CSV",
             "body": f"Could not retrieve CSV: {e}"
         }
+
+def get_contracted_players_from_s3(bucket_name, prefix):
+    # Normalized layout: only the players table and the contract links are read, never the contract years
+    try:
+        logging.info(f"Retrieving normalized contract tables from S3 for bucket {bucket_name} and prefix {prefix}")
+        players = read_s3_object(bucket_name, f"{prefix}players.csv", lambda body: pd.read_csv(body, usecols=['player_key', 'nhl_id']))
+        contracts = read_s3_object(bucket_name, f"{prefix}contracts.csv", lambda body: pd.read_csv(body, usecols=['player_key']))
+        return {
+            "statusCode": 200,
+            "message": "CSV retrieved successfully",
+            "body": players[players['player_key'].isin(contracts['player_key'])]
+        }
+    except Exception as e:
+        logging.error(f"Could not retrieve normalized contract tables from S3 for bucket {bucket_name} and prefix {prefix}: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve CSV",
+            "body": f"Could not retrieve CSV: {e}"
+        }
         
         
 def get_nhl_ids(csv_data):
     try:
         logging.info(f"Retrieving NHL IDs from CSV")
-        nhl_ids = csv_data['nhl_id'].unique().tolist()
+        # Rows PuckPedia has no NHL id for are dropped, and the float column pandas reads them as is cast back to int
+        nhl_ids = csv_data['nhl_id'].dropna().astype('int64').unique().tolist()
         logging.info(f"NHL IDs retrieved successfully")
         return {
             "statusCode": 200,
@@ -71,7 +87,7 @@ def get_nhl_ids(csv_data):
 def save_to_s3(data, bucket_name, prefix):
     try:
         logging.info(f"Saving to S3 for bucket {bucket_name} and prefix {prefix}")
-        s3 = boto3.client("s3", region_name="us-east-2")
+        s3 = get_s3_client()
         path = f"{prefix}nhl_ids.json"
         data = {
             "nhl_ids": data
@@ -92,23 +108,134 @@ def save_to_s3(data, bucket_name, prefix):
             "body": f"Could not save to S3: {e}"
         }
 
+def get_previous_nhl_ids(bucket_name, prefix):
+    try:
+        data = read_s3_object(bucket_name, f"{prefix}nhl_ids.json", json.load)
+        return {
+            "statusCode": 200,
+            "message": "Previous NHL IDs retrieved successfully",
+            "body": data['nhl_ids']
+        }
+    except Exception as e:
+        # Nothing published yet, the first run is a full refresh
+        logging.info(f"No previous NHL IDs for bucket {bucket_name} and prefix {prefix}: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve previous NHL IDs",
+            "body": f"Could not retrieve previous NHL IDs: {e}"
+        }
+
+def build_nhl_id_changes(nhl_ids, previous_nhl_ids):
+    if previous_nhl_ids is None:
+        return {
+            "full_refresh": True,
+            "new_ids": nhl_ids,
+            "removed_ids": []
+        }
+    previous = set(previous_nhl_ids)
+    current = set(nhl_ids)
+    return {
+        "full_refresh": False,
+        "new_ids": [nhl_id for nhl_id in nhl_ids if nhl_id not in previous],
+        "removed_ids": [nhl_id for nhl_id in previous_nhl_ids if nhl_id not in current]
+    }
+
+def save_nhl_id_changes(changes, total_ids, bucket_name, prefix):
+    try:
+        s3 = get_s3_client()
+        path = f"{prefix}nhl_ids_changes.json"
+        data = {
+            **changes,
+            "counts": {
+                "new": len(changes['new_ids']),
+                "removed": len(changes['removed_ids']),
+                "total": total_ids
+            },
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        s3.put_object(Bucket=bucket_name, Key=path, Body=json.dumps(data), ContentType='application/json')
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": "Saved to S3"
+        }
+    except Exception as e:
+        logging.error(f"Could not save NHL ID changes to S3 for bucket {bucket_name} and prefix {prefix}: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
+def publish_nhl_ids(nhl_ids, bucket_name, prefix):
+    # nhl_ids_changes.json records what this run changed; the collectors diff nhl_ids.json against what they
+    # already stored, so this file is only a log of the latest run, not something they depend on
+    previous_nhl_ids = get_previous_nhl_ids(bucket_name, prefix)
+    previous_nhl_ids = previous_nhl_ids['body'] if previous_nhl_ids['statusCode'] == 200 else None
+    changes = build_nhl_id_changes(nhl_ids, previous_nhl_ids)
+    if previous_nhl_ids is not None and set(previous_nhl_ids) == set(nhl_ids):
+        logging.info(f"NHL IDs unchanged, leaving {prefix}nhl_ids.json in place")
+    else:
+        response = save_to_s3(nhl_ids, bucket_name, prefix)
+        if response['statusCode'] != 200:
+            return response
+    save_nhl_id_changes(changes, len(nhl_ids), bucket_name, prefix)
+    return {
+        "statusCode": 200,
+        "message": "NHL IDs published",
+        "body": changes
+    }
+
 def lambda_handler(event, context):
     try:
-        historical_contracts_csv_data = get_historical_contracts_csv_from_s3(event['bucket_name'], event['historical_contracts_prefix'])
+        if 'canonical_contracts_prefix' in event:
+            # Built once by build_canonical_contracts, so there is nothing left to concatenate
+            canonical_contracts_csv_data = get_current_contracts_csv_from_s3(event['bucket_name'], event['canonical_contracts_prefix'])
+            if canonical_contracts_csv_data['statusCode'] != 200:
+                return {
+                    "statusCode": 404,
+                    "message": "Could not retrieve canonical contracts CSV",
+                }
+            nhl_ids = get_nhl_ids(canonical_contracts_csv_data['body'])
+            if nhl_ids['statusCode'] != 200:
+                return {
+                    "statusCode": 404,
+                    "message": "Could not retrieve NHL IDs",
+                }
+            changes = publish_nhl_ids(nhl_ids['body'], event['bucket_name'], event['nhl_ids_prefix'])
+            return {
+                "statusCode": 200,
+                "message": "Player IDs retrieved successfully",
+                "body": nhl_ids['body'],
+                "new_ids": len(changes['body']['new_ids']) if changes['statusCode'] == 200 else None,
+                "removed_ids": len(changes['body']['removed_ids']) if changes['statusCode'] == 200 else None
+            }
+
+        # With contracts_mode "normalized" the prefixes point at the collectors' normalized/ folders
+        normalized = event.get('contracts_mode', 'wide') == 'normalized'
+        if normalized:
+            historical_contracts_csv_data = get_contracted_players_from_s3(event['bucket_name'], event['historical_contracts_prefix'])
+        else:
+            historical_contracts_csv_data = get_historical_contracts_csv_from_s3(event['bucket_name'], event['historical_contracts_prefix'])
         
         if historical_contracts_csv_data['statusCode'] == 200:
-            current_contracts_csv_data = get_current_contracts_csv_from_s3(event['bucket_name'], event['current_contracts_prefix'])
+            if normalized:
+                current_contracts_csv_data = get_contracted_players_from_s3(event['bucket_name'], event['current_contracts_prefix'])
+            else:
+                current_contracts_csv_data = get_current_contracts_csv_from_s3(event['bucket_name'], event['current_contracts_prefix'])
             
             if current_contracts_csv_data['statusCode'] == 200:
                 historical_contracts_csv_data['body'] = pd.concat([historical_contracts_csv_data['body'], current_contracts_csv_data['body']])
                 nhl_ids = get_nhl_ids(historical_contracts_csv_data['body'])
                 
                 if nhl_ids['statusCode'] == 200:
-                    save_to_s3(nhl_ids['body'], event['bucket_name'], event['nhl_ids_prefix'])
+                    changes = publish_nhl_ids(nhl_ids['body'], event['bucket_name'], event['nhl_ids_prefix'])
                     return {
                         "statusCode": 200,
                         "message": "Player IDs retrieved successfully",
-                        "body": nhl_ids['body']
+                        "body": nhl_ids['body'],
+                        "new_ids": len(changes['body']['new_ids']) if changes['statusCode'] == 200 else None,
+                        "removed_ids": len(changes['body']['removed_ids']) if changes['statusCode'] == 200 else None
                     }
                 else:
                     return {
@@ -140,13 +267,14 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "puckpedia",
-    "historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
-    "current_contracts_prefix": "players/current_contracts/current_contracts.csv",
-    "nhl_ids_prefix": "players/nhl_ids/"
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
+        "current_contracts_prefix": "players/current_contracts/current_contracts.csv",
+        "nhl_ids_prefix": "players/nhl_ids/"
+    }
 
-response = lambda_handler(event, None)
-print(len(response['body']))
-print(response)
+    response = lambda_handler(event, None)
+    print(len(response['body']))
+    print(response)
@@ -1,19 +1,11 @@
-import boto3
 import pandas as pd
-from io import StringIO
+from o2k_io import read_table, write_table
 
 
-
-
-
-
-def get_data(bucket_name, prefix, year):
+def get_data(bucket_name, prefix, year, engine=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
         prefix = prefix + str(year) + "/" + f"skaters_{year}.csv"
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, engine=engine)
         data['season'] = (data['season'].astype(str) + (data['season'] + 1).astype(str)).astype(int)
         
         return {
@@ -29,14 +21,14 @@ def get_data(bucket_name, prefix, year):
         }
 
 
-def save_to_s3(data, bucket_name, prefix):
+def save_to_s3(data, bucket_name, prefix, seasons=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        s3.put_object(Bucket=bucket_name, Key=prefix, Body=data.to_csv(index=False))
+        changed = write_table(data, bucket_name, prefix, seasons)
         return {
             "statusCode": 200,
             "message": "Data saved successfully",
-            "body": "Data saved successfully"
+            "body": "Data saved successfully",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -48,17 +40,21 @@ def save_to_s3(data, bucket_name, prefix):
 def lambda_handler(event, context):
     try:
         merged_data_list = []
+        seasons = []
         for year in event['years']:
-            data = get_data(event['bucket_name'], event['data_prefix'], year)
+            data = get_data(event['bucket_name'], event['data_prefix'], year, event.get('csv_engine'))
             if data['statusCode'] == 200:
                 merged_data_list.append(data['body'])
+                seasons.append(int(f"{year}{year + 1}"))
         merged_data = pd.concat(merged_data_list)
-        save_to_s3_response = save_to_s3(merged_data, event['merged_data_bucket_name'], event['merged_data_prefix'])
+        # Only the years read in this run are replaced, so a partial refresh or a missing source file keeps the other seasons
+        save_to_s3_response = save_to_s3(merged_data, event['merged_data_bucket_name'], event['merged_data_prefix'], seasons)
         if save_to_s3_response['statusCode'] == 200:
             return {
                 "statusCode": 200,
                 "message": "Merge all years data",
-                "body": "Merge all years data"
+                "body": "Merge all years data",
+                "changed": save_to_s3_response['changed']
             }
         else:
             return {
@@ -76,16 +72,13 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "money-puck-data",
-    "years": [2008, 2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024],
-    "data_prefix": "skaters/",
-    "merged_data_prefix": "merged_data/skaters/merged_data.csv",
-    "merged_data_bucket_name": "money-puck-data"
-}
-
-print(lambda_handler(event, None))
-
-
-
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "money-puck-data",
+        "years": [2008, 2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024],
+        "data_prefix": "skaters/",
+        "merged_data_prefix": "merged_data/skaters/merged_data.csv",
+        "merged_data_bucket_name": "money-puck-data"
+    }
 
+    print(lambda_handler(event, None))
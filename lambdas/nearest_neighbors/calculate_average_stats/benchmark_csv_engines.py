@@ -0,0 +1,115 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from o2k_io import CSV_ENGINES, read_csv
+
+
+SITUATIONS = ["all", "5on5", "5on4", "4on5", "other"]
+
+def build_csv(players, seasons, columns, seed=0):
+    # Same shape as the merged advanced file: one row per player, season and situation, mostly float stats
+    rng = np.random.default_rng(seed)
+    rows = players * seasons * len(SITUATIONS)
+    data = {
+        "playerId": np.repeat(np.arange(8470000, 8470000 + players), seasons * len(SITUATIONS)),
+        "season": np.tile(np.repeat(np.arange(2008, 2008 + seasons), len(SITUATIONS)), players),
+        "situation": np.tile(SITUATIONS, players * seasons),
+        "name": np.repeat([f"Player {player}" for player in range(players)], seasons * len(SITUATIONS)),
+        "team": rng.choice(["TOR", "MTL", "BOS", "NYR", "EDM"], rows),
+        "position": rng.choice(["C", "L", "R", "D"], rows),
+        "contract_id": rng.integers(0, players * 4, rows).astype(float)
+    }
+    data["contract_id"][rng.random(rows) < 0.05] = np.nan
+    for index in range(columns):
+        data[f"stat_{index}"] = rng.random(rows) * 100 if index % 3 else rng.integers(0, 500, rows)
+    return pd.DataFrame(data).to_csv(index=False).encode('utf-8')
+
+def scale_csv(raw, scale):
+    # Repeating the data rows keeps the value distribution and only changes the size
+    header, _, body = raw.partition(b"\n")
+    return header + b"\n" + body * scale
+
+def get_rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def sample_peak_rss(stop, peak, interval=0.005):
+    # ru_maxrss also remembers import-time peaks, so the current RSS is sampled while the parse runs
+    while not stop.is_set():
+        peak[0] = max(peak[0], get_rss())
+        stop.wait(interval)
+
+def measure(path, engine, columns, queue):
+    # Runs in its own process so each engine starts from the same baseline
+    # readinto fills one preallocated buffer; read() can briefly hold two copies and hide the parser's own peak
+    raw = bytearray(os.path.getsize(path))
+    with open(path, 'rb') as f:
+        f.readinto(raw)
+    before = get_rss()
+    peak = [before]
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_peak_rss, args=(stop, peak))
+    sampler.start()
+    start = time.perf_counter()
+    data = read_csv(pa.BufferReader(raw), columns, engine)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+    peak[0] = max(peak[0], get_rss())
+    queue.put((elapsed, peak[0] - before, data.shape))
+
+def run_engine(path, engine, columns):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(path, engine, columns, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def run_benchmark(players, seasons, columns, scales, repeat, select):
+    raw = build_csv(players, seasons, columns)
+    selected = None
+    if select:
+        selected = ["playerId", "season", "situation"] + [f"stat_{index}" for index in range(min(select, columns))]
+
+    expected = read_csv(pa.BufferReader(raw), selected, "pandas")
+    for engine in CSV_ENGINES:
+        data = read_csv(pa.BufferReader(raw), selected, engine)
+        pd.testing.assert_frame_equal(data[expected.columns], expected, check_exact=False, check_dtype=False)
+    print(f"Engines agree on {len(expected)} rows x {len(expected.columns)} columns")
+
+    for scale in scales:
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+            f.write(scale_csv(raw, scale))
+        print(f"x{scale}: {os.path.getsize(f.name) / 1e6:.1f} MB CSV{f', {len(selected)} columns selected' if selected else ''}")
+        try:
+            results = {engine: [run_engine(f.name, engine, selected) for _ in range(repeat)] for engine in CSV_ENGINES}
+        finally:
+            os.remove(f.name)
+        for engine in CSV_ENGINES:
+            timings = [result[0] for result in results[engine]]
+            peak = max(result[1] for result in results[engine])
+            rows, width = results[engine][0][2]
+            print(f"{engine:>8}: best {min(timings):.2f} s, mean {sum(timings) / len(timings):.2f} s over {repeat} runs, "
+                  f"peak RSS +{peak / 1e6:.0f} MB, {rows} x {width}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare parse time and peak memory of the Arrow and pandas CSV engines")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--seasons", type=int, default=17, help="MoneyPuck years in the merged file")
+    parser.add_argument("--columns", type=int, default=60, help="Stat columns besides the id and label columns")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--select", type=int, default=0, help="Only parse this many stat columns plus the ids")
+    args = parser.parse_args()
+    run_benchmark(args.players, args.seasons, args.columns, args.scales, args.repeat, args.select)
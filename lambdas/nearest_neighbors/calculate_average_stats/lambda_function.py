@@ -1,16 +1,13 @@
-import boto3
 import pandas as pd
-from io import StringIO
+from o2k_io import read_table, write_table
+
 
     
     
-def get_data(bucket_name, prefix):
+def get_data(bucket_name, prefix, engine=None):
 
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, engine=engine)
         return {
             "statusCode": 200,
             "message": "Data retrieved successfully",
@@ -87,12 +84,12 @@ def merge_data(data, average_stats):
 
 def save_data(bucket_name, prefix, data):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        s3.put_object(Bucket=bucket_name, Key=prefix, Body=data.to_csv(index=False))
+        changed = write_table(data, bucket_name, prefix)
         return {
             "statusCode": 200,
             "message": "Data saved successfully",
-            "body": "Data saved successfully"
+            "body": "Data saved successfully",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -103,7 +100,7 @@ def save_data(bucket_name, prefix, data):
 
 def lambda_handler(event, context):
     try:
-        data = get_data(event['bucket_name'], event['merged_data_prefix'])
+        data = get_data(event['bucket_name'], event['merged_data_prefix'], event.get('csv_engine'))
         if data['statusCode'] == 200:
             average_stats = calculate_average_stats(data['body'])
             # print(average_stats['body'])
@@ -115,7 +112,8 @@ def lambda_handler(event, context):
                         return {
                             "statusCode": 200,
                             "message": "Data merged successfully",
-                            "body": "Data merged successfully"
+                            "body": "Data merged successfully",
+                            "changed": save_data_result['changed']
                         }
                     else:
                         return {
@@ -153,14 +151,13 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "contract-stats-merged-data",
-    "merged_data_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
-    "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv"
-}
-
-print(lambda_handler(event, {}))
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "contract-stats-merged-data",
+        "merged_data_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
+        "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv"
+    }
 
+    print(lambda_handler(event, {}))
 
 
-        
\ No newline at end of file
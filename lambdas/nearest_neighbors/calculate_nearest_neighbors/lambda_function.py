@@ -1,24 +1,20 @@
-import boto3
 import pandas as pd
-from io import StringIO
 from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler
-import pickle
-import io
 import joblib
-import time
-
+from o2k_io import read_table
 
 
 scaler = StandardScaler()
 
+FEATURES = ['goals_per_game_y', 'assists_per_game_y', 'points_per_game_y', 'even_strength_points_per_game_y', 'power_play_points_per_game_y', 'goals_per_60_y', 'assists_per_60_y', 'points_per_60_y', 'timeOnIcePerGame_y', 'shotsBlockedByPlayer_y', 'onIce_corsiPercentage_y', 'onIce_xGoalsPercentage_y']
+# The neighbour search only needs the ids next to the features, so the average stats read skips every other column
+AVERAGE_STATS_COLUMNS = ['contract_id', 'playerId'] + FEATURES
+
 
-def get_data(bucket_name, prefix):
+def get_data(bucket_name, prefix, columns=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, columns, cached=True)
         return {
             "statusCode": 200,
             "message": "Data retrieved successfully",
@@ -33,8 +29,7 @@ def get_data(bucket_name, prefix):
 
 def calculate_nearest_neighbors(data):
     try:
-        features = ['goals_per_game_y', 'assists_per_game_y', 'points_per_game_y', 'even_strength_points_per_game_y', 'power_play_points_per_game_y', 'goals_per_60_y', 'assists_per_60_y', 'points_per_60_y', 'timeOnIcePerGame_y', 'shotsBlockedByPlayer_y', 'onIce_corsiPercentage_y', 'onIce_xGoalsPercentage_y']
-        data = data[features].fillna(0)
+        data = data[FEATURES].fillna(0)
         data_scaled = scaler.fit_transform(data)
         nbrs = NearestNeighbors(n_neighbors=10, algorithm='ball_tree').fit(data_scaled)
         return {
@@ -53,8 +48,7 @@ def calculate_nearest_neighbors(data):
 def find_similar_contracts(contract_id, data, nbrs):
     try:
         # features = ['goals_y', 'assists_y', 'plusMinus_y', 'points_y', 'pointsPerGame_y', 'timeOnIcePerGame_y', 'shotsBlockedByPlayer_y', 'onIce_corsiPercentage_y']
-        features = ['goals_per_game_y', 'assists_per_game_y', 'points_per_game_y', 'even_strength_points_per_game_y', 'power_play_points_per_game_y', 'goals_per_60_y', 'assists_per_60_y', 'points_per_60_y', 'timeOnIcePerGame_y', 'shotsBlockedByPlayer_y', 'onIce_corsiPercentage_y', 'onIce_xGoalsPercentage_y']
-        contract_data = data[data['contract_id'] == contract_id][features].fillna(0)
+        contract_data = data[data['contract_id'] == contract_id][FEATURES].fillna(0)
         contract_data_scaled = scaler.transform(contract_data)
         distances, indices = nbrs.kneighbors(contract_data_scaled)
         
@@ -113,7 +107,7 @@ def get_next_contract_info(contract_id, player_id, data):
 
 def lambda_handler(event, context):
     try:
-        data = get_data(event['bucket_name'], event['average_stats_prefix'])
+        data = get_data(event['bucket_name'], event['average_stats_prefix'], AVERAGE_STATS_COLUMNS)
         if data['statusCode'] == 200:
             nearest_neighbors = calculate_nearest_neighbors(data['body'])
             if nearest_neighbors['statusCode'] == 200:
@@ -175,33 +169,27 @@ def lambda_handler(event, context):
         
         
 
-event = {
-    "bucket_name": "contract-stats-merged-data",
-    "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv",
-    "nearest_neighbors_prefix": "players/nearest_neighbors/nearest_neighbors_advanced_contracts.pkl",
-    "contract_id": 6131,
-    "contract_bucket_name": "puckpedia",
-    "contract_prefix": "players/merged_data/merged_data.csv"
-}
-
-lambda_result = lambda_handler(event, {})
-# print(lambda_result)
-# print(lambda_result['body'][['contract_id', 'lastName', 'value', 'length', 'season', 'percentage_of_season_salary_cap', 'cap_hit', 'aav']])
-# print(lambda_handler(event, {}))
-
-player_contracts = lambda_result['body']
-player_contracts['average_percentage_of_season_salary_cap'] = player_contracts.groupby('contract_id')['percentage_of_season_salary_cap'].transform('mean')
-
-player_contracts['season_span'] = player_contracts.groupby('contract_id')['season'].transform(lambda x: f"{x.min()} - {x.max()}")
-
-first_entry_per_contract = player_contracts.groupby('contract_id').first()
-
-
-print(first_entry_per_contract[[ 'lastName', 'value', 'length', 'cap_hit', 'aav', 'average_percentage_of_season_salary_cap', 'season_span']])
-
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "contract-stats-merged-data",
+        "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv",
+        "nearest_neighbors_prefix": "players/nearest_neighbors/nearest_neighbors_advanced_contracts.pkl",
+        "contract_id": 6131,
+        "contract_bucket_name": "puckpedia",
+        "contract_prefix": "players/merged_data/merged_data.csv"
+    }
 
+    lambda_result = lambda_handler(event, {})
+    # print(lambda_result)
+    # print(lambda_result['body'][['contract_id', 'lastName', 'value', 'length', 'season', 'percentage_of_season_salary_cap', 'cap_hit', 'aav']])
+    # print(lambda_handler(event, {}))
 
+    player_contracts = lambda_result['body']
+    player_contracts['average_percentage_of_season_salary_cap'] = player_contracts.groupby('contract_id')['percentage_of_season_salary_cap'].transform('mean')
 
+    player_contracts['season_span'] = player_contracts.groupby('contract_id')['season'].transform(lambda x: f"{x.min()} - {x.max()}")
 
+    first_entry_per_contract = player_contracts.groupby('contract_id').first()
 
 
+    print(first_entry_per_contract[[ 'lastName', 'value', 'length', 'cap_hit', 'aav', 'average_percentage_of_season_salary_cap', 'season_span']])
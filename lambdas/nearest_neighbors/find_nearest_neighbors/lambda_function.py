@@ -1,23 +1,17 @@
-import boto3
-import pandas as pd
-from io import StringIO
-import pickle
 import joblib
 import io
 from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler
+from o2k_io import read_cached_s3_object, read_table
+
+
 scaler = StandardScaler()
 
 
 def get_pickle_from_s3(bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        body = response['Body'].read()
-    
         # Load back into sklearn object
-        buffer = io.BytesIO(body)
-        model = joblib.load(buffer)
+        model = read_cached_s3_object(bucket_name, prefix, lambda body: joblib.load(io.BytesIO(body.read())))
         
         return {
             "statusCode": 200,
@@ -33,10 +27,7 @@ def get_pickle_from_s3(bucket_name, prefix):
         
 def get_data(bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, cached=True)
         return {
             "statusCode": 200,
             "message": "Data retrieved successfully",
@@ -108,13 +99,13 @@ def lambda_handler(event, context):
         }
         
         
-event = {
-    "bucket_name": "contract-stats-merged-data",
-    "nearest_neighbors_prefix": "players/nearest_neighbors/nearest_neighbors_advanced_contracts.pkl",
-    "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv",
-    "contract_id": "1234567890"
-}
-
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "contract-stats-merged-data",
+        "nearest_neighbors_prefix": "players/nearest_neighbors/nearest_neighbors_advanced_contracts.pkl",
+        "average_stats_prefix": "players/average_stats/average_stats_advanced_contracts.csv",
+        "contract_id": "1234567890"
+    }
 
-print(lambda_handler(event, {}))
 
+    print(lambda_handler(event, {}))
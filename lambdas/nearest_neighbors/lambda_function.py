@@ -1,8 +1,8 @@
-import boto3
 import pandas as pd
-from io import StringIO
 from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler
+from o2k_io import read_table
+
 
 scaler = StandardScaler()
 
@@ -10,10 +10,7 @@ scaler = StandardScaler()
 def get_data(bucket_name, prefix):
 
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix)
         return {
             "statusCode": 200,
             "message": "Data retrieved successfully",
@@ -183,11 +180,12 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "contract-stats-merged-data",
-    "merged_data_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
-    "contract_id": 9
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "contract-stats-merged-data",
+        "merged_data_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
+        "contract_id": 9
+    }
 
 
-print(lambda_handler(event, None))
+    print(lambda_handler(event, None))
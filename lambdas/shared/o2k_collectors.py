@@ -0,0 +1,520 @@
+# Plumbing shared by the NHL API stats collectors and the shard_collection driver that fans them out: the worker
+# reporting, the column buffer, incremental refreshes, checkpoints and the rolling part sink.
+# deploy.yml ships this file next to o2k_io in each function's layer.
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+import boto3
+import pandas as pd
+import requests
+from datetime import datetime
+from io import StringIO
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+from o2k_io import get_s3_client, read_s3_object
+
+# Workers are invoked asynchronously, so the client never waits on a run; retries are off because a retried
+# invoke starts a second worker on the same shard while the first one is still writing
+LAMBDA_CLIENT_CONFIG = Config(read_timeout=900, retries={"max_attempts": 0})
+lambda_client = None
+lambda_client_lock = threading.Lock()
+
+def get_lambda_client():
+    global lambda_client
+    with lambda_client_lock:
+        if lambda_client is None:
+            lambda_client = boto3.client("lambda", region_name="us-east-2", config=LAMBDA_CLIENT_CONFIG)
+        return lambda_client
+
+def get_stalled_response(previous_index, response):
+    # A checkpoint that did not move next_index would be resumed forever
+    if response.get('next_index', previous_index + 1) > previous_index:
+        return None
+    return {
+        "statusCode": 500,
+        "message": "Worker made no progress",
+        "body": f"Worker checkpointed at {response.get('next_index')} without collecting any ids"
+    }
+
+def report_worker_response(event, context, response):
+    # A worker started by shard_collection has no caller waiting for its return value: a checkpoint
+    # re-invokes the same function to carry on, anything else is written to result_key for the driver
+    if not event.get('result_key'):
+        return response
+    if response.get('statusCode') == 202:
+        stalled = get_stalled_response(event.get('next_index', 0), response)
+        if stalled is None:
+            try:
+                get_lambda_client().invoke(
+                    FunctionName=context.invoked_function_arn,
+                    InvocationType='Event',
+                    Payload=json.dumps({**event, "continuation_token": response['continuation_token'], "next_index": response['next_index']})
+                )
+                return response
+            except Exception as e:
+                stalled = {
+                    "statusCode": 500,
+                    "message": "Could not resume worker",
+                    "body": f"Could not resume worker from checkpoint {response['continuation_token']}: {e}"
+                }
+        response = stalled
+    try:
+        get_s3_client().put_object(Bucket=event['result_bucket_name'], Key=event['result_key'], Body=json.dumps(response, default=str), ContentType='application/json')
+    except Exception as e:
+        logging.error(f"Could not report worker result to s3://{event['result_bucket_name']}/{event['result_key']}: {e}")
+    return response
+
+def reports_to_driver(handler):
+    # Wraps a collector's lambda_handler so it can run as an asynchronous shard_collection worker
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        return report_worker_response(event, context, handler(event, context))
+    return wrapper
+
+def get_session(max_workers):
+    # One keep-alive connection per worker so concurrent requests reuse sockets
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    return session
+
+def has_time_left(context, margin_ms):
+    # Local runs pass no Lambda context and never checkpoint
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return True
+    return context.get_remaining_time_in_millis() > margin_ms
+
+def append_records(columns, records):
+    # Records go straight into per-column lists; keys missing from a record are padded with None
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    for record in records:
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * row_count
+            column.append(value)
+        row_count += 1
+        for column in columns.values():
+            if len(column) < row_count:
+                column.append(None)
+    return columns
+
+def build_dataframe(columns):
+    return pd.DataFrame(columns)
+
+def get_current_season():
+    # A new season's stats start appearing in the fall
+    today = datetime.now()
+    start_year = today.year if today.month >= 9 else today.year - 1
+    return int(f"{start_year}{start_year + 1}")
+
+def get_season_ids(first_season, last_season=None):
+    if last_season is None:
+        last_season = get_current_season() // 10000
+    return [int(f"{year}{year + 1}") for year in range(first_season, last_season + 1)]
+
+def order_by_nhl_ids(df, nhl_ids):
+    # Order rows like the per-player path: by position in nhl_ids, then season
+    order = {player_id: index for index, player_id in enumerate(nhl_ids)}
+    return df.assign(_order=df['playerId'].map(order)).sort_values(['_order', 'seasonId'], kind='stable').drop(columns=['_order'])
+
+def get_nhl_ids(bucket_name, prefix):
+    try:
+        data = read_s3_object(bucket_name, prefix, json.load)
+        return {
+            "statusCode": 200,
+            "message": "NHL IDs retrieved successfully",
+            "body": data['nhl_ids']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve NHL IDs",
+            "body": f"Could not retrieve NHL IDs: {e}"
+        }
+
+def get_nhl_id_changes(nhl_ids, collected_ids):
+    # Diffed against the ids the stored table already covers rather than get_player_ids' latest diff,
+    # so ids that a failed run or a second get_player_ids run skipped past are still collected
+    current = set(nhl_ids)
+    return {
+        "new_ids": [nhl_id for nhl_id in nhl_ids if nhl_id not in collected_ids],
+        "removed_ids": sorted(nhl_id for nhl_id in collected_ids if nhl_id not in current)
+    }
+
+# Incremental runs. name is the collector's table, e.g. "player_stats": the stored table is {prefix}{name}.csv
+# and the ids it covers are {prefix}{name}_ids.json
+
+def get_previous_stats(bucket_name, prefix, name):
+    try:
+        previous_stats = read_s3_object(bucket_name, f"{prefix}{name}.csv", pd.read_csv)
+        try:
+            # Ids without any stats never appear in the table, so the ids covered by the last run are tracked separately
+            collected_ids = set(read_s3_object(bucket_name, f"{prefix}{name}_ids.json", json.load)['nhl_ids'])
+        except Exception:
+            # Older runs did not record the ids they covered
+            collected_ids = set(previous_stats['playerId'].unique().tolist())
+        return {
+            "statusCode": 200,
+            "message": "Previous stats retrieved successfully",
+            "body": {
+                "stats": previous_stats,
+                "collected_ids": collected_ids
+            }
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve previous stats",
+            "body": f"Could not retrieve previous {name}: {e}"
+        }
+
+def save_collected_ids(nhl_ids, bucket_name, prefix, name):
+    try:
+        s3 = get_s3_client()
+        path = f"{prefix}{name}_ids.json"
+        s3.put_object(Bucket=bucket_name, Key=path, Body=json.dumps({"nhl_ids": nhl_ids}), ContentType='application/json')
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": "Saved to S3"
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
+
+def get_refresh_plan(event, nhl_ids, name):
+    # incremental refetches the open season and unseen ids; only_new_ids fetches unseen ids and drops removed ones,
+    # leaving the open season as it was. previous_stats stays None for a full refresh, including when there is no stored table.
+    plan = {"previous_stats": None, "collected_ids": None, "current_season": None, "unchanged": False}
+    if not (event.get('incremental', False) or event.get('only_new_ids', False)):
+        return plan
+    previous_stats = get_previous_stats(event['player_stats_bucket_name'], event['player_stats_prefix'], name)
+    if previous_stats['statusCode'] != 200:
+        logging.warning(f"Running a full refresh: {previous_stats['body']}")
+        return plan
+    plan['previous_stats'] = previous_stats['body']['stats']
+    plan['collected_ids'] = previous_stats['body']['collected_ids']
+    if event.get('only_new_ids', False):
+        changes = get_nhl_id_changes(nhl_ids, plan['collected_ids'])
+        plan['unchanged'] = not changes['new_ids'] and not changes['removed_ids']
+    else:
+        plan['current_season'] = event.get('current_season') or get_current_season()
+    return plan
+
+def upsert_stats(previous_stats, fresh_stats_list, nhl_ids):
+    keys = ['playerId', 'seasonId']
+    if not fresh_stats_list:
+        merged_stats = previous_stats
+    else:
+        fresh_stats = pd.concat(fresh_stats_list, ignore_index=True)
+        fresh_keys = pd.MultiIndex.from_frame(fresh_stats[keys])
+        previous_keys = pd.MultiIndex.from_frame(previous_stats[keys])
+        merged_stats = pd.concat([previous_stats[~previous_keys.isin(fresh_keys)], fresh_stats], ignore_index=True)
+    # Ids dropped from nhl_ids.json would also be missing from a full refresh
+    merged_stats = merged_stats[merged_stats['playerId'].isin(set(nhl_ids))]
+    return order_by_nhl_ids(merged_stats, nhl_ids)
+
+def collect_stats_incrementally(nhl_ids, plan, get_season_stats, collect_stats):
+    # get_season_stats(season_id, session=...) fetches one season for every id, collect_stats(ids) fetches whole careers
+    try:
+        # Completed seasons are frozen, so only the open season and unseen ids are fetched.
+        # Without a current_season (new ids only) the open season is left as it was.
+        current_season = plan['current_season']
+        new_ids = [nhl_id for nhl_id in nhl_ids if nhl_id not in plan['collected_ids']]
+        logging.info(f"Refreshing season {current_season} and {len(new_ids)} new ids")
+
+        fresh_stats_list = []
+        failed_ids = []
+        if current_season is not None:
+            session = get_session(1)
+            season_stats = get_season_stats(current_season, session=session)
+            session.close()
+            if season_stats['statusCode'] != 200:
+                return season_stats
+            season_df = pd.DataFrame(season_stats['body'])
+            if not season_df.empty:
+                # New ids get their full career below, which already covers the open season
+                known_ids = set(nhl_ids) - set(new_ids)
+                fresh_stats_list.append(season_df[season_df['playerId'].isin(known_ids)])
+
+        if new_ids:
+            new_stats = collect_stats(new_ids)
+            if new_stats['statusCode'] != 200:
+                return new_stats
+            fresh_stats_list.extend(new_stats['body'])
+            failed_ids = new_stats['failed_ids']
+
+        df = upsert_stats(plan['previous_stats'], fresh_stats_list, nhl_ids)
+        return {
+            "statusCode": 200,
+            "message": "Stats collected successfully",
+            "body": [df],
+            "failed_ids": failed_ids
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not collect stats incrementally",
+            "body": f"Could not collect stats incrementally: {e}"
+        }
+
+# Checkpoints. A run that nears the Lambda timeout saves its state under {prefix}checkpoints/{run_id}/ and returns a 202
+# with run_id as the continuation_token; the next invocation carries on from next_index.
+
+def new_checkpoint_state(nhl_ids):
+    return {
+        "run_id": uuid.uuid4().hex,
+        "nhl_ids": nhl_ids,
+        "next_index": 0,
+        "parts": [],
+        "failed_ids": []
+    }
+
+def get_checkpoint_prefix(prefix, run_id):
+    return f"{prefix}checkpoints/{run_id}/"
+
+def get_checkpoint_state(bucket_name, prefix, continuation_token):
+    try:
+        state = read_s3_object(bucket_name, f"{get_checkpoint_prefix(prefix, continuation_token)}state.json", json.load)
+        logging.info(f"Resuming run {state['run_id']} at {state['next_index']} of {len(state['nhl_ids'])} ids")
+        return {
+            "statusCode": 200,
+            "message": "Checkpoint retrieved successfully",
+            "body": state
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve checkpoint",
+            "body": f"Could not retrieve checkpoint {continuation_token}: {e}"
+        }
+
+def save_checkpoint(sink):
+    try:
+        state = sink['state']
+        flushed = sink_flush(sink)
+        if flushed['statusCode'] != 200:
+            return flushed
+        s3 = get_s3_client()
+        # The state is written last so a crash mid-checkpoint resumes from the previous one
+        s3.put_object(Bucket=sink['bucket_name'], Key=f"{sink['prefix']}state.json", Body=json.dumps(state), ContentType='application/json')
+        return {
+            "statusCode": 200,
+            "message": "Checkpoint saved",
+            "body": state['run_id']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not save checkpoint",
+            "body": f"Could not save checkpoint: {e}"
+        }
+
+def delete_checkpoint(state, bucket_name, prefix):
+    try:
+        s3 = get_s3_client()
+        checkpoint_prefix = get_checkpoint_prefix(prefix, state['run_id'])
+        keys = state['parts'] + [f"{checkpoint_prefix}state.json"]
+        s3.delete_objects(Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in keys]})
+    except Exception as e:
+        logging.warning(f"Could not delete checkpoint {state['run_id']}: {e}")
+
+def collect_stats_with_checkpoints(state, event, context, collect_stats):
+    # collect_stats(ids) fetches one batch and returns its frames and failed_ids
+    try:
+        nhl_ids = state['nhl_ids']
+        batch_size = event.get('checkpoint_batch_size', 100)
+        margin_ms = event.get('checkpoint_margin_ms', 60000)
+        sink = new_stats_sink(state, event['player_stats_bucket_name'], event['player_stats_prefix'], event.get('flush_rows', 5000))
+        start_index = state['next_index']
+        while state['next_index'] < len(nhl_ids):
+            # At least one batch runs per invocation, so a margin larger than the timeout still makes progress
+            if state['next_index'] > start_index and not has_time_left(context, margin_ms):
+                checkpoint = save_checkpoint(sink)
+                if checkpoint['statusCode'] != 200:
+                    return checkpoint
+                return {
+                    "statusCode": 202,
+                    "message": "Checkpoint saved",
+                    "body": f"Collected {state['next_index']} of {len(nhl_ids)} ids",
+                    "continuation_token": state['run_id'],
+                    "next_index": state['next_index']
+                }
+            batch_ids = nhl_ids[state['next_index']:state['next_index'] + batch_size]
+            stats = collect_stats(batch_ids)
+            if stats['statusCode'] != 200:
+                return stats
+            for df in stats['body']:
+                appended = sink_append(sink, df)
+                if appended['statusCode'] != 200:
+                    return appended
+            state['failed_ids'].extend(stats['failed_ids'])
+            state['next_index'] += len(batch_ids)
+
+        return {
+            "statusCode": 200,
+            "message": "Stats collected successfully",
+            "body": [],
+            "sink": sink,
+            "failed_ids": state['failed_ids']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not collect stats",
+            "body": f"Could not collect stats: {e}"
+        }
+
+# Part sink. Rows are flushed to part files under the run's checkpoint prefix so memory stays bounded,
+# and the parts are concatenated into the output once the run is done.
+
+def new_stats_sink(state, bucket_name, prefix, flush_rows):
+    state.setdefault('columns', None)
+    state.setdefault('dtypes', None)
+    return {
+        "state": state,
+        "bucket_name": bucket_name,
+        "prefix": get_checkpoint_prefix(prefix, state['run_id']),
+        "flush_rows": flush_rows,
+        "buffer": [],
+        "buffered_rows": 0
+    }
+
+def get_part_dtypes(df):
+    # Integer columns are made nullable, otherwise a frame with a missing value writes 1 as 1.0 in its part
+    dtypes = {}
+    for column, dtype in df.dtypes.items():
+        if dtype.kind in 'iu':
+            dtypes[column] = "Int64"
+        elif dtype.kind == 'f':
+            dtypes[column] = "float64"
+        elif dtype.kind == 'b':
+            dtypes[column] = "boolean"
+    return dtypes
+
+def widen_part_dtypes(sink, df):
+    # The dtypes are pinned from the first frame, so a later frame may not fit them, e.g. a fractional value in a
+    # column that only held whole numbers so far. Int64 is widened to float64 and anything else is unpinned rather
+    # than failing the run; parts already written keep their text, which reads back as the same values.
+    dtypes = sink['state']['dtypes']
+    for column, dtype in list(dtypes.items()):
+        try:
+            df[column].astype(dtype)
+        except (TypeError, ValueError):
+            if dtype == "Int64" and df[column].dtype.kind in 'iuf':
+                dtypes[column] = "float64"
+            else:
+                del dtypes[column]
+            logging.warning(f"Widening part column {column} from {dtype} to {dtypes.get(column, 'object')}")
+    sink['buffer'] = [frame.astype(dtypes) for frame in sink['buffer']]
+
+def sink_append(sink, df):
+    state = sink['state']
+    if state['columns'] is None:
+        state['columns'] = list(df.columns)
+        state['dtypes'] = get_part_dtypes(df)
+    elif list(df.columns) != state['columns']:
+        # Every part shares the first frame's schema so the parts can be concatenated byte-wise
+        extra_columns = [column for column in df.columns if column not in state['columns']]
+        if extra_columns:
+            # A column can't be added to parts already written, so the run stops instead of losing it
+            logging.error(f"Columns outside the part schema: {extra_columns}")
+            return {
+                "statusCode": 404,
+                "message": "Columns outside the part schema",
+                "body": f"Columns outside the part schema: {extra_columns}"
+            }
+        df = df.reindex(columns=state['columns'])
+    if state.get('dtypes') is None:
+        # Checkpoints written before dtypes were tracked take them from the next frame
+        state['dtypes'] = get_part_dtypes(df)
+    try:
+        df = df.astype(state['dtypes'])
+    except (TypeError, ValueError):
+        widen_part_dtypes(sink, df)
+        df = df.astype(state['dtypes'])
+    sink['buffer'].append(df)
+    sink['buffered_rows'] += len(df)
+    if sink['buffered_rows'] >= sink['flush_rows']:
+        return sink_flush(sink)
+    return {
+        "statusCode": 200,
+        "message": "Rows buffered",
+        "body": sink['buffered_rows']
+    }
+
+def sink_flush(sink):
+    try:
+        state = sink['state']
+        if sink['buffer']:
+            s3 = get_s3_client()
+            path = f"{sink['prefix']}part-{len(state['parts']):05d}.csv"
+            csv_buffer = StringIO()
+            pd.concat(sink['buffer']).to_csv(csv_buffer, index=False)
+            s3.put_object(Bucket=sink['bucket_name'], Key=path, Body=csv_buffer.getvalue())
+            state['parts'].append(path)
+            logging.info(f"Flushed {sink['buffered_rows']} rows to {path}")
+            sink['buffer'] = []
+            sink['buffered_rows'] = 0
+        return {
+            "statusCode": 200,
+            "message": "Rows flushed",
+            "body": state['parts']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not flush rows",
+            "body": f"Could not flush rows: {e}"
+        }
+
+def publish_stats_sink(sink, bucket_name, key):
+    try:
+        flushed = sink_flush(sink)
+        if flushed['statusCode'] != 200:
+            return flushed
+        parts = sink['state']['parts']
+        if not parts:
+            return {
+                "statusCode": 204,
+                "message": "No stats collected",
+                "body": "No stats collected"
+            }
+        s3 = get_s3_client()
+        # Parts are streamed through a temp file one chunk at a time, keeping only the first header
+        combined = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        try:
+            with combined:
+                for index, path in enumerate(parts):
+                    body = s3.get_object(Bucket=sink['bucket_name'], Key=path)['Body']
+                    header_skipped = index == 0
+                    for chunk in body.iter_chunks(1 << 20):
+                        if not header_skipped:
+                            newline = chunk.find(b"\n")
+                            if newline == -1:
+                                continue
+                            chunk = chunk[newline + 1:]
+                            header_skipped = True
+                        combined.write(chunk)
+            s3.upload_file(combined.name, bucket_name, key)
+        finally:
+            os.remove(combined.name)
+        return {
+            "statusCode": 200,
+            "message": "Saved to S3",
+            "body": "Saved to S3"
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not save to S3",
+            "body": f"Could not save to S3: {e}"
+        }
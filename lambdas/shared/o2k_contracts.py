@@ -0,0 +1,232 @@
+# Contract schema shared by the PuckPedia collectors, which write the wide and normalized layouts and the
+# change index, and by the stages that read them back (build_canonical_contracts and the stats/contract merges).
+# deploy.yml ships this file next to o2k_io in each function's layer.
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+from o2k_io import get_s3_client, read_s3_object
+
+def append_contract_rows(columns, player, contracts_key):
+    # One row per contract year, with year fields over contract fields over player fields.
+    # Columns are created in the order {**player, **contract, **year} would place them, and
+    # keys missing from a row are padded with None.
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    player_info = [(k, v) for k, v in player.items() if k != contracts_key]
+    for contract in player.get(contracts_key, []):
+        years = contract.get('years', [])
+        if not years:
+            continue
+        base = dict(player_info)
+        for k, v in contract.items():
+            if k != 'years':
+                base[k] = v
+        # Resolve the column lists once per contract rather than once per year
+        base_columns = []
+        for key, value in base.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * row_count
+            base_columns.append((key, value, column))
+        for year in years:
+            get = year.get
+            for key, value, column in base_columns:
+                column.append(get(key, value))
+            filled = len(base_columns)
+            for key, value in year.items():
+                if key in base:
+                    continue
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * row_count
+                column.append(value)
+                filled += 1
+            row_count += 1
+            if filled < len(columns):
+                for column in columns.values():
+                    if len(column) < row_count:
+                        column.append(None)
+    return columns
+
+# Normalized layout: each player, contract and contract year is stored once and linked by
+# player_key / contract_key instead of being repeated on every contract-year row
+CONTRACT_TABLES = ("players", "contracts", "contract_years")
+# A null cell reads back as "not set", which the join fills from the contract or player level, so the fields a record
+# sets to null on purpose are listed here ("|"-joined) to keep the wide layout's {**player, **contract, **year}
+NULL_FIELDS_COLUMN = "null_fields"
+
+def get_player_key(player_info):
+    # PuckPedia's own id, then the NHL id; a digest of the player fields as a last resort
+    for key in ('player_id', 'nhl_id'):
+        if player_info.get(key) is not None:
+            return f"{key}:{player_info[key]}"
+    return hashlib.sha1(json.dumps(player_info, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+# Terms that tell a player's contracts apart when PuckPedia sends one without a contract_id
+CONTRACT_KEY_FIELDS = ("signing_date", "length", "value")
+
+def get_contract_key(player_key, contract_info, years, seen):
+    if contract_info.get('contract_id') is not None:
+        return str(contract_info['contract_id'])
+    # Stable across runs as long as the contract keeps its first season and terms. seen counts the keys already
+    # given to this player's contracts, so two contracts alike in all of them are told apart by their order in the list.
+    first_season = min((str(year.get('season')) for year in years), default='')
+    key = "|".join([player_key, first_season, *(str(contract_info.get(field)) for field in CONTRACT_KEY_FIELDS)])
+    occurrence = seen.get(key, 0)
+    seen[key] = occurrence + 1
+    if occurrence:
+        key = f"{key}|{occurrence}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def append_record(columns, record):
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    for key, value in record.items():
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = [None] * row_count
+        column.append(value)
+    row_count += 1
+    if len(record) < len(columns):
+        for column in columns.values():
+            if len(column) < row_count:
+                column.append(None)
+    return columns
+
+def with_null_fields(record):
+    null_fields = [key for key, value in record.items() if value is None]
+    return {**record, NULL_FIELDS_COLUMN: "|".join(null_fields)} if null_fields else record
+
+def append_normalized_rows(tables, player, contracts_key):
+    player_info = {k: v for k, v in player.items() if k != contracts_key}
+    player_key = get_player_key(player_info)
+    append_record(tables['players'], with_null_fields({"player_key": player_key, **player_info}))
+    seen = {}
+    for contract in player.get(contracts_key, []):
+        years = contract.get('years', [])
+        contract_info = {k: v for k, v in contract.items() if k != 'years'}
+        contract_key = get_contract_key(player_key, contract_info, years, seen)
+        append_record(tables['contracts'], with_null_fields({"contract_key": contract_key, "player_key": player_key, **contract_info}))
+        for year in years:
+            append_record(tables['contract_years'], with_null_fields({"contract_key": contract_key, **year}))
+    return tables
+
+def append_contract_index(index, player, contracts_key):
+    # contract_key -> [content hash, nhl_id]; the hash covers the contract fields and all of its years
+    player_info = {k: v for k, v in player.items() if k != contracts_key}
+    player_key = get_player_key(player_info)
+    seen = {}
+    for contract in player.get(contracts_key, []):
+        contract_info = {k: v for k, v in contract.items() if k != 'years'}
+        contract_key = get_contract_key(player_key, contract_info, contract.get('years', []), seen)
+        digest = hashlib.sha1(json.dumps(contract, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        if contract_key in index:
+            # A contract_id PuckPedia repeats would otherwise overwrite the earlier copy, and a change to that copy
+            # would never reach the delta. Every copy is folded into the one entry's digest instead.
+            previous_digest, nhl_id = index[contract_key]
+            logging.warning(f"Contract {contract_key} appears more than once (nhl_id {nhl_id} and {player_info.get('nhl_id')}), tracking all copies under one key")
+            index[contract_key] = [hashlib.sha1(f"{previous_digest}|{digest}".encode('utf-8')).hexdigest()[:16], nhl_id]
+        else:
+            index[contract_key] = [digest, player_info.get('nhl_id')]
+    return index
+
+def build_contract_delta(previous_index, contract_index, source):
+    inserted = [key for key in contract_index if key not in previous_index]
+    deleted = [key for key in previous_index if key not in contract_index]
+    updated = [key for key, (digest, _) in contract_index.items() if key in previous_index and previous_index[key][0] != digest]
+    affected_nhl_ids = {contract_index[key][1] for key in inserted + updated} | {previous_index[key][1] for key in deleted + updated}
+    return {
+        "source": source,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "contracts": len(contract_index),
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": deleted,
+        "affected_nhl_ids": sorted(nhl_id for nhl_id in affected_nhl_ids if nhl_id is not None)
+    }
+
+def get_contract_index(bucket_name, prefix):
+    try:
+        data = read_s3_object(bucket_name, f"{prefix}contract_index.json", json.load)
+        return {
+            "statusCode": 200,
+            "message": "Contract index retrieved successfully",
+            "body": data['contracts']
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve contract index",
+            "body": f"Could not retrieve contract index: {e}"
+        }
+
+def save_contract_changes(contract_index, bucket_name, prefix, source):
+    # Diffs against the index of the previous snapshot and writes the delta next to the data.
+    # The index is replaced last, so a failed run is simply folded into the next run's delta.
+    try:
+        previous_index = get_contract_index(bucket_name, prefix)
+        if previous_index['statusCode'] == 200:
+            delta = build_contract_delta(previous_index['body'], contract_index, source)
+            delta['full_refresh'] = False
+        else:
+            logging.warning(f"No previous contract index, treating every contract as inserted: {previous_index['body']}")
+            delta = build_contract_delta({}, contract_index, source)
+            delta['full_refresh'] = True
+
+        s3 = get_s3_client()
+        delta_json = json.dumps(delta)
+        s3.put_object(Bucket=bucket_name, Key=f"{prefix}deltas/{delta['created_at']}.json", Body=delta_json, ContentType='application/json')
+        s3.put_object(Bucket=bucket_name, Key=f"{prefix}latest_delta.json", Body=delta_json, ContentType='application/json')
+        s3.put_object(Bucket=bucket_name, Key=f"{prefix}contract_index.json", Body=json.dumps({"contracts": contract_index}), ContentType='application/json')
+        summary = {key: len(delta[key]) for key in ("inserted", "updated", "deleted", "affected_nhl_ids")}
+        logging.info(f"Contract changes for {source}: {summary}")
+        return {
+            "statusCode": 200,
+            "message": "Contract changes saved to S3",
+            "body": summary
+        }
+    except Exception as e:
+        logging.error(f"Could not save contract changes to S3: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not save contract changes to S3",
+            "body": f"Could not save contract changes to S3: {e}"
+        }
+
+def get_field_presence(table):
+    # <column>__has is True where the record sets the field, to a value or to an explicit null
+    null_fields = table[NULL_FIELDS_COLUMN].fillna('').astype(str).str.split('|') if NULL_FIELDS_COLUMN in table else None
+    table = table.drop(columns=NULL_FIELDS_COLUMN, errors='ignore')
+    presence = {}
+    for column in table.columns:
+        if column not in ('player_key', 'contract_key'):
+            has = table[column].notna()
+            if null_fields is not None:
+                has |= null_fields.map(lambda fields: column in fields)
+            presence[f"{column}__has"] = has
+    return pd.concat([table, pd.DataFrame(presence, index=table.index)], axis=1)
+
+def join_contract_tables(players, contracts, contract_years):
+    # Rebuilds the wide one-row-per-contract-year view with the wide layout's {**player, **contract, **year} precedence:
+    # a field the year row sets is kept, explicit nulls included, and only the rest come from the contract, then the player.
+    # validate fails the join if a key repeats instead of silently duplicating year rows.
+    order = dict.fromkeys(c for table in (players, contracts, contract_years) for c in table.columns if c not in ('player_key', 'contract_key', NULL_FIELDS_COLUMN))
+    wide = get_field_presence(contract_years).merge(get_field_presence(contracts), on='contract_key', how='left', suffixes=('', '__contract'), validate='many_to_one')
+    wide = wide.merge(get_field_presence(players), on='player_key', how='left', suffixes=('', '__player'), validate='many_to_one')
+    columns = {}
+    for column in order:
+        # Unsuffixed is the most specific level that has the column, then __contract, then __player
+        levels = [suffix for suffix in ('', '__contract', '__player') if f"{column}{suffix}" in wide]
+        value = wide[f"{column}{levels[0]}"]
+        has = wide[f"{column}__has{levels[0]}"].fillna(False).astype(bool)
+        for suffix in levels[1:]:
+            value = value.where(has, wide[f"{column}{suffix}"])
+            has |= wide[f"{column}__has{suffix}"].fillna(False).astype(bool)
+        columns[column] = value
+    return pd.DataFrame(columns, index=wide.index)
+
+def get_table_key(prefix, name, storage_format="csv"):
+    # "partitioned" names a season-partitioned folder instead of a single object
+    if storage_format == "partitioned":
+        return f"{prefix}{name}/"
+    return f"{prefix}{name}.{storage_format}"
@@ -0,0 +1,629 @@
+# I/O shared by every lambda: S3 reads and writes, the CSV/Parquet/partitioned table layouts, the cached
+# Secrets Manager lookups and the rate-limited, optionally disk-cached HTTP client the collectors call their APIs through.
+# deploy.yml ships this file in each function's layer, so lambda_function.py imports it directly;
+# for local runs put lambdas/shared on PYTHONPATH.
+import boto3
+import hashlib
+import json
+import logging
+import os
+import pickle
+import random
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import chain
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+try:
+    import requests
+except ImportError:
+    requests = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# One S3 client per container, shared by every call and kept across warm invocations
+s3_client = None
+s3_client_lock = threading.Lock()
+s3_read_stats = {"objects": 0, "bytes": 0, "seconds": 0.0}
+
+def get_s3_client():
+    global s3_client
+    with s3_client_lock:
+        if s3_client is None:
+            s3_client = boto3.client("s3", region_name="us-east-2")
+        return s3_client
+
+# Content-Encodings the table writers compress with; readers undo them while streaming
+CONTENT_ENCODINGS = ("gzip", "zstd")
+
+def read_s3_object(bucket_name, key, parse):
+    # parse gets the streaming body, so the bytes go straight into the parser without a decoded copy
+    started = time.perf_counter()
+    response = get_s3_client().get_object(Bucket=bucket_name, Key=key)
+    try:
+        encoding = response.get('ContentEncoding')
+        data = parse(pa.CompressedInputStream(response['Body'], encoding) if encoding in CONTENT_ENCODINGS else response['Body'])
+    finally:
+        response['Body'].close()
+    elapsed = time.perf_counter() - started
+    size = response.get('ContentLength', 0)
+    with s3_client_lock:
+        s3_read_stats['objects'] += 1
+        s3_read_stats['bytes'] += size
+        s3_read_stats['seconds'] += elapsed
+    logging.info(f"Read s3://{bucket_name}/{key}: {size} bytes in {elapsed:.3f}s")
+    return data
+
+def reset_s3_read_stats():
+    # Called at the start of a handler, so the stats cover one invocation rather than the container's lifetime
+    with s3_client_lock:
+        s3_read_stats.update({"objects": 0, "bytes": 0, "seconds": 0.0})
+
+def get_s3_read_stats():
+    with s3_client_lock:
+        return {**s3_read_stats, "seconds": round(s3_read_stats['seconds'], 3)}
+
+# Parsed objects are cached for the life of the container: in memory up to OBJECT_CACHE_MAX_BYTES and as pickles
+# in OBJECT_CACHE_DIR up to OBJECT_CACHE_DISK_MAX_BYTES, least recently used first out of each. An entry is only
+# reused while a HEAD of the object still returns the ETag it was read at, so a warm query costs one HEAD instead
+# of a download and a parse. Cached values are shared between calls and must not be modified in place.
+OBJECT_CACHE_DIR = "/tmp/s3_object_cache"
+OBJECT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+OBJECT_CACHE_DISK_MAX_BYTES = 384 * 1024 * 1024
+object_cache = OrderedDict()
+object_cache_files = OrderedDict()
+object_cache_lock = threading.Lock()
+object_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+object_cache_dir_ready = False
+
+def evict_cache_entries(entries, max_bytes, on_evict=None):
+    total = sum(entry['size'] for entry in entries.values())
+    while total > max_bytes and entries:
+        _, entry = entries.popitem(last=False)
+        total -= entry['size']
+        if on_evict:
+            on_evict(entry)
+
+def remove_cache_file(entry):
+    try:
+        os.remove(entry['path'])
+    except OSError:
+        pass
+
+def get_object_cache_path(cache_key):
+    global object_cache_dir_ready
+    if not object_cache_dir_ready:
+        # Files left by an earlier process in this container are not in the index, so start from an empty folder
+        shutil.rmtree(OBJECT_CACHE_DIR, ignore_errors=True)
+        os.makedirs(OBJECT_CACHE_DIR, exist_ok=True)
+        object_cache_dir_ready = True
+    return os.path.join(OBJECT_CACHE_DIR, hashlib.sha1(json.dumps(cache_key).encode('utf-8')).hexdigest() + ".pkl")
+
+def read_cached_s3_object(bucket_name, key, parse, variant=None):
+    # variant tells apart different parses of the same object, e.g. different column projections
+    etag = get_s3_client().head_object(Bucket=bucket_name, Key=key)['ETag']
+    cache_key = [bucket_name, key, variant]
+    cache_id = json.dumps(cache_key)
+    with object_cache_lock:
+        entry = object_cache.get(cache_id)
+        if entry and entry['etag'] == etag:
+            object_cache.move_to_end(cache_id)
+            object_cache_stats['memory_hits'] += 1
+            return entry['data']
+        file_entry = object_cache_files.get(cache_id)
+        if file_entry and file_entry['etag'] == etag:
+            object_cache_files.move_to_end(cache_id)
+    if file_entry and file_entry['etag'] == etag:
+        with open(file_entry['path'], 'rb') as cache_file:
+            data = pickle.load(cache_file)
+        with object_cache_lock:
+            object_cache_stats['disk_hits'] += 1
+            object_cache[cache_id] = {"etag": etag, "data": data, "size": file_entry['size']}
+            evict_cache_entries(object_cache, OBJECT_CACHE_MAX_BYTES)
+        return data
+
+    data = read_s3_object(bucket_name, key, parse)
+    blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    with object_cache_lock:
+        object_cache_stats['misses'] += 1
+        if len(blob) <= OBJECT_CACHE_MAX_BYTES:
+            object_cache[cache_id] = {"etag": etag, "data": data, "size": len(blob)}
+            object_cache.move_to_end(cache_id)
+            evict_cache_entries(object_cache, OBJECT_CACHE_MAX_BYTES)
+        if len(blob) <= OBJECT_CACHE_DISK_MAX_BYTES:
+            path = get_object_cache_path(cache_key)
+            try:
+                with open(path, 'wb') as cache_file:
+                    cache_file.write(blob)
+                object_cache_files[cache_id] = {"etag": etag, "path": path, "size": len(blob)}
+                object_cache_files.move_to_end(cache_id)
+                evict_cache_entries(object_cache_files, OBJECT_CACHE_DISK_MAX_BYTES, remove_cache_file)
+            except OSError as e:
+                logging.warning(f"Could not cache s3://{bucket_name}/{key} in {OBJECT_CACHE_DIR}: {e}")
+    return data
+
+def get_object_cache_stats():
+    with object_cache_lock:
+        return {**object_cache_stats, "memory_bytes": sum(entry['size'] for entry in object_cache.values()), "disk_bytes": sum(entry['size'] for entry in object_cache_files.values())}
+
+def read_object(bucket_name, key, parse, variant=None, cached=False):
+    # cached goes through the object cache above; otherwise every call downloads and parses the object again
+    if cached:
+        return read_cached_s3_object(bucket_name, key, parse, variant)
+    return read_s3_object(bucket_name, key, parse)
+
+# Tables are CSV when the key ends in .csv, .csv.gz or .csv.zst and Parquet otherwise; Parquet keeps dtypes and lets readers load only some columns
+PARQUET_COMPRESSION = "zstd"
+
+def read_table(bucket_name, key, columns=None, seasons=None, engine=None, cached=False):
+    if key.endswith('/'):
+        return read_partitioned_table(bucket_name, key, columns, seasons, cached)
+    if seasons is not None and columns is not None and PARTITION_COLUMN not in columns:
+        return read_table(bucket_name, key, [*columns, PARTITION_COLUMN], seasons, engine, cached).drop(columns=PARTITION_COLUMN)
+    if is_csv_key(key):
+        data = read_csv_table(bucket_name, key, columns, engine, cached)
+    else:
+        data = read_object(bucket_name, key, lambda body: pd.read_parquet(BytesIO(body.read()), columns=columns), columns, cached)
+    if seasons is not None:
+        data = data[data[PARTITION_COLUMN].isin(seasons)].reset_index(drop=True)
+    return data
+
+# Keys ending in / are Hive-style datasets with one folder per season: {key}season=20232024/part-00000.parquet.
+# The season lives in the folder name, so reads filtered by season only download the matching folders.
+PARTITION_COLUMN = "season"
+
+def get_partition_value(value):
+    return int(value) if value.lstrip('-').isdigit() else value
+
+def list_partitions(bucket_name, prefix):
+    partitions = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}{PARTITION_COLUMN}="):
+        for item in page.get('Contents', []):
+            folder, _, name = item['Key'][len(prefix):].partition('/')
+            if name.startswith('part-'):
+                partitions.setdefault(get_partition_value(folder.split('=', 1)[1]), []).append(item['Key'])
+    return partitions
+
+def read_partitioned_table(bucket_name, prefix, columns=None, seasons=None, cached=False):
+    partitions = list_partitions(bucket_name, prefix)
+    if seasons is not None:
+        wanted = set(seasons)
+        partitions = {season: keys for season, keys in partitions.items() if season in wanted}
+    if not partitions:
+        raise FileNotFoundError(f"No {PARTITION_COLUMN} partitions found under s3://{bucket_name}/{prefix}")
+    file_columns = None if columns is None else [column for column in columns if column != PARTITION_COLUMN]
+    frames = []
+    for season in sorted(partitions):
+        for key in sorted(partitions[season]):
+            frame = read_table(bucket_name, key, file_columns, cached=cached)
+            frame[PARTITION_COLUMN] = season
+            frames.append(frame)
+    data = pd.concat(frames, ignore_index=True)
+    return data if columns is None else data[columns]
+
+# Every table carries a digest of its contents in its metadata; a write whose digest matches the stored one
+# is skipped, and write_table returns whether anything changed so the next stages can be skipped too
+CONTENT_HASH_METADATA_KEY = "content-sha256"
+
+def get_content_hash(data):
+    # Hashes column names, dtypes and values rather than the encoded bytes, so it is stable across chunking and codecs
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in data.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def get_stored_content_hash(bucket_name, key):
+    try:
+        return get_s3_client().head_object(Bucket=bucket_name, Key=key)['Metadata'].get(CONTENT_HASH_METADATA_KEY)
+    except Exception:
+        return None
+
+def write_table(data, bucket_name, key, seasons=None):
+    if key.endswith('/'):
+        return write_partitioned_table(data, bucket_name, key, seasons)
+    content_hash = get_content_hash(data)
+    if get_stored_content_hash(bucket_name, key) == content_hash:
+        logging.info(f"Skipping write to s3://{bucket_name}/{key}: contents unchanged")
+        return False
+    metadata = {CONTENT_HASH_METADATA_KEY: content_hash}
+    if is_csv_key(key):
+        write_csv_table(data, bucket_name, key, metadata)
+        return True
+    buffer = BytesIO()
+    data.to_parquet(buffer, index=False, compression=PARQUET_COMPRESSION)
+    get_s3_client().put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue(), ContentType='application/vnd.apache.parquet', Metadata=metadata)
+    return True
+
+def write_partitioned_table(data, bucket_name, prefix, seasons=None):
+    # seasons limits the write to those folders, so a one-season refresh leaves every other season untouched.
+    # Without it the frame is the whole table, and folders for seasons it no longer has are deleted.
+    missing = data[PARTITION_COLUMN].isna().sum()
+    if missing:
+        logging.warning(f"Dropping {missing} rows without a {PARTITION_COLUMN} from s3://{bucket_name}/{prefix}")
+    changed = False
+    written = set()
+    for season, partition in data.groupby(PARTITION_COLUMN, sort=True):
+        if isinstance(season, float) and season.is_integer():
+            season = int(season)
+        written.add(season)
+        changed |= write_table(partition.drop(columns=PARTITION_COLUMN), bucket_name, f"{prefix}{PARTITION_COLUMN}={season}/part-00000.parquet")
+    replaced = None if seasons is None else set(seasons)
+    stale = [key for season, keys in list_partitions(bucket_name, prefix).items() if season not in written and (replaced is None or season in replaced) for key in keys]
+    if stale:
+        logging.info(f"Deleting {len(stale)} partition files under s3://{bucket_name}/{prefix} for seasons no longer in the table")
+        s3 = get_s3_client()
+        for start in range(0, len(stale), 1000):
+            s3.delete_objects(Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in stale[start:start + 1000]]})
+        changed = True
+    return changed
+
+# The suffix of a CSV key picks the Content-Encoding it is compressed with
+CSV_CONTENT_ENCODINGS = {".csv": None, ".csv.gz": "gzip", ".csv.zst": "zstd"}
+# CSV is encoded CSV_CHUNK_ROWS rows at a time and uploaded in parts of at least MULTIPART_PART_SIZE bytes
+# (S3's minimum is 5 MiB), so the whole file never sits in memory as one string
+CSV_CHUNK_ROWS = 20000
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+def is_csv_key(key):
+    return key.endswith(tuple(CSV_CONTENT_ENCODINGS))
+
+# CSV tables are parsed by pandas unless a stage opts into pyarrow's multithreaded reader with engine "arrow".
+# Arrow is faster but peaks at roughly twice the memory on large files (see benchmark_csv_engines.py),
+# so it is only worth it where the stage's memory setting has room for that.
+CSV_ENGINES = ("arrow", "pandas")
+CSV_ENGINE = "pandas"
+# Label and date columns are always text, as pandas reads them, even when a file has them empty or numeric-looking;
+# other columns are inferred. Ids stay inferred because merges write them as floats once a row has no match.
+CSV_COLUMN_TYPES = {
+    "situation": pa.string(), "name": pa.string(), "team": pa.string(), "position": pa.string(),
+    "signing_date": pa.string(), "birthDate": pa.string()
+}
+# pandas' default missing-value markers, so both engines read the same cells as missing
+CSV_NULL_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+def read_csv(body, columns=None, engine=CSV_ENGINE):
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine {engine}, expected one of {', '.join(CSV_ENGINES)}")
+    if engine == "pandas":
+        return pd.read_csv(body, usecols=columns)
+    convert_options = pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES, include_columns=columns, null_values=CSV_NULL_VALUES, strings_can_be_null=True)
+    table = pa_csv.read_csv(body, read_options=pa_csv.ReadOptions(use_threads=True), convert_options=convert_options)
+    # Casting a parsed date back to text would not give the original cell back, so an unlisted date column is an error
+    # and read_csv_table reads the file with pandas instead
+    temporal = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+    if temporal:
+        raise pa.ArrowInvalid(f"Arrow inferred dates or times in {temporal}; add them to CSV_COLUMN_TYPES to read them as text")
+    return table.to_pandas()
+
+def read_csv_table(bucket_name, key, columns=None, engine=None, cached=False):
+    engine = engine or CSV_ENGINE
+    try:
+        return read_object(bucket_name, key, lambda body: read_csv(body, columns, engine), [columns, engine], cached)
+    except pa.ArrowInvalid as e:
+        # Arrow is stricter than pandas, e.g. it rejects short rows that pandas pads with NaN, so the file is read again with pandas
+        if engine != "arrow":
+            raise
+        logging.warning(f"Arrow could not parse s3://{bucket_name}/{key}, reading it with pandas: {e}")
+        return read_csv_table(bucket_name, key, columns, "pandas", cached)
+
+class PartBuffer:
+    # File-like sink for the compressor; finished bytes are drained from it one part at a time
+    def __init__(self):
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        part = bytes(self.buffer)
+        self.buffer.clear()
+        return part
+
+def iter_csv_parts(data, content_encoding=None):
+    sink = PartBuffer()
+    stream = pa.CompressedOutputStream(sink, content_encoding) if content_encoding else sink
+    parts = 0
+    for start in range(0, max(len(data), 1), CSV_CHUNK_ROWS):
+        stream.write(data.iloc[start:start + CSV_CHUNK_ROWS].to_csv(index=False, header=start == 0).encode('utf-8'))
+        if len(sink.buffer) >= MULTIPART_PART_SIZE:
+            parts += 1
+            yield sink.drain()
+    stream.close()
+    if sink.buffer or not parts:
+        yield sink.drain()
+
+def upload_part(bucket_name, key, upload_id, part_number, body):
+    response = get_s3_client().upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)
+    return {"PartNumber": part_number, "ETag": response['ETag']}
+
+def write_csv_table(data, bucket_name, key, metadata=None):
+    content_encoding = next(encoding for suffix, encoding in CSV_CONTENT_ENCODINGS.items() if key.endswith(suffix))
+    extra_args = {"ContentType": "text/csv", "Metadata": metadata or {}}
+    if content_encoding:
+        extra_args["ContentEncoding"] = content_encoding
+    s3 = get_s3_client()
+    parts = iter_csv_parts(data, content_encoding)
+    first_part = next(parts)
+    second_part = next(parts, None)
+    if second_part is None:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=first_part, **extra_args)
+        return
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key, **extra_args)['UploadId']
+    try:
+        # Each part uploads in the background while the next one is encoded; at most one part is in flight
+        futures = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for part_number, body in enumerate(chain([first_part, second_part], parts), start=1):
+                futures.append(executor.submit(upload_part, bucket_name, key, upload_id, part_number, body))
+                if len(futures) > 1:
+                    futures[-2].result()
+        s3.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": [future.result() for future in futures]})
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
+
+# Independent inputs are read on a small thread pool, so a stage waits for its slowest input instead of the sum of all of them
+FETCH_MAX_WORKERS = 4
+
+def fetch_frames(reads, max_workers=FETCH_MAX_WORKERS):
+    # reads maps a name to (function, *args); all calls run at once and their results come back under the same names
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(reads)))) as executor:
+        futures = {name: executor.submit(function, *args) for name, (function, *args) in reads.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+# Secrets are kept at module scope, so warm invocations skip Secrets Manager until the TTL runs out
+SECRETS_TTL = 15 * 60
+secrets_cache = {}
+secrets_lock = threading.Lock()
+
+def fetch_secret(client, name):
+    response = client.get_secret_value(SecretId=name)
+    if "SecretString" in response:
+        return json.loads(response["SecretString"])
+    return response["SecretBinary"]  # base64 encoded
+
+def get_secrets(names=("PuckPedia",), ttl=SECRETS_TTL):
+    try:
+        now = time.monotonic()
+        secrets = {}
+        with secrets_lock:
+            for name in names:
+                cached = secrets_cache.get(name)
+                if cached is not None and now - cached['fetched'] < ttl:
+                    secrets[name] = cached['value']
+        missing = [name for name in names if name not in secrets]
+        if missing:
+            # LOCAL_SECRETS_PATH points at a JSON file shaped like {"PuckPedia": {"PuckPedia": "<api key>"}} for offline runs
+            local_secrets_path = os.environ.get('LOCAL_SECRETS_PATH')
+            if local_secrets_path:
+                with open(local_secrets_path, 'r') as f:
+                    local_secrets = json.load(f)
+            else:
+                client = boto3.client("secretsmanager", region_name="us-east-2")
+            for name in missing:
+                try:
+                    value = local_secrets[name] if local_secrets_path else fetch_secret(client, name)
+                except Exception as e:
+                    logging.error(f"Could not retrieve secret {name}: {e}")
+                    return {
+                        "statusCode": 404,
+                        "message": "Could not retrieve secret",
+                        "body": f"Could not retrieve secret {name}: {e}"
+                    }
+                with secrets_lock:
+                    secrets_cache[name] = {"value": value, "fetched": now}
+                secrets[name] = value
+        return {
+            "statusCode": 200,
+            "message": "Secrets retrieved successfully",
+            "secrets": secrets
+        }
+    except Exception as e:
+        logging.error(f"Could not retrieve secrets: {e}")
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve secrets",
+            "body": f"Could not retrieve secrets: {e}"
+        }
+
+# Token bucket shared by every request in the run, slowed down on 429 and retried within a budget
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+rate_limiter = {
+    "max_rate": 10.0, "rate": 10.0, "min_rate": 0.5, "tokens": 10.0, "updated": time.monotonic(),
+    "max_retries": 5, "retry_budget": 200, "retries": 0, "requests": 0, "throttled": 0, "started": time.monotonic()
+}
+rate_limiter_lock = threading.Lock()
+
+def configure_rate_limiter(requests_per_second=10.0, max_retries=5, retry_budget=200):
+    with rate_limiter_lock:
+        now = time.monotonic()
+        rate_limiter.update({
+            "max_rate": requests_per_second, "rate": requests_per_second, "tokens": requests_per_second, "updated": now,
+            "max_retries": max_retries, "retry_budget": retry_budget, "retries": 0, "requests": 0, "throttled": 0, "started": now
+        })
+
+def get_rate_limiter_stats():
+    elapsed = time.monotonic() - rate_limiter['started']
+    return {
+        "requests": rate_limiter['requests'],
+        "retries": rate_limiter['retries'],
+        "throttled": rate_limiter['throttled'],
+        "current_rate": round(rate_limiter['rate'], 2),
+        "requests_per_second": round(rate_limiter['requests'] / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+def acquire_token():
+    while True:
+        with rate_limiter_lock:
+            now = time.monotonic()
+            rate = rate_limiter['rate']
+            rate_limiter['tokens'] = min(rate, rate_limiter['tokens'] + (now - rate_limiter['updated']) * rate)
+            rate_limiter['updated'] = now
+            if rate_limiter['tokens'] >= 1:
+                rate_limiter['tokens'] -= 1
+                rate_limiter['requests'] += 1
+                return
+            wait = (1 - rate_limiter['tokens']) / rate
+        time.sleep(wait)
+
+def record_throttled():
+    # Multiplicative decrease on 429, additive increase on success
+    with rate_limiter_lock:
+        rate_limiter['rate'] = max(rate_limiter['min_rate'], rate_limiter['rate'] / 2)
+        rate_limiter['tokens'] = 0
+        rate_limiter['throttled'] += 1
+
+def record_success():
+    with rate_limiter_lock:
+        rate_limiter['rate'] = min(rate_limiter['max_rate'], rate_limiter['rate'] + 0.1)
+
+def take_retry():
+    with rate_limiter_lock:
+        if rate_limiter['retries'] >= rate_limiter['retry_budget']:
+            return False
+        rate_limiter['retries'] += 1
+        return True
+
+def get_retry_delay(response, attempt):
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return int(response.headers['Retry-After'])
+    return random.uniform(0, min(30, 0.5 * 2 ** attempt))
+
+def rate_limited_get(url, session=None, headers=None, timeout=30, **kwargs):
+    attempt = 0
+    while True:
+        acquire_token()
+        response = None
+        try:
+            response = (session or requests).get(url, headers=headers, timeout=timeout, **kwargs)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                record_success()
+                return response
+            if response.status_code == 429:
+                record_throttled()
+            error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        attempt += 1
+        if attempt > rate_limiter['max_retries'] or not take_retry():
+            logging.error(f"Giving up on {url} after {attempt} attempts")
+            raise error
+        delay = get_retry_delay(response, attempt)
+        logging.warning(f"Retrying {url} in {delay:.1f}s: {error}")
+        time.sleep(delay)
+
+def decode_json(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+# On-disk response cache, enabled by setting cache_dir in the event
+CACHE_TTLS = {
+    "stats/rest/en/skater/summary": 12 * 60 * 60,
+    "stats/rest/en/goalie/summary": 12 * 60 * 60,
+    "/landing": 24 * 60 * 60,
+}
+NEGATIVE_CACHE_TTL = 7 * 24 * 60 * 60
+response_cache = {"dir": None, "hits": 0, "negative_hits": 0, "revalidated": 0, "misses": 0}
+response_cache_lock = threading.Lock()
+
+def configure_response_cache(cache_dir):
+    # Warm containers keep module state, so the counters start over with each invocation
+    with response_cache_lock:
+        response_cache.update(dir=cache_dir, hits=0, negative_hits=0, revalidated=0, misses=0)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+def get_cache_stats():
+    return {k: v for k, v in response_cache.items() if k != 'dir'}
+
+def count_cache(counter):
+    with response_cache_lock:
+        response_cache[counter] += 1
+
+def get_cache_ttl(url):
+    for endpoint, ttl in CACHE_TTLS.items():
+        if endpoint in url:
+            return ttl
+    return 0
+
+def get_cache_path(url):
+    return os.path.join(response_cache['dir'], f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json")
+
+def read_cached_response(url):
+    try:
+        with open(get_cache_path(url), 'rb') as f:
+            return decode_json(f.read())
+    except Exception:
+        return None
+
+def write_cached_response(url, entry):
+    try:
+        path = get_cache_path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not cache response for {url}: {e}")
+
+def get_cached_json(url, session=None, negative_ttl=0):
+    if not response_cache['dir']:
+        return decode_json(rate_limited_get(url, session).content)
+
+    now = time.time()
+    cached = read_cached_response(url)
+    if cached is not None:
+        ttl = negative_ttl if cached['negative'] else get_cache_ttl(url)
+        if now - cached['fetched_at'] < ttl:
+            count_cache('negative_hits' if cached['negative'] else 'hits')
+            return cached['body']
+
+    headers = {}
+    if cached is not None and not cached['negative']:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    response = rate_limited_get(url, session, headers)
+
+    if response.status_code == 304 and cached is not None:
+        count_cache('revalidated')
+        cached['fetched_at'] = now
+        write_cached_response(url, cached)
+        return cached['body']
+
+    count_cache('misses')
+    if response.status_code == 404:
+        body = None
+    else:
+        body = decode_json(response.content)
+    # Empty per-player results (skaters in the goalie run and vice versa) are cached as negatives;
+    # season queries pass no negative_ttl, so an empty page only lives as long as the endpoint TTL
+    negative = bool(negative_ttl) and (body is None or (isinstance(body, dict) and body.get('total') == 0))
+    if response.ok or negative:
+        write_cached_response(url, {
+            "url": url,
+            "fetched_at": now,
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "negative": negative,
+            "body": body
+        })
+    return body
@@ -1,22 +1,14 @@
-import boto3
-import pandas as pd
-import json
 import os
 import sys
-import logging
 import requests
 import re
-import time
-from io import StringIO
 import tqdm     
+from o2k_io import read_table, write_table
 
 
-def get_merged_stats(bucket_name, prefix):
+def get_merged_stats(bucket_name, prefix, seasons=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, seasons=seasons)
         return {
             "statusCode": 200,
             "message": "Merged stats retrieved successfully",
@@ -68,16 +60,15 @@ def calculate_advanced_stats(merged_stats):
             "body": f"Could not calculate advanced stats: {e}"
         }
 
-def save_to_s3(data, bucket_name, prefix):
+def save_to_s3(data, bucket_name, prefix, seasons=None):
 
     try:
-        data = data.to_csv(index=False)
-        s3 = boto3.client("s3", region_name="us-east-2")
-        s3.put_object(Bucket=bucket_name, Key=prefix, Body=data)
+        changed = write_table(data, bucket_name, prefix, seasons)
         return {
             "statusCode": 200,
             "message": "Data saved successfully",
-            "body": "Data saved successfully"
+            "body": "Data saved successfully",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -88,7 +79,14 @@ def save_to_s3(data, bucket_name, prefix):
 
 def lambda_handler(event, context):
     try:
-        merged_stats = get_merged_stats(event['bucket_name'], event['merged_stats_prefix'])
+        # seasons refreshes just those seasons, which only makes sense when the other seasons live in their own folders
+        if 'seasons' in event and not event['advanced_stats_prefix'].endswith('/'):
+            return {
+                "statusCode": 404,
+                "message": "seasons needs a partitioned output",
+                "body": "seasons needs a partitioned advanced_stats_prefix ending in /, otherwise the other seasons would be overwritten"
+            }
+        merged_stats = get_merged_stats(event['bucket_name'], event['merged_stats_prefix'], event.get('seasons'))
         print(merged_stats['body'].columns)
         if merged_stats['statusCode'] == 200:
             advanced_stats = calculate_advanced_stats(merged_stats['body'])
@@ -97,12 +95,13 @@ def lambda_handler(event, context):
                 # print(merged_stats.columns)
                 # advanced_stats = advanced_stats['body']
                 # merged_stats = pd.merge(merged_stats, advanced_stats, on='playerId', how='left', suffixes=("", ""))
-                save_to_s3_response = save_to_s3(advanced_stats['body'], event['bucket_name'], event['advanced_stats_prefix'])
+                save_to_s3_response = save_to_s3(advanced_stats['body'], event['bucket_name'], event['advanced_stats_prefix'], event.get('seasons'))
                 if save_to_s3_response['statusCode'] == 200:
                     return {
                         "statusCode": 200,
                         "message": "Add advanced stats",
-                        "body": "Add advanced stats"
+                        "body": "Add advanced stats",
+                        "changed": save_to_s3_response['changed']
                     }
                 else:
                     return {
@@ -133,14 +132,14 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "puckpedia",
-    "merged_stats_prefix": "players/merged_data/merged_data.csv",
-    "advanced_stats_prefix": "players/advanced_stats/advanced_stats.csv",
-    "advanced_stats_bucket_name": "puckpedia",
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "merged_stats_prefix": "players/merged_data/merged_data.csv",
+        "advanced_stats_prefix": "players/advanced_stats/advanced_stats.csv",
+        "advanced_stats_bucket_name": "puckpedia",
+    }
+
+    print(lambda_handler(event, None))
+
 
-print(lambda_handler(event, None))
-    
-        
-        
\ No newline at end of file
@@ -1,12 +1,11 @@
-import boto3
 import pandas as pd
-from io import StringIO
 import os
+from o2k_io import read_table, write_table, fetch_frames
 
 
 # def get_large_data(bucket_name, prefix):
 #     try:
-#         s3 = boto3.client("s3", region_name="us-east-2")
+#         s3 = get_s3_client()
 #         tmp_path = f"/tmp/{os.path.basename(prefix)}"
 
 #         s3.download_file(bucket_name, prefix, tmp_path)
@@ -24,12 +23,9 @@ import os
 #             "body": f"Data not found: {e}"
 #         }
 
-def get_data(bucket_name, prefix):
+def get_data(bucket_name, prefix, seasons=None, engine=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, seasons=seasons, engine=engine)
         return {
             "statusCode": 200,
             "message": "Data retrieved successfully",
@@ -48,15 +44,15 @@ def merge_data(contract_stats, advanced_stats):
     return merged_stats
 
 
-def save_to_s3(data, bucket_name, prefix):
+def save_to_s3(data, bucket_name, prefix, seasons=None):
 
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        s3.put_object(Bucket=bucket_name, Key=prefix, Body=data.to_csv(index=False))
+        changed = write_table(data, bucket_name, prefix, seasons)
         return {
             "statusCode": 200,
             "message": "Data saved successfully",
-            "body": "Data saved successfully"
+            "body": "Data saved successfully",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -67,20 +63,32 @@ def save_to_s3(data, bucket_name, prefix):
 
 def lambda_handler(event, context):
     try:
-        contract_stats = get_data(event['bucket_name'], event['contract_stats_prefix'])
+        # seasons refreshes just those seasons, which only makes sense when the other seasons live in their own folders
+        if 'seasons' in event and not event['save_to_s3_prefix'].endswith('/'):
+            return {
+                "statusCode": 404,
+                "message": "seasons needs a partitioned output",
+                "body": "seasons needs a partitioned save_to_s3_prefix ending in /, otherwise the other seasons would be overwritten"
+            }
+        inputs = fetch_frames({
+            "contract_stats": (get_data, event['bucket_name'], event['contract_stats_prefix'], event.get('seasons'), event.get('csv_engine')),
+            "advanced_stats": (get_data, event['advanced_stats_bucket_name'], event['advanced_stats_prefix'], event.get('seasons'), event.get('csv_engine'))
+        })
+        contract_stats = inputs['contract_stats']
         if contract_stats['statusCode'] == 200:
-            advanced_stats = get_data(event['advanced_stats_bucket_name'], event['advanced_stats_prefix'])
+            advanced_stats = inputs['advanced_stats']
             
             if advanced_stats['statusCode'] == 200:
                 contract_stats['body'].drop(columns=['position', 'season'], inplace=True)
                 merged_stats = pd.merge(contract_stats['body'], advanced_stats['body'], left_on=['playerId', 'seasonId'], right_on=['playerId', 'season'], how='inner', suffixes=("", ""))
                 
-                save_to_s3_response = save_to_s3(merged_stats, event['save_to_s3_bucket_name'], event['save_to_s3_prefix'])
+                save_to_s3_response = save_to_s3(merged_stats, event['save_to_s3_bucket_name'], event['save_to_s3_prefix'], event.get('seasons'))
                 if save_to_s3_response['statusCode'] == 200:
                     return {
                         "statusCode": 200,
                         "message": "Merge advanced stats and regular stats",
-                        "body": "Merge advanced stats and regular stats"
+                        "body": "Merge advanced stats and regular stats",
+                        "changed": save_to_s3_response['changed']
                     }
                 else:
                     return {    
@@ -112,13 +120,14 @@ def lambda_handler(event, context):
         
         
         
-event = {
-    "bucket_name": "puckpedia",
-    "contract_stats_prefix": "players/advanced_stats/advanced_stats.csv",
-    "advanced_stats_prefix": "merged_data/skaters/merged_data.csv",
-    "advanced_stats_bucket_name": "money-puck-data",
-    "save_to_s3_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
-    "save_to_s3_bucket_name": "contract-stats-merged-data"
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "puckpedia",
+        "contract_stats_prefix": "players/advanced_stats/advanced_stats.csv",
+        "advanced_stats_prefix": "merged_data/skaters/merged_data.csv",
+        "advanced_stats_bucket_name": "money-puck-data",
+        "save_to_s3_prefix": "players/merged_data/merged_data_advanced_contracts.csv",
+        "save_to_s3_bucket_name": "contract-stats-merged-data"
+    }
 
-print(lambda_handler(event, None))
\ No newline at end of file
+    print(lambda_handler(event, None))
@@ -1,21 +1,16 @@
-import boto3
 import pandas as pd
-import json
 import os
 import sys
-import logging
 import requests
 import re
-import time
-from io import StringIO
 import tqdm 
+from o2k_io import read_s3_object, read_table, write_table, fetch_frames
+from o2k_contracts import CONTRACT_TABLES, join_contract_tables, get_table_key
+
 
 def get_goalie_stats(bucket_name, prefix):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix)
         return {
             "statusCode": 200,
             "message": "Goalie stats retrieved successfully",
@@ -28,12 +23,9 @@ def get_goalie_stats(bucket_name, prefix):
             "body": f"Could not retrieve goalie stats: {e}"
         }
     
-def get_contracts(bucket_name, prefix):
+def get_contracts(bucket_name, prefix, seasons=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, seasons=seasons)
         return {
             "statusCode": 200,
             "message": "Contracts retrieved successfully",
@@ -45,6 +37,23 @@ def get_contracts(bucket_name, prefix):
             "message": "Could not retrieve contracts",
             "body": f"Could not retrieve contracts: {e}"
         }
+
+
+def get_normalized_contracts(bucket_name, prefix):
+    # prefix is the normalized/ folder, e.g. players/current_contracts/normalized/
+    try:
+        tables = fetch_frames({name: (read_s3_object, bucket_name, f"{prefix}{name}.csv", pd.read_csv) for name in CONTRACT_TABLES})
+        return {
+            "statusCode": 200,
+            "message": "Contracts retrieved successfully",
+            "body": join_contract_tables(tables['players'], tables['contracts'], tables['contract_years'])
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve contracts",
+            "body": f"Could not retrieve contracts: {e}"
+        }
     
 def merge_goalie_stats_contracts(goalie_stats, contracts):
     try:
@@ -63,17 +72,14 @@ def merge_goalie_stats_contracts(goalie_stats, contracts):
             "body": f"Could not merge goalie stats and contracts: {e}"
         }
     
-def save_to_s3(data, bucket_name, prefix):      
+def save_to_s3(data, bucket_name, prefix, storage_format="csv", seasons=None):      
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        path = f"{prefix}goalie_stats_contracts.csv"
-        csv_buffer = StringIO()
-        data.to_csv(csv_buffer, index=False)
-        s3.put_object(Bucket=bucket_name, Key=path, Body=csv_buffer.getvalue())
+        changed = write_table(data, bucket_name, get_table_key(prefix, "goalie_stats_contracts", storage_format), seasons)
         return {
             "statusCode": 200,
             "message": "Saved to S3",
-            "body": "Saved to S3"
+            "body": "Saved to S3",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -83,27 +89,60 @@ def save_to_s3(data, bucket_name, prefix):
         }
 
 
+def get_all_contracts(event):
+    if 'canonical_contracts_prefix' in event:
+        # Built once by build_canonical_contracts: concatenated, deduplicated, integer seasons
+        return get_contracts(event['contracts_bucket_name'], event['canonical_contracts_prefix'], event.get('seasons'))
+
+    # "normalized" reads the players / contracts / contract_years tables and joins them here
+    get_snapshot = get_normalized_contracts if event.get('contracts_mode', 'wide') == 'normalized' else get_contracts
+    snapshots = fetch_frames({
+        "current": (get_snapshot, event['contracts_bucket_name'], event['player_current_contracts_prefix']),
+        "historical": (get_snapshot, event['contracts_bucket_name'], event['player_historical_contracts_prefix'])
+    })
+    current_contracts = snapshots['current']
+    historical_contracts = snapshots['historical']
+    for contracts in (current_contracts, historical_contracts):
+        if contracts['statusCode'] != 200:
+            return contracts
+    merged_contracts = pd.concat([current_contracts['body'], historical_contracts['body']])
+    merged_contracts['season'] = merged_contracts['season'].astype(str).str.replace('-', '', regex=False).astype(int)
+    return {
+        "statusCode": 200,
+        "message": "Contracts retrieved successfully",
+        "body": merged_contracts
+    }
 
 def lambda_handler(event, context):
     try:
-        goalie_stats = get_goalie_stats(event['bucket_name'], event['goalie_stats_prefix'])
+        # seasons refreshes just those seasons, which only makes sense when the other seasons live in their own folders
+        if 'seasons' in event and event.get('storage_format') != 'partitioned':
+            return {
+                "statusCode": 404,
+                "message": "seasons needs a partitioned output",
+                "body": "seasons needs storage_format partitioned, otherwise the other seasons would be overwritten"
+            }
+        inputs = fetch_frames({
+            "goalie_stats": (get_goalie_stats, event['bucket_name'], event['goalie_stats_prefix']),
+            "contracts": (get_all_contracts, event)
+        })
+        goalie_stats = inputs['goalie_stats']
         if goalie_stats['statusCode'] == 200:
-            current_contracts = get_contracts(event['contracts_bucket_name'], event['player_current_contracts_prefix'])
-            historical_contracts = get_contracts(event['contracts_bucket_name'], event['player_historical_contracts_prefix'])
-            if current_contracts['statusCode'] == 200 and historical_contracts['statusCode'] == 200:
-                current_contracts = current_contracts['body']
-                historical_contracts = historical_contracts['body']
-                merged_contracts = pd.concat([current_contracts, historical_contracts])
-                merged_contracts['season'] = merged_contracts['season'].astype(str).str.replace('-', '', regex=False).astype(int)
+            contracts = inputs['contracts']
+            if contracts['statusCode'] == 200:
+                merged_contracts = contracts['body']
+                if 'seasons' in event:
+                    merged_contracts = merged_contracts[merged_contracts['season'].isin(event['seasons'])]
                 
                 merged_stats = merge_goalie_stats_contracts(goalie_stats['body'], merged_contracts)
                 if merged_stats['statusCode'] == 200:   
-                    save_to_s3_response = save_to_s3(merged_stats['body'], event['merged_stats_bucket_name'], event['merged_stats_prefix'])
+                    save_to_s3_response = save_to_s3(merged_stats['body'], event['merged_stats_bucket_name'], event['merged_stats_prefix'], event.get('storage_format', 'csv'), event.get('seasons'))
                     if save_to_s3_response['statusCode'] == 200:
                         return {
                             "statusCode": 200,
                             "message": "Merge goalie stats contracts",
-                            "body": "Merge goalie stats contracts"
+                            "body": "Merge goalie stats contracts",
+                            "changed": save_to_s3_response['changed']
                         }
                     else:
                         return {
@@ -137,14 +176,15 @@ def lambda_handler(event, context):
         }
         
         
-event = {
-    "bucket_name": "nhlapi-data",
-    "goalie_stats_prefix": "players/player_stats/goalie_stats.csv",
-    "merged_stats_prefix": "players/merged_data/merged_goalie_stats_contracts.csv",
-    "merged_stats_bucket_name": "puckpedia",
-    "contracts_bucket_name": "puckpedia",
-    "player_current_contracts_prefix": "players/current_contracts/current_contracts.csv",
-    "player_historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
-}
+if __name__ == "__main__":
+    event = {
+        "bucket_name": "nhlapi-data",
+        "goalie_stats_prefix": "players/player_stats/goalie_stats.csv",
+        "merged_stats_prefix": "players/merged_data/merged_goalie_stats_contracts.csv",
+        "merged_stats_bucket_name": "puckpedia",
+        "contracts_bucket_name": "puckpedia",
+        "player_current_contracts_prefix": "players/current_contracts/current_contracts.csv",
+        "player_historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
+    }
 
-print(lambda_handler(event, None))
\ No newline at end of file
+    print(lambda_handler(event, None))
@@ -1,15 +1,12 @@
-import boto3
 import pandas as pd
-from io import StringIO
+from o2k_io import read_s3_object, read_table, write_table, fetch_frames
+from o2k_contracts import CONTRACT_TABLES, join_contract_tables, get_table_key
 
 
 def get_player_stats_from_s3(bucket_name, prefix):
 
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix)
         return {
             "statusCode": 200,
             "message": "Player stats retrieved successfully",
@@ -23,12 +20,9 @@ def get_player_stats_from_s3(bucket_name, prefix):
         }
     
     
-def get_player_contracts_from_s3(bucket_name, prefix):
+def get_player_contracts_from_s3(bucket_name, prefix, seasons=None):
     try:
-        s3 = boto3.client("s3", region_name="us-east-2")
-        response = s3.get_object(Bucket=bucket_name, Key=prefix)
-        data = response['Body'].read().decode('utf-8')
-        data = pd.read_csv(StringIO(data))
+        data = read_table(bucket_name, prefix, seasons=seasons)
         return {
             "statusCode": 200,
             "message": "Player contracts retrieved successfully",
@@ -40,18 +34,32 @@ def get_player_contracts_from_s3(bucket_name, prefix):
             "message": "Could not retrieve player contracts",
             "body": f"Could not retrieve player contracts: {e}"
         }
+
+
+def get_normalized_player_contracts_from_s3(bucket_name, prefix):
+    # prefix is the normalized/ folder, e.g. players/current_contracts/normalized/
+    try:
+        tables = fetch_frames({name: (read_s3_object, bucket_name, f"{prefix}{name}.csv", pd.read_csv) for name in CONTRACT_TABLES})
+        return {
+            "statusCode": 200,
+            "message": "Player contracts retrieved successfully",
+            "body": join_contract_tables(tables['players'], tables['contracts'], tables['contract_years'])
+        }
+    except Exception as e:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve player contracts",
+            "body": f"Could not retrieve player contracts: {e}"
+        }
     
-def save_csv_to_s3(data, bucket_name, prefix):
+def save_csv_to_s3(data, bucket_name, prefix, storage_format="csv", seasons=None):
     try:
-        path = f"{prefix}merged_data.csv"
-        s3 = boto3.client("s3", region_name="us-east-2")
-        csv_buffer = StringIO()
-        data.to_csv(csv_buffer, index=False)
-        s3.put_object(Bucket=bucket_name, Key=path, Body=csv_buffer.getvalue())
+        changed = write_table(data, bucket_name, get_table_key(prefix, "merged_data", storage_format), seasons)
         return {
             "statusCode": 200,
             "message": "Merged data saved to S3",
-            "body": "Merged data saved to S3"
+            "body": "Merged data saved to S3",
+            "changed": changed
         }
     except Exception as e:
         return {
@@ -62,44 +70,86 @@ def save_csv_to_s3(data, bucket_name, prefix):
         
 
 
+def get_all_player_contracts(event):
+    if 'canonical_contracts_prefix' in event:
+        # Built once by build_canonical_contracts: concatenated, deduplicated, integer seasons
+        canonical_contracts = get_player_contracts_from_s3(event['player_contracts_bucket_name'], event['canonical_contracts_prefix'], event.get('seasons'))
+        if canonical_contracts['statusCode'] != 200:
+            return {
+                "statusCode": 404,
+                "message": "Could not retrieve canonical player contracts",
+                "body": "Could not retrieve canonical player contracts"
+            }
+        return canonical_contracts
+
+    # "normalized" reads the players / contracts / contract_years tables and joins them here
+    if event.get('contracts_mode', 'wide') == 'normalized':
+        get_contracts = get_normalized_player_contracts_from_s3
+    else:
+        get_contracts = get_player_contracts_from_s3
+    player_contracts = fetch_frames({
+        "current": (get_contracts, event['player_contracts_bucket_name'], event['player_current_contracts_prefix']),
+        "historical": (get_contracts, event['player_contracts_bucket_name'], event['player_historical_contracts_prefix'])
+    })
+    current_player_contracts = player_contracts['current']
+    if current_player_contracts['statusCode'] != 200:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve current player contracts",
+            "body": "Could not retrieve current player contracts"
+        }
+    current_player_contracts['body']['season'] = current_player_contracts['body']['season'].astype(str).str.replace('-', '', regex=False).astype(int)
+    historical_player_contracts = player_contracts['historical']
+    if historical_player_contracts['statusCode'] != 200:
+        return {
+            "statusCode": 404,
+            "message": "Could not retrieve historical player contracts",
+            "body": "Could not retrieve historical player contracts"
+        }
+    historical_player_contracts['body']['season'] = historical_player_contracts['body']['season'].astype(str).str.replace('-', '', regex=False).astype(int)
+    return {
+        "statusCode": 200,
+        "message": "Player contracts retrieved successfully",
+        "body": pd.concat([current_player_contracts['body'], historical_player_contracts['body']])
+    }
+
 def lambda_handler(event, context):
     try:
-        player_stats = get_player_stats_from_s3(event['player_stats_bucket_name'], event['player_stats_prefix'])
+        # seasons refreshes just those seasons, which only makes sense when the other seasons live in their own folders
+        if 'seasons' in event and event.get('storage_format') != 'partitioned':
+            return {
+                "statusCode": 404,
+                "message": "seasons needs a partitioned output",
+                "body": "seasons needs storage_format partitioned, otherwise the other seasons would be overwritten"
+            }
+        inputs = fetch_frames({
+            "player_stats": (get_player_stats_from_s3, event['player_stats_bucket_name'], event['player_stats_prefix']),
+            "player_contracts": (get_all_player_contracts, event)
+        })
+        player_stats = inputs['player_stats']
         if player_stats['statusCode'] == 200:
-            current_player_contracts = get_player_contracts_from_s3(event['player_contracts_bucket_name'], event['player_current_contracts_prefix'])
-            if current_player_contracts['statusCode'] == 200:
-                current_player_contracts['body']['season'] = current_player_contracts['body']['season'].astype(str).str.replace('-', '', regex=False).astype(int)
-                historical_player_contracts = get_player_contracts_from_s3(event['player_contracts_bucket_name'], event['player_historical_contracts_prefix'])
-                if historical_player_contracts['statusCode'] == 200:
-                    historical_player_contracts['body']['season'] = historical_player_contracts['body']['season'].astype(str).str.replace('-', '', regex=False).astype(int)
-                    player_contracts = pd.concat([current_player_contracts['body'], historical_player_contracts['body']])
-                    merged_data = pd.merge(player_stats['body'], player_contracts, left_on=['playerId', 'seasonId'], right_on=['nhl_id', 'season'], how='inner')
-                    save_csv_to_s3_response = save_csv_to_s3(merged_data, event['merged_data_bucket_name'], event['merged_data_prefix'])
-                    
-                    if save_csv_to_s3_response['statusCode'] == 200:
-                        return {
-                            "statusCode": 200,
-                            "message": "Stats and contracts merged successfully",
-                            "body": "Stats and contracts merged successfully"
-                        }
-                    else:
-                        return {
-                            "statusCode": 404,
-                            "message": "Could not save merged data to S3",
-                            "body": "Could not save merged data to S3"
-                        }
+            player_contracts = inputs['player_contracts']
+            if player_contracts['statusCode'] == 200:
+                if 'seasons' in event:
+                    player_contracts['body'] = player_contracts['body'][player_contracts['body']['season'].isin(event['seasons'])]
+                merged_data = pd.merge(player_stats['body'], player_contracts['body'], left_on=['playerId', 'seasonId'], right_on=['nhl_id', 'season'], how='inner')
+                save_csv_to_s3_response = save_csv_to_s3(merged_data, event['merged_data_bucket_name'], event['merged_data_prefix'], event.get('storage_format', 'csv'), event.get('seasons'))
+                
+                if save_csv_to_s3_response['statusCode'] == 200:
+                    return {
+                        "statusCode": 200,
+                        "message": "Stats and contracts merged successfully",
+                        "body": "Stats and contracts merged successfully",
+                        "changed": save_csv_to_s3_response['changed']
+                    }
                 else:
                     return {
                         "statusCode": 404,
-                        "message": "Could not retrieve historical player contracts",
-                        "body": "Could not retrieve historical player contracts"
+                        "message": "Could not save merged data to S3",
+                        "body": "Could not save merged data to S3"
                     }
             else:
-                return {
-                    "statusCode": 404,
-                    "message": "Could not retrieve current player contracts",
-                    "body": "Could not retrieve current player contracts"
-                }
+                return player_contracts
         else:
             return {
                 "statusCode": 404,
@@ -115,17 +165,15 @@ def lambda_handler(event, context):
         }
 
 
+if __name__ == "__main__":
+    event = {
+        "player_stats_bucket_name": "nhlapi-data",
+        "player_stats_prefix": "players/player_stats/player_stats.csv",
+        "player_contracts_bucket_name": "puckpedia",
+        "player_current_contracts_prefix": "players/current_contracts/current_contracts.csv",
+        "player_historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
+        "merged_data_bucket_name": "puckpedia",
+        "merged_data_prefix": "players/merged_data/"
+    }
 
-
-
-event = {
-    "player_stats_bucket_name": "nhlapi-data",
-    "player_stats_prefix": "players/player_stats/player_stats.csv",
-    "player_contracts_bucket_name": "puckpedia",
-    "player_current_contracts_prefix": "players/current_contracts/current_contracts.csv",
-    "player_historical_contracts_prefix": "players/historical_contracts/historical_contracts.csv",
-    "merged_data_bucket_name": "puckpedia",
-    "merged_data_prefix": "players/merged_data/"
-}
-
-print(lambda_handler(event, None))
\ No newline at end of file
+    print(lambda_handler(event, None))
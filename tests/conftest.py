@@ -0,0 +1,37 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas")
+# deploy.yml ships lambdas/shared in every layer; locally it has to be on the path
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, "shared"))
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+
+def load_lambda(path):
+    # Every function is called lambda_function.py, so each one is loaded under a name built from its folder
+    name = path.replace("/", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDAS_DIR, path, "lambda_function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def s3():
+    moto = pytest.importorskip("moto")
+    import boto3
+    import o2k_io
+
+    with moto.mock_aws():
+        # The shared client is created lazily, so a fresh one is bound to the mock
+        o2k_io.s3_client = None
+        client = boto3.client("s3", region_name="us-east-2")
+        client.create_bucket(Bucket="o2k-test", CreateBucketConfiguration={"LocationConstraint": "us-east-2"})
+        yield client
+        o2k_io.s3_client = None
@@ -0,0 +1,16 @@
+import pandas as pd
+
+from conftest import load_lambda
+
+
+def test_derived_contract_id_does_not_depend_on_the_id_dtype():
+    canonical = load_lambda("PuckPedia/build_canonical_contracts")
+    current = pd.DataFrame({"nhl_id": [8478402], "signing_date": ["2020-07-01"], "season": ["2023-24"], "cap_hit": [1000000]})
+    # A missing nhl_id elsewhere in the snapshot turns the column into float
+    historical = pd.DataFrame({"nhl_id": [8478402.0, None], "signing_date": ["2020-07-01", "2019-07-01"], "season": ["2023-24", "2019-20"], "cap_hit": [1000000, 500000]})
+
+    # Each snapshot is paired with an empty copy of itself so the concat keeps its dtypes
+    from_int = canonical.build_canonical_contracts(current, current.iloc[:0])
+    from_float = canonical.build_canonical_contracts(historical, historical.iloc[:0])
+    assert from_int['statusCode'] == 200 and from_float['statusCode'] == 200
+    assert from_int['body']['contract_id'].tolist() == from_float['body']['contract_id'].tolist()
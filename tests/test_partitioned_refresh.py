@@ -0,0 +1,68 @@
+import pandas as pd
+
+from conftest import load_lambda
+
+BUCKET = "o2k-test"
+
+
+def put_csv(s3, key, data):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=data.to_csv(index=False))
+
+
+def list_seasons(s3, prefix):
+    keys = [item['Key'] for item in s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix).get('Contents', [])]
+    return sorted({key[len(prefix):].split('/')[0] for key in keys})
+
+
+def put_inputs(s3):
+    stats = pd.DataFrame({
+        "playerId": [8478402, 8478402, 8471214],
+        "seasonId": [20222023, 20232024, 20232024],
+        "goals": [64, 32, 31]
+    })
+    contracts = pd.DataFrame({
+        "nhl_id": [8478402, 8478402, 8471214],
+        "season": [20222023, 20232024, 20232024],
+        "contract_id": [1, 1, 2],
+        "value": [100000000, 100000000, 38000000]
+    })
+    put_csv(s3, "stats/stats.csv", stats)
+    put_csv(s3, "canonical/contracts.csv", contracts)
+
+
+def test_player_merge_seasons_refresh_keeps_other_seasons(s3):
+    put_inputs(s3)
+    merge = load_lambda("utilities/merge_player_stats_contracts")
+    event = {
+        "player_stats_bucket_name": BUCKET,
+        "player_stats_prefix": "stats/stats.csv",
+        "player_contracts_bucket_name": BUCKET,
+        "canonical_contracts_prefix": "canonical/contracts.csv",
+        "merged_data_bucket_name": BUCKET,
+        "merged_data_prefix": "merged/",
+        "storage_format": "partitioned"
+    }
+    assert merge.lambda_handler(event, None)['statusCode'] == 200
+    assert list_seasons(s3, "merged/merged_data/") == ["season=20222023", "season=20232024"]
+
+    assert merge.lambda_handler({**event, "seasons": [20232024]}, None)['statusCode'] == 200
+    assert list_seasons(s3, "merged/merged_data/") == ["season=20222023", "season=20232024"]
+
+
+def test_goalie_merge_seasons_refresh_keeps_other_seasons(s3):
+    put_inputs(s3)
+    merge = load_lambda("utilities/merge_goalie_stats_contracts")
+    event = {
+        "bucket_name": BUCKET,
+        "goalie_stats_prefix": "stats/stats.csv",
+        "contracts_bucket_name": BUCKET,
+        "canonical_contracts_prefix": "canonical/contracts.csv",
+        "merged_stats_bucket_name": BUCKET,
+        "merged_stats_prefix": "merged/",
+        "storage_format": "partitioned"
+    }
+    assert merge.lambda_handler(event, None)['statusCode'] == 200
+    assert list_seasons(s3, "merged/goalie_stats_contracts/") == ["season=20222023", "season=20232024"]
+
+    assert merge.lambda_handler({**event, "seasons": [20232024]}, None)['statusCode'] == 200
+    assert list_seasons(s3, "merged/goalie_stats_contracts/") == ["season=20222023", "season=20232024"]
@@ -0,0 +1,65 @@
+import json
+import re
+from io import BytesIO
+from types import SimpleNamespace
+
+import o2k_collectors
+import o2k_io
+
+from conftest import load_lambda
+
+BUCKET = "o2k-test"
+
+
+def test_shard_ids_without_ids():
+    driver = load_lambda("NHLAPI/shard_collection")
+    assert driver.shard_ids([], 4) == []
+    assert driver.shard_ids([1, 2, 3], 2) == [[1, 2], [3]]
+
+
+def fake_nhl_api(url, session=None, headers=None, **kwargs):
+    player_id = int(re.search(r"playerId=(\d+)", url).group(1))
+    data = [{"playerId": player_id, "seasonId": 20232024, "goals": player_id % 50}] if player_id % 3 else []
+    return SimpleNamespace(status_code=200, ok=True, headers={}, content=json.dumps({"data": data, "total": len(data)}).encode())
+
+
+class FakeLambdaClient:
+    # Runs each Event invoke in-process; the collector re-invokes itself through the same client
+    def __init__(self, handler):
+        self.handler = handler
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        assert InvocationType == "Event"
+        self.invocations.append(FunctionName)
+        context = SimpleNamespace(invoked_function_arn=FunctionName, get_remaining_time_in_millis=lambda: 0)
+        self.handler(json.loads(Payload), context)
+        return {"StatusCode": 202, "Payload": BytesIO(b"")}
+
+
+def test_lambda_backend_runs_workers_asynchronously(s3, monkeypatch):
+    collector = load_lambda("NHLAPI/collect_player_stats_local")
+    monkeypatch.setattr(o2k_io, "rate_limited_get", fake_nhl_api)
+    lambda_client = FakeLambdaClient(collector.lambda_handler)
+    monkeypatch.setattr(o2k_collectors, "lambda_client", lambda_client)
+    driver = load_lambda("NHLAPI/shard_collection")
+
+    event = {
+        "collector": "player_stats",
+        "backend": "lambda",
+        "nhl_ids": list(range(1, 13)),
+        "shard_count": 3,
+        "output_bucket_name": BUCKET,
+        "output_prefix": "stats/",
+        "worker_event": {"checkpoint_batch_size": 2}
+    }
+    started = driver.lambda_handler(event, None)
+    assert started['statusCode'] == 202
+    # Every shard of 4 ids checkpoints after each batch of 2, so it takes one re-invocation to finish
+    assert len(lambda_client.invocations) == 6
+
+    finished = driver.lambda_handler({**event, "continuation_token": started['continuation_token']}, None)
+    assert finished['statusCode'] == 200
+    merged = s3.get_object(Bucket=BUCKET, Key="stats/player_stats.csv")['Body'].read().decode()
+    assert [int(line.split(',')[0]) for line in merged.splitlines()[1:]] == [1, 2, 4, 5, 7, 8, 10, 11]
+    assert not s3.list_objects_v2(Bucket=BUCKET, Prefix="stats/shards/").get('KeyCount')
@@ -0,0 +1,19 @@
+import pandas as pd
+
+import o2k_collectors
+
+BUCKET = "o2k-test"
+
+
+def test_sink_widens_an_integer_column_for_fractional_values(s3):
+    state = o2k_collectors.new_checkpoint_state([1, 2, 3])
+    sink = o2k_collectors.new_stats_sink(state, BUCKET, "stats/", flush_rows=2)
+    assert o2k_collectors.sink_append(sink, pd.DataFrame({"playerId": [1], "gamesPlayed": [82]}))['statusCode'] == 200
+    # Fills the first part, written with gamesPlayed as Int64
+    assert o2k_collectors.sink_append(sink, pd.DataFrame({"playerId": [2], "gamesPlayed": [None]}))['statusCode'] == 200
+    assert o2k_collectors.sink_append(sink, pd.DataFrame({"playerId": [3], "gamesPlayed": [40.5]}))['statusCode'] == 200
+    assert state['dtypes'] == {"playerId": "Int64", "gamesPlayed": "float64"}
+
+    assert o2k_collectors.publish_stats_sink(sink, BUCKET, "stats/player_stats.csv")['statusCode'] == 200
+    merged = s3.get_object(Bucket=BUCKET, Key="stats/player_stats.csv")['Body'].read().decode()
+    assert merged.splitlines() == ["playerId,gamesPlayed", "1,82", "2,", "3,40.5"]